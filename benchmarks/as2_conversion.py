@@ -0,0 +1,89 @@
+"""Compare JSON-LD <-> RDF conversion throughput of the pyld and fast paths.
+
+Usage: python -m benchmarks.as2_conversion [count]
+"""
+
+import sys
+import time
+from typing import Any, Callable
+
+import rdflib
+
+from firm_ld.as2 import as2_to_graph, graph_to_as2
+from firm_ld.jsonld_utils import jsonld_to_graph, subject_to_jsonld
+
+STORE_CONTEXT = [
+    "https://www.w3.org/ns/activitystreams",
+    "https://w3c-ccg.github.io/security-vocab/contexts/security-v1.jsonld",
+    {"firm": "https://firm.stevebate.dev#"},
+]
+
+
+def make_activity(n: int) -> dict[str, Any]:
+    actor = f"https://server.test/actors/{n % 100}"
+    return {
+        "@context": STORE_CONTEXT,
+        "id": f"https://server.test/activities/{n}",
+        "type": "Create",
+        "actor": actor,
+        "to": ["https://www.w3.org/ns/activitystreams#Public"],
+        "cc": [f"{actor}/followers"],
+        "published": "2024-01-01T00:00:00Z",
+        "object": {
+            "id": f"https://server.test/notes/{n}",
+            "type": "Note",
+            "attributedTo": actor,
+            "content": f"Note number {n}",
+            "contentMap": {"en": f"Note number {n}"},
+            "tag": [{"type": "Mention", "href": actor, "name": "@actor"}],
+        },
+    }
+
+
+def measure(
+    label: str, convert: Callable[[dict[str, Any]], rdflib.Graph], docs: list
+) -> None:
+    convert(docs[0])  # warm up caches
+    start = time.perf_counter()
+    triples = 0
+    for doc in docs:
+        triples += len(convert(doc))
+    elapsed = time.perf_counter() - start
+    print(
+        f"{label:>8}: {len(docs) / elapsed:10.0f} objects/sec "
+        f"({triples / elapsed:10.0f} triples/sec)"
+    )
+
+
+def measure_reads(
+    label: str,
+    serialize: Callable[[rdflib.Graph, str], dict[str, Any] | None],
+    g: rdflib.Graph,
+    uris: list[str],
+) -> None:
+    serialize(g, uris[0])  # warm up caches
+    start = time.perf_counter()
+    for uri in uris:
+        serialize(g, uri)
+    elapsed = time.perf_counter() - start
+    print(f"{label:>8}: {len(uris) / elapsed:10.0f} objects/sec")
+
+
+def main() -> None:
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    docs = [make_activity(n) for n in range(count)]
+    print("JSON-LD -> RDF")
+    measure("pyld", jsonld_to_graph, docs)
+    measure("fast", as2_to_graph, docs)
+
+    g = rdflib.Graph()
+    for doc in docs:
+        g += as2_to_graph(doc)
+    uris = [doc["id"] for doc in docs]
+    print("RDF -> JSON-LD")
+    measure_reads("pyld", subject_to_jsonld, g, uris)
+    measure_reads("fast", graph_to_as2, g, uris)
+
+
+if __name__ == "__main__":
+    main()
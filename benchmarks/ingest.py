@@ -0,0 +1,34 @@
+"""Measure bulk ingestion throughput against the number of worker processes.
+
+Usage: python -m benchmarks.ingest [count] [workers...]
+"""
+
+import json
+import os
+import sys
+
+import rdflib
+
+from benchmarks.as2_conversion import make_activity
+from firm_ld.as2 import as2_to_graph
+from firm_ld.ingest import ingest
+
+
+def main() -> None:
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    if len(sys.argv) > 2:
+        worker_counts = [int(arg) for arg in sys.argv[2:]]
+    else:
+        cpus = os.cpu_count() or 1
+        worker_counts = sorted({0, 1, 2, 4, cpus} - {n for n in (2, 4) if n > cpus})
+    lines = [json.dumps(make_activity(n)) for n in range(count)]
+    for workers in worker_counts:
+        stats = ingest(lines, rdflib.Graph(), converter=as2_to_graph, workers=workers)
+        print(
+            f"{workers:>3} workers: {stats.rate:10.0f} objects/sec "
+            f"({stats.triples / stats.elapsed:10.0f} triples/sec)"
+        )
+
+
+if __name__ == "__main__":
+    main()
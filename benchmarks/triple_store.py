@@ -0,0 +1,118 @@
+"""Compare the memory use and lookup latency of the Memory and Compact stores.
+
+Each store is loaded in a fresh process so the memory measurements don't
+interfere. Memory is the growth of the resident set while loading.
+
+Usage: python -m benchmarks.triple_store [count...] (default: 1M and 10M)
+"""
+
+import multiprocessing
+import random
+import sys
+import time
+from typing import Iterator
+
+import rdflib
+
+from firm_ld.triple_store import CompactStore
+
+EX = rdflib.Namespace("https://server.test/")
+AS2 = rdflib.Namespace("https://www.w3.org/ns/activitystreams#")
+
+PREDICATES = [
+    rdflib.RDF.type,
+    AS2.attributedTo,
+    AS2.content,
+    AS2.published,
+    AS2.inReplyTo,
+    AS2.to,
+    AS2.cc,
+    AS2.tag,
+    AS2.name,
+    AS2.url,
+]
+
+LOOKUPS = 2000
+
+
+def make_triples(count: int) -> Iterator[tuple]:
+    """About ten triples per note, with shared actors and types."""
+    for n in range(count):
+        note, field = divmod(n, len(PREDICATES))
+        subject = EX[f"notes/{note}"]
+        predicate = PREDICATES[field]
+        if field == 0:
+            obj = AS2.Note
+        elif field in (1, 5, 6):
+            obj = EX[f"actors/{note % 1000}"]
+        elif field == 4:
+            obj = EX[f"notes/{note // 2}"]
+        else:
+            obj = rdflib.Literal(f"Value {note} {field}")
+        yield subject, predicate, obj
+
+
+def _rss() -> int:
+    with open("/proc/self/statm") as f:
+        return int(f.read().split()[1]) * 4096
+
+
+def _measure(store_name: str, count: int, results: multiprocessing.Queue) -> None:
+    store = CompactStore() if store_name == "Compact" else store_name
+    before = _rss()
+    start = time.perf_counter()
+    graph = rdflib.Graph(store=store)
+    graph.addN((s, p, o, graph) for s, p, o in make_triples(count))
+    if isinstance(graph.store, CompactStore):
+        graph.store.compact()
+    load = time.perf_counter() - start
+    memory = _rss() - before
+
+    rng = random.Random(1)
+    notes = count // len(PREDICATES)
+    patterns = {
+        "s ? ?": [(EX[f"notes/{rng.randrange(notes)}"], None, None)] * LOOKUPS,
+        "s p ?": [
+            (EX[f"notes/{rng.randrange(notes)}"], AS2.content, None)
+            for _ in range(LOOKUPS)
+        ],
+        "? p o": [
+            (None, AS2.attributedTo, EX[f"actors/{rng.randrange(1000)}"])
+            for _ in range(LOOKUPS // 100)
+        ],
+        "? ? o": [(None, None, EX[f"notes/{rng.randrange(notes)}"])] * LOOKUPS,
+    }
+    latencies = {}
+    for label, lookups in patterns.items():
+        start = time.perf_counter()
+        for pattern in lookups:
+            for _ in graph.triples(pattern):
+                pass
+        latencies[label] = (time.perf_counter() - start) / len(lookups) * 1e6
+    results.put((load, memory, latencies))
+
+
+def main() -> None:
+    counts = [int(arg) for arg in sys.argv[1:]] or [1_000_000, 10_000_000]
+    context = multiprocessing.get_context("spawn")
+    for count in counts:
+        print(f"{count:,} triples")
+        for store_name in ("Memory", "Compact"):
+            results = context.Queue()
+            process = context.Process(
+                target=_measure, args=(store_name, count, results)
+            )
+            process.start()
+            load, memory, latencies = results.get()
+            process.join()
+            lookups = "  ".join(
+                f"{label}: {latency:8.1f}us" for label, latency in latencies.items()
+            )
+            print(
+                f"{store_name:>8}: {memory / count:6.0f} bytes/triple, "
+                f"load {load:6.1f}s  {lookups}"
+            )
+
+
+if __name__ == "__main__":
+    main()
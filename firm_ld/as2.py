@@ -0,0 +1,442 @@
+"""Fast-path conversion between compacted ActivityStreams JSON-LD and RDF.
+
+Almost every document we handle uses the stock ActivityStreams (plus
+security) context. Rather than running the generic JSON-LD algorithms for
+each document, the context is compiled once into a term table that maps
+terms directly to IRIs and type coercions (and a reverse map for going back
+to compacted JSON). Documents using anything the tables can't represent
+faithfully are handed to the generic pyld path.
+"""
+
+import logging
+from dataclasses import dataclass, field
+from typing import Any
+
+import rdflib
+from pyld import jsonld
+
+from firm_ld.cache import LRUCache
+from firm_ld.jsonld_utils import (
+    JSONLD_COMPACTION_CONTEXT,
+    context_cache,
+    context_fingerprint,
+    jsonld_to_graph,
+    literal_to_jsonld,
+    node_to_python,
+    subject_to_jsonld,
+)
+from firm_ld.ordered import inline_items, is_ordered_list
+
+log = logging.getLogger(__name__)
+
+
+class UnsupportedDocument(Exception):
+    """The document needs the generic pyld conversion path."""
+
+
+@dataclass(frozen=True)
+class Term:
+    iri: str
+    coercion: str | None = None
+    container: str | None = None
+
+
+@dataclass
+class TermTable:
+    """A precompiled JSON-LD context."""
+
+    terms: dict[str, Term] = field(default_factory=dict)
+    prefixes: dict[str, str] = field(default_factory=dict)
+    vocab: str | None = None
+    id_aliases: set[str] = field(default_factory=lambda: {"@id"})
+    type_aliases: set[str] = field(default_factory=lambda: {"@type"})
+    unsupported: set[str] = field(default_factory=set)
+
+    def _expand_compact_iri(self, value: str) -> str | None:
+        prefix, _, suffix = value.partition(":")
+        if prefix == "_":
+            raise UnsupportedDocument(f"Blank node identifier: {value}")
+        if suffix.startswith("//"):
+            return value
+        if prefix in self.prefixes:
+            return self.prefixes[prefix] + suffix
+        if prefix in self.terms or prefix in self.unsupported:
+            raise UnsupportedDocument(f"Ambiguous compact IRI: {value}")
+        return value
+
+    def expand_vocab(self, value: str) -> str:
+        """Expand a property name or type value."""
+        if value in self.unsupported:
+            raise UnsupportedDocument(f"Unsupported term: {value}")
+        if term := self.terms.get(value):
+            return term.iri
+        if ":" in value:
+            if iri := self._expand_compact_iri(value):
+                return iri
+        if self.vocab and not self.vocab.startswith("_:"):
+            return self.vocab + value
+        raise UnsupportedDocument(f"Unknown term: {value}")
+
+    def expand_id(self, value: str) -> str:
+        """Expand a node identifier or @id-coerced value."""
+        if ":" in value:
+            if iri := self._expand_compact_iri(value):
+                return iri
+        raise UnsupportedDocument(f"Relative IRI: {value}")
+
+    def property(self, key: str) -> Term:
+        if key in self.unsupported:
+            raise UnsupportedDocument(f"Unsupported term: {key}")
+        if term := self.terms.get(key):
+            return term
+        return Term(self.expand_vocab(key))
+
+
+def compile_context(context: Any) -> TermTable:
+    """Compile a JSON-LD context into a term table."""
+    active_ctx = context_cache.active_context(context)
+    table = TermTable(vocab=active_ctx.get("@vocab"))
+    for name, mapping in active_ctx["mappings"].items():
+        if mapping is None:
+            table.unsupported.add(name)
+            continue
+        iri = mapping.get("@id")
+        if iri == "@id":
+            table.id_aliases.add(name)
+            continue
+        if iri == "@type":
+            table.type_aliases.add(name)
+            continue
+        containers = [c for c in mapping.get("@container", []) if c != "@set"]
+        if (
+            iri is None
+            or iri.startswith("@")
+            or mapping.get("reverse")
+            or "@context" in mapping
+            or "@nest" in mapping
+            or len(containers) > 1
+            or mapping.get("@type") == "@vocab"
+        ):
+            table.unsupported.add(name)
+            continue
+        if mapping.get("_prefix"):
+            table.prefixes[name] = iri
+        table.terms[name] = Term(
+            iri,
+            coercion=mapping.get("@type"),
+            container=containers[0] if containers else None,
+        )
+    return table
+
+
+_term_tables: LRUCache[str, TermTable] = LRUCache(16)
+
+
+def term_table(context: Any) -> TermTable:
+    key = context_fingerprint(context)
+    if (table := _term_tables.get(key)) is None:
+        table = compile_context(context)
+        _term_tables.put(key, table)
+    return table
+
+
+def _as_list(value: Any) -> list[Any]:
+    return value if isinstance(value, list) else [value]
+
+
+class _GraphBuilder:
+    def __init__(self, table: TermTable, graph: rdflib.Graph):
+        self.table = table
+        self.graph = graph
+
+    def insert_resource(self, resource: dict[str, Any]) -> rdflib.term.Node:
+        table = self.table
+        subject: rdflib.term.Node | None = None
+        for key in resource:
+            if key in table.id_aliases:
+                if not isinstance(resource[key], str):
+                    raise UnsupportedDocument("Invalid @id")
+                subject = rdflib.URIRef(table.expand_id(resource[key]))
+        if subject is None:
+            subject = rdflib.BNode()
+        for key, value in resource.items():
+            if value is None or key in table.id_aliases:
+                continue
+            if key in table.type_aliases:
+                for type_ in _as_list(value):
+                    if not isinstance(type_, str):
+                        raise UnsupportedDocument("Invalid @type")
+                    self.graph.add(
+                        (
+                            subject,
+                            rdflib.RDF.type,
+                            rdflib.URIRef(table.expand_vocab(type_)),
+                        )
+                    )
+                continue
+            if key.startswith("@"):
+                raise UnsupportedDocument(f"Unsupported keyword: {key}")
+            term = table.property(key)
+            predicate = rdflib.URIRef(term.iri)
+            for obj in self._objects(term, value):
+                self.graph.add((subject, predicate, obj))
+        return subject
+
+    def _objects(self, term: Term, value: Any) -> list[rdflib.term.Node]:
+        if term.container == "@language":
+            if not isinstance(value, dict):
+                raise UnsupportedDocument("Invalid language map")
+            literals = []
+            for item in value.values():
+                for text in _as_list(item):
+                    if text is None:
+                        continue
+                    if not isinstance(text, str):
+                        raise UnsupportedDocument("Invalid language map value")
+                    literals.append(rdflib.Literal(text))
+            return literals
+        if term.container is not None:
+            raise UnsupportedDocument(f"Unsupported container: {term.container}")
+        objects: list[rdflib.term.Node] = []
+        for item in _as_list(value):
+            if item is None:
+                continue
+            if isinstance(item, dict):
+                objects.append(self._node(item))
+            elif isinstance(item, list):
+                raise UnsupportedDocument("Nested array")
+            elif isinstance(item, str) and term.coercion == "@id":
+                objects.append(rdflib.URIRef(self.table.expand_id(item)))
+            else:
+                objects.append(rdflib.Literal(item))
+        return objects
+
+    def _node(self, item: dict[str, Any]) -> rdflib.term.Node:
+        keys = [k for k, v in item.items() if v is not None and v != []]
+        for key in keys:
+            if key.startswith("@") and key not in ("@id", "@type"):
+                raise UnsupportedDocument(f"Unsupported keyword: {key}")
+        if len(keys) == 1:
+            if keys[0] in self.table.id_aliases:
+                return rdflib.URIRef(self.table.expand_id(item[keys[0]]))
+            # The generic path can't represent single-property nodes
+            raise UnsupportedDocument("Single property node")
+        return self.insert_resource(item)
+
+
+def fast_as2_to_graph(doc: dict[str, Any]) -> rdflib.Graph:
+    """Convert a compacted document using only the precompiled term table.
+
+    Raises UnsupportedDocument if the document needs the generic path.
+    """
+    if not isinstance(doc, dict) or "@context" not in doc:
+        raise UnsupportedDocument("Missing @context")
+    table = term_table(doc["@context"])
+    resource = {k: v for k, v in doc.items() if k != "@context"}
+    g = rdflib.Graph()
+    _GraphBuilder(table, g).insert_resource(resource)
+    return g
+
+
+def as2_to_graph(doc: dict[str, Any]) -> rdflib.Graph:
+    """A drop-in replacement for jsonld_to_graph with a fast path for AS2."""
+    try:
+        return fast_as2_to_graph(doc)
+    except UnsupportedDocument as ex:
+        log.debug("Using generic JSON-LD conversion: %s", ex)
+        return jsonld_to_graph(doc)
+
+
+class ReverseTermMap:
+    """Maps IRIs back to compact terms for a compaction context.
+
+    Term selection depends on the IRI and the shape of the value (node
+    reference, datatype, language), so selections are computed with pyld's
+    own rules the first time each combination is seen and memoized.
+    """
+
+    def __init__(self, context: Any):
+        self.context = context
+        self.active_ctx = context_cache.active_context(context)
+        self.supported = not any(
+            mapping is not None and "@context" in mapping
+            for mapping in self.active_ctx["mappings"].values()
+        )
+        self._processor = jsonld.JsonLdProcessor()
+        self._options = {"base": "", "compactArrays": True, "link": False}
+        self._terms: dict[tuple, str] = {}
+        self._iris: LRUCache[tuple[str, bool], str] = LRUCache(8192)
+        # IRIs that can't be compacted to a CURIE are returned unchanged
+        mappings = self.active_ctx["mappings"]
+        self._curie_candidates = tuple(
+            definition["@id"]
+            for term, definition in mappings.items()
+            if ":" not in term and definition and definition.get("@id")
+        ) + tuple(
+            f"{term}:"
+            for term, definition in mappings.items()
+            if definition and definition.get("_prefix")
+        )
+        self.id_key = self.compact_iri("@id", vocab=True)
+        self.type_key = self.compact_iri("@type", vocab=True)
+
+    def compact_iri(self, iri: str, vocab: bool = False) -> str:
+        if not vocab and not iri.startswith(self._curie_candidates):
+            if "@base" not in self.active_ctx:
+                return iri
+        key = (iri, vocab)
+        if (term := self._iris.get(key)) is None:
+            term = self._processor._compact_iri(
+                self.active_ctx, iri, vocab=vocab, base=""
+            )
+            self._iris.put(key, term)
+        return term
+
+    def term(self, iri: str, shape: tuple, value: dict[str, Any]) -> str:
+        key = (iri, shape)
+        if (term := self._terms.get(key)) is None:
+            term = self._processor._compact_iri(
+                self.active_ctx, iri, value=value, vocab=True
+            )
+            self._terms[key] = term
+        return term
+
+    def container(self, term: str) -> list[str]:
+        mapping = self.active_ctx["mappings"].get(term) or {}
+        return mapping.get("@container", [])
+
+    def compact_value(self, term: str, value: dict[str, Any]) -> Any:
+        mapping = self.active_ctx["mappings"].get(term)
+        if "@id" in value and mapping is not None:
+            type_ = mapping.get("@type")
+            compacted = self.compact_iri(value["@id"], vocab=type_ == "@vocab")
+            if type_ in ("@id", "@vocab"):
+                return compacted
+            return {self.id_key: compacted}
+        if (
+            len(value) == 1
+            and mapping is not None
+            and "@type" not in mapping
+            and "@language" not in mapping
+            and "@language" not in self.active_ctx
+        ):
+            return value["@value"]
+        return self._processor._compact_value(
+            self.active_ctx, term, value, self._options
+        )
+
+
+_reverse_term_maps: LRUCache[str, ReverseTermMap] = LRUCache(16)
+
+
+def reverse_term_map(context: Any) -> ReverseTermMap:
+    key = context_fingerprint(context)
+    if (term_map := _reverse_term_maps.get(key)) is None:
+        term_map = ReverseTermMap(context)
+        _reverse_term_maps.put(key, term_map)
+    return term_map
+
+
+class _DocumentBuilder:
+    def __init__(self, term_map: ReverseTermMap, graph: rdflib.Graph):
+        self.term_map = term_map
+        self.graph = graph
+        self.visited: set[rdflib.term.Node] = set()
+
+    def node(self, subject: rdflib.term.Node) -> dict[str, Any]:
+        term_map = self.term_map
+        self.visited.add(subject)
+        types: list[str] = []
+        values: dict[str, list[Any]] = {}
+        language_maps: dict[str, dict[str, Any]] = {}
+        for p, o in sorted(self.graph.predicate_objects(subject), key=_by_predicate):
+            if p == rdflib.RDF.type:
+                types.append(term_map.compact_iri(str(o), vocab=True))
+                continue
+            iri = str(p)
+            if is_ordered_list(self.graph, o):
+                # Large lists are read by pages (see RdfResourceStore.items)
+                if (items := inline_items(self.graph, o)) is not None:
+                    term, compacted = self.ordered_list(iri, items)
+                    values.setdefault(term, []).extend(compacted)
+                continue
+            if isinstance(o, rdflib.BNode) and o not in self.visited:
+                term = term_map.term(iri, ("@node",), {})
+                values.setdefault(term, []).append(self.node(o))
+                continue
+            if isinstance(o, rdflib.Literal):
+                value = literal_to_jsonld(o)
+                shape: tuple = (
+                    "@value",
+                    value.get("@type"),
+                    value.get("@language"),
+                    isinstance(value["@value"], str),
+                )
+            else:
+                value = node_to_python(o)
+                vocab_term = term_map.compact_iri(value["@id"], vocab=True)
+                mapping = term_map.active_ctx["mappings"].get(vocab_term)
+                shape = ("@id", bool(mapping and mapping.get("@id") == value["@id"]))
+            term = term_map.term(iri, shape, value)
+            if "@language" in term_map.container(term):
+                language_map = language_maps.setdefault(term, {})
+                language_map.setdefault(value["@language"], []).append(value["@value"])
+                values.setdefault(term, [])
+            else:
+                values.setdefault(term, []).append(term_map.compact_value(term, value))
+
+        doc: dict[str, Any] = {}
+        if not isinstance(subject, rdflib.BNode):
+            doc[term_map.id_key] = term_map.compact_iri(str(subject))
+        if types:
+            doc[term_map.type_key] = types[0] if len(types) == 1 else types
+        for term, items in values.items():
+            if term in language_maps:
+                doc[term] = {
+                    lang: texts[0] if len(texts) == 1 else texts
+                    for lang, texts in language_maps[term].items()
+                }
+            elif len(items) == 1 and not (
+                {"@set", "@list"} & set(term_map.container(term))
+            ):
+                doc[term] = items[0]
+            else:
+                doc[term] = items
+        return doc
+
+    def ordered_list(
+        self, iri: str, items: list[rdflib.term.Node]
+    ) -> tuple[str, list[Any]]:
+        expanded = [node_to_python(item) for item in items]
+        term = self.term_map.term(iri, ("@list",), {"@list": expanded})
+        return term, [
+            (
+                self.node(item)
+                if isinstance(item, rdflib.BNode)
+                else self.term_map.compact_value(term, value)
+            )
+            for item, value in zip(items, expanded)
+        ]
+
+
+def _by_predicate(po: tuple[rdflib.term.Node, rdflib.term.Node]) -> str:
+    return str(po[0])
+
+
+def graph_to_as2(
+    g: rdflib.Graph, uri: str, context: Any = JSONLD_COMPACTION_CONTEXT
+) -> dict[str, Any] | None:
+    """A drop-in replacement for subject_to_jsonld that compacts directly.
+
+    Uses a reverse term map instead of building an expanded document and
+    running pyld compaction.
+    """
+    subject = rdflib.URIRef(uri)
+    if (subject, None, None) not in g:
+        return None
+    term_map = reverse_term_map(context)
+    if not term_map.supported:
+        return subject_to_jsonld(g, uri)
+    doc = {"@context": term_map.context["@context"]}
+    doc.update(_DocumentBuilder(term_map, g).node(subject))
+    return doc
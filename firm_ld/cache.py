@@ -0,0 +1,291 @@
+import json
+import re
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import (
+    Any,
+    Callable,
+    Generic,
+    Hashable,
+    Iterable,
+    Mapping,
+    Protocol,
+    TypeVar,
+)
+
+from rdflib.plugins.sparql import prepareQuery
+from rdflib.plugins.sparql.sparql import Query
+from rdflib.query import Result
+
+K = TypeVar("K", bound=Hashable)
+V = TypeVar("V")
+
+_MISSING = object()
+
+
+class Invalidatable(Protocol):
+    """Anything that must be told when stored resources change."""
+
+    def invalidate(self, subjects: Iterable[str] | None = None) -> None: ...
+
+
+@dataclass
+class CacheStats:
+    hits: int
+    misses: int
+    evictions: int
+    size: int
+    maxsize: int
+    bytes: int = 0
+
+    @property
+    def hit_ratio(self) -> float:
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+
+class LRUCache(Generic[K, V]):
+    """A thread-safe, bounded LRU mapping with optional time-to-live expiry."""
+
+    def __init__(
+        self,
+        maxsize: int = 128,
+        ttl: float | None = None,
+        timer: Callable[[], float] = time.monotonic,
+        on_evict: Callable[[K, V], None] | None = None,
+    ):
+        if maxsize < 1:
+            raise ValueError("maxsize must be positive")
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._timer = timer
+        self._on_evict = on_evict
+        self._entries: OrderedDict[K, tuple[V, float | None]] = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key: K, default: V | None = None) -> V | None:
+        with self._lock:
+            entry = self._entries.get(key, _MISSING)
+            if entry is not _MISSING:
+                value, expires = entry  # type: ignore
+                if expires is None or expires > self._timer():
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self._entries[key]
+            self.misses += 1
+            return default
+
+    def put(self, key: K, value: V) -> None:
+        expires = self._timer() + self.ttl if self.ttl is not None else None
+        with self._lock:
+            self._entries[key] = (value, expires)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                evicted_key, (evicted, _) = self._entries.popitem(last=False)
+                self.evictions += 1
+                if self._on_evict:
+                    self._on_evict(evicted_key, evicted)
+
+    def pop(self, key: K, default: V | None = None) -> V | None:
+        with self._lock:
+            entry = self._entries.pop(key, _MISSING)
+            return default if entry is _MISSING else entry[0]  # type: ignore
+
+    def invalidate(self, key: K) -> bool:
+        with self._lock:
+            return self._entries.pop(key, _MISSING) is not _MISSING
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def keys(self) -> list[K]:
+        with self._lock:
+            return list(self._entries)
+
+    def stats(self) -> CacheStats:
+        return CacheStats(
+            hits=self.hits,
+            misses=self.misses,
+            evictions=self.evictions,
+            size=len(self._entries),
+            maxsize=self.maxsize,
+        )
+
+    def __contains__(self, key: object) -> bool:
+        return key in self._entries
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+class ObjectCache:
+    """A bounded cache of compacted JSON objects keyed by URI.
+
+    Objects are stored serialized so every reader gets a private copy and
+    the memory footprint can be tracked. Each entry records the other
+    subjects (blank nodes) in its closure so that a change to any of them
+    invalidates the entry too.
+    """
+
+    def __init__(self, maxsize: int = 1024):
+        self._lock = threading.RLock()
+        self._entries: LRUCache[str, tuple[str, frozenset[str]]] = LRUCache(
+            maxsize, on_evict=self._forget
+        )
+        self._dependents: dict[str, set[str]] = {}
+        self.bytes = 0
+        # Incremented on every invalidation to detect stale read-through puts
+        self.generation = 0
+
+    def get(self, uri: str) -> dict[str, Any] | None:
+        entry = self._entries.get(uri)
+        return json.loads(entry[0]) if entry else None
+
+    def put(
+        self,
+        uri: str,
+        obj: dict[str, Any],
+        dependencies: Iterable[str] = (),
+        generation: int | None = None,
+    ) -> None:
+        data = json.dumps(obj)
+        with self._lock:
+            if generation is not None and generation != self.generation:
+                return
+            if (old := self._entries.pop(uri)) is not None:
+                self._forget(uri, old)
+            entry = (data, frozenset(dependencies))
+            self.bytes += len(data)
+            for dependency in entry[1]:
+                self._dependents.setdefault(dependency, set()).add(uri)
+            self._entries.put(uri, entry)
+
+    def _forget(self, uri: str, entry: tuple[str, frozenset[str]]) -> None:
+        self.bytes -= len(entry[0])
+        for dependency in entry[1]:
+            if dependents := self._dependents.get(dependency):
+                dependents.discard(uri)
+                if not dependents:
+                    del self._dependents[dependency]
+
+    def invalidate(self, subjects: Iterable[str] | None = None) -> None:
+        """Drop the entries for (or depending on) subjects, or everything."""
+        with self._lock:
+            self.generation += 1
+            if subjects is None:
+                self._entries.clear()
+                self._dependents.clear()
+                self.bytes = 0
+                return
+            for subject in subjects:
+                for uri in [subject, *self._dependents.get(subject, ())]:
+                    if (entry := self._entries.pop(uri)) is not None:
+                        self._forget(uri, entry)
+
+    def stats(self) -> CacheStats:
+        stats = self._entries.stats()
+        stats.bytes = self.bytes
+        return stats
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+# Strings and IRIs are kept as they are. Comments and whitespace runs are
+# replaced by a single space.
+_QUERY_TOKENS = re.compile(
+    r'("""[\s\S]*?"""'
+    r"|'''[\s\S]*?'''"
+    r'|"(?:[^"\\\n]|\\.)*"'
+    r"|'(?:[^'\\\n]|\\.)*'"
+    r'|<[^<>"{}|^`\\\s]*>)'
+    r"|((?:#[^\n]*|\s+)+)"
+)
+
+# Results of queries using these functions (or remote services) can't be
+# reused
+_VOLATILE = re.compile(r"\b(?:NOW|RAND|UUID|STRUUID|BNODE)\s*\(|\bSERVICE\b", re.I)
+
+
+def normalize_query(text: str) -> str:
+    """The query text without insignificant whitespace or comments."""
+    return _QUERY_TOKENS.sub(
+        lambda m: m.group(1) if m.group(1) is not None else " ", text
+    ).strip()
+
+
+def _freeze(mapping: Mapping[str, Any] | None) -> tuple[tuple[str, Any], ...]:
+    # The values (namespaces or terms) are hashable
+    return tuple(sorted((str(k), v) for k, v in (mapping or {}).items()))
+
+
+class QueryCache:
+    """Caches prepared SPARQL queries and their results.
+
+    Prepared queries are keyed by the normalized query text and namespaces.
+    Results are also keyed by the initial bindings and are reused until the
+    write generation changes. It's bumped by invalidate, which is called by
+    RdfDataSet.notify_write for SPARQL updates and store writes.
+    """
+
+    def __init__(self, maxsize: int = 256, plans: int = 512):
+        self._plans: LRUCache[Hashable, Query] = LRUCache(plans)
+        self._results: LRUCache[Hashable, tuple[int, Result]] = LRUCache(maxsize)
+        self._lock = threading.Lock()
+        self.generation = 0
+
+    def prepare(self, text: str, init_ns: Mapping[str, Any] | None = None) -> Query:
+        key = (normalize_query(text), _freeze(init_ns))
+        if (prepared := self._plans.get(key)) is None:
+            prepared = prepareQuery(text, initNs=init_ns)
+            self._plans.put(key, prepared)
+        return prepared
+
+    def query(
+        self,
+        text: str,
+        evaluate: Callable[[Query], Result],
+        init_ns: Mapping[str, Any] | None = None,
+        init_bindings: Mapping[str, Any] | None = None,
+        prepared: Query | None = None,
+        scope: Hashable = None,
+    ) -> Result:
+        """The cached result of the query, or the result of evaluate.
+
+        The query text is prepared unless it's already been (prepared).
+        Results evaluated differently (e.g., by another query processor)
+        are kept apart by their scope.
+        """
+        normalized = normalize_query(text)
+        if _VOLATILE.search(normalized):
+            return evaluate(prepared or self.prepare(text, init_ns))
+        key = (normalized, _freeze(init_ns), _freeze(init_bindings), scope)
+        generation = self.generation
+        entry = self._results.get(key)
+        if entry is not None and entry[0] == generation:
+            return entry[1]
+        result = evaluate(prepared or self.prepare(text, init_ns))
+        if result.type == "SELECT":
+            # The bindings are produced lazily. Reading them all makes the
+            # result reusable.
+            result.bindings = list(result.bindings)
+        with self._lock:
+            if generation == self.generation:
+                self._results.put(key, (generation, result))
+        return result
+
+    def invalidate(self, subjects: Iterable[str] | None = None) -> None:
+        """Drop every cached result (any write can change any result)."""
+        with self._lock:
+            self.generation += 1
+            self._results.clear()
+
+    def stats(self) -> dict[str, CacheStats]:
+        return {"plans": self._plans.stats(), "results": self._results.stats()}
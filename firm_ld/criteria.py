@@ -0,0 +1,282 @@
+"""Evaluation of store query criteria as direct triple-pattern lookups."""
+
+import datetime
+import heapq
+import itertools
+from dataclasses import dataclass
+from decimal import Decimal
+from typing import Any, Iterable
+
+import rdflib
+
+from firm_ld.as2 import TermTable, UnsupportedDocument, term_table
+from firm_ld.cache import LRUCache
+from firm_ld.index import PropertyIndex
+from firm_ld.jsonld_utils import context_cache, context_fingerprint
+
+CRITERIA_CONTEXT = [
+    "https://www.w3.org/ns/activitystreams",
+    "https://w3c-ccg.github.io/security-vocab/contexts/security-v1.jsonld",
+    {"firm": "https://firm.stevebate.dev#"},
+]
+
+# Matches counted per pattern when choosing the evaluation order
+SELECTIVITY_SAMPLE = 1000
+
+Pattern = tuple[rdflib.URIRef, rdflib.term.Node]
+
+
+@dataclass(frozen=True)
+class _KeyPlan:
+    key: str
+    predicate: rdflib.URIRef | None  # None for the subject (id) key
+    coercion: str | None = None
+    is_type: bool = False
+
+
+@dataclass(frozen=True)
+class CriteriaPlan:
+    """A compiled criteria shape. Values are bound when it's evaluated."""
+
+    keys: tuple[_KeyPlan, ...]
+    table: TermTable | None
+
+    def bind(self, criteria: dict[str, Any]) -> tuple[str | None, list[Pattern]]:
+        if self.table is None:
+            return _bind_expanded(criteria)
+        subject: str | None = None
+        patterns: list[Pattern] = []
+        for key_plan in self.keys:
+            for value in _as_list(criteria[key_plan.key]):
+                if isinstance(value, dict):
+                    if set(value) - self.table.id_aliases:
+                        return _bind_expanded(criteria)
+                    value = next(iter(value.values()))
+                    coercion = "@id"
+                else:
+                    coercion = key_plan.coercion
+                if key_plan.predicate is None:
+                    subject = self.table.expand_id(value)
+                elif key_plan.is_type:
+                    patterns.append(
+                        (
+                            key_plan.predicate,
+                            rdflib.URIRef(self.table.expand_vocab(value)),
+                        )
+                    )
+                elif coercion == "@id" and isinstance(value, str):
+                    patterns.append(
+                        (key_plan.predicate, rdflib.URIRef(self.table.expand_id(value)))
+                    )
+                else:
+                    patterns.append((key_plan.predicate, rdflib.Literal(value)))
+        return subject, patterns
+
+
+def _as_list(value: Any) -> list[Any]:
+    return value if isinstance(value, list) else [value]
+
+
+def _bind_expanded(criteria: dict[str, Any]) -> tuple[str | None, list[Pattern]]:
+    """Bind criteria using generic JSON-LD expansion."""
+    subject: str | None = None
+    patterns: list[Pattern] = []
+    for resource in context_cache.expand(criteria, CRITERIA_CONTEXT):
+        for key, values in resource.items():
+            if key == "@id":
+                subject = values
+            elif key == "@type":
+                patterns.extend((rdflib.RDF.type, rdflib.URIRef(t)) for t in values)
+            else:
+                for value in values:
+                    if "@id" in value:
+                        obj: rdflib.term.Node = rdflib.URIRef(value["@id"])
+                    elif "@value" in value:
+                        obj = rdflib.Literal(value["@value"])
+                    else:
+                        raise ValueError(f"Unsupported criteria value for {key}")
+                    patterns.append((rdflib.URIRef(key), obj))
+    return subject, patterns
+
+
+def _compile(criteria: dict[str, Any]) -> CriteriaPlan:
+    context = criteria.get("@context", CRITERIA_CONTEXT)
+    try:
+        table = term_table(context)
+        keys: list[_KeyPlan] = []
+        for key in sorted(criteria):
+            if key == "@context":
+                continue
+            if key in table.id_aliases:
+                keys.append(_KeyPlan(key, None))
+            elif key in table.type_aliases:
+                keys.append(_KeyPlan(key, rdflib.RDF.type, is_type=True))
+            elif key.startswith("@"):
+                raise UnsupportedDocument(f"Unsupported keyword: {key}")
+            else:
+                term = table.property(key)
+                if term.container is not None:
+                    raise UnsupportedDocument(f"Unsupported container: {key}")
+                keys.append(_KeyPlan(key, rdflib.URIRef(term.iri), term.coercion))
+        return CriteriaPlan(tuple(keys), table)
+    except UnsupportedDocument:
+        return CriteriaPlan((), None)
+
+
+_plans: LRUCache[tuple, CriteriaPlan] = LRUCache(256)
+
+
+def compile_criteria(criteria: dict[str, Any]) -> CriteriaPlan:
+    """Compile criteria, reusing the plan for criteria with the same shape."""
+    shape = (
+        context_fingerprint(criteria.get("@context")),
+        tuple(sorted(criteria)),
+    )
+    if (plan := _plans.get(shape)) is None:
+        plan = _compile(criteria)
+        _plans.put(shape, plan)
+    return plan
+
+
+def _estimate(graph: rdflib.Graph, pattern: Pattern) -> int:
+    predicate, obj = pattern
+    matches = graph.triples((None, predicate, obj))
+    return sum(1 for _ in itertools.islice(matches, SELECTIVITY_SAMPLE))
+
+
+def expand_property(term: str) -> rdflib.URIRef:
+    """Expand a property term (or compact IRI) using the criteria context."""
+    table = term_table(CRITERIA_CONTEXT)
+    if term in table.type_aliases:
+        return rdflib.RDF.type
+    return rdflib.URIRef(table.property(term).iri)
+
+
+def _order_predicate(order_by: str) -> rdflib.URIRef | None:
+    if order_by in term_table(CRITERIA_CONTEXT).id_aliases:
+        return None
+    try:
+        return expand_property(order_by)
+    except UnsupportedDocument as ex:
+        raise ValueError(f"Unknown order_by property: {order_by}") from ex
+
+
+def _sort_value(value: rdflib.term.Node) -> Any:
+    if isinstance(value, rdflib.Literal):
+        python_value = value.toPython()
+        if isinstance(python_value, datetime.datetime):
+            if python_value.tzinfo is None:
+                python_value = python_value.replace(tzinfo=datetime.timezone.utc)
+            return (0, python_value)
+        if isinstance(python_value, (int, float, Decimal)) and not isinstance(
+            python_value, bool
+        ):
+            return (1, python_value)
+    return (2, str(value))
+
+
+def order_subjects(
+    graph: rdflib.Graph,
+    subjects: Iterable[str],
+    order_by: str | None = None,
+    descending: bool = False,
+    after: str | None = None,
+    offset: int = 0,
+    limit: int | None = None,
+) -> list[str]:
+    """Sort and page subject URIs.
+
+    Subjects are ordered by the value of the order_by property (then by
+    URI, so the order is total). Subjects without a value sort last in
+    either direction. The after cursor is the URI of the last subject of the
+    previous page; the page continues from where that subject sorts.
+    """
+    predicate = _order_predicate(order_by) if order_by else None
+    # Sorted in reverse when descending, so missing values rank lowest then
+    missing = -1 if descending else 1
+
+    def sort_key(uri: str) -> tuple:
+        if predicate is not None:
+            value = graph.value(rdflib.URIRef(uri), predicate)
+            if value is not None:
+                return (0, _sort_value(value), uri)
+        return (missing, (), uri)
+
+    keyed: Iterable[tuple] = ((sort_key(uri), uri) for uri in subjects)
+    if after is not None:
+        cursor = sort_key(after)
+        keyed = [
+            item
+            for item in keyed
+            if (item[0] < cursor if descending else item[0] > cursor)
+        ]
+    if limit is None:
+        ordered = sorted(keyed, reverse=descending)[offset:]
+    else:
+        select = heapq.nlargest if descending else heapq.nsmallest
+        ordered = select(offset + limit, keyed)[offset:]
+    return [uri for _, uri in ordered]
+
+
+def match_subjects(
+    graph: rdflib.Graph,
+    criteria: dict[str, Any],
+    order_by: str | None = None,
+    descending: bool = False,
+    after: str | None = None,
+    offset: int = 0,
+    limit: int | None = None,
+    index: PropertyIndex | None = None,
+) -> list[str]:
+    """The URIs of subjects matching all the criteria.
+
+    Evaluation starts from the most selective pattern and checks the
+    remaining patterns for each candidate, so the cost depends on the
+    number of candidates rather than the size of the graph. Patterns
+    covered by the index are answered from it. Results are ordered by URI
+    unless order_by is given (see order_subjects).
+    """
+    subject, patterns = compile_criteria(criteria).bind(criteria)
+    indexed: dict[Pattern, set[rdflib.term.Node]] = {}
+    if index is not None:
+        for pattern in patterns:
+            if (subjects := index.subjects(*pattern)) is not None:
+                indexed[pattern] = subjects
+    candidates: set[rdflib.term.Node]
+    if subject is not None:
+        if (rdflib.URIRef(subject), None, None) not in graph:
+            return []
+        candidates = {rdflib.URIRef(subject)}
+    elif patterns:
+        if len(patterns) > 1:
+            patterns.sort(
+                key=lambda pattern: (
+                    len(indexed[pattern])
+                    if pattern in indexed
+                    else _estimate(graph, pattern)
+                )
+            )
+        pattern = patterns.pop(0)
+        if pattern in indexed:
+            candidates = indexed[pattern]
+        else:
+            candidates = set(graph.subjects(*pattern))
+    else:
+        return []
+    for pattern in patterns:
+        if not candidates:
+            break
+        if pattern in indexed:
+            candidates &= indexed[pattern]
+        else:
+            predicate, obj = pattern
+            candidates = {s for s in candidates if (s, predicate, obj) in graph}
+    return order_subjects(
+        graph,
+        (str(s) for s in candidates if not isinstance(s, rdflib.BNode)),
+        order_by,
+        descending,
+        after,
+        offset,
+        limit,
+    )
@@ -0,0 +1,147 @@
+from collections import defaultdict
+from dataclasses import dataclass, field
+from typing import Any
+
+import rdflib
+
+from firm_ld.jsonld_utils import blank_node_closure
+from firm_ld.ordered import LIST, is_ordered_list
+
+
+@dataclass
+class Delta:
+    """The triples added to and removed from a graph by a write."""
+
+    added: rdflib.Graph = field(default_factory=rdflib.Graph)
+    removed: rdflib.Graph = field(default_factory=rdflib.Graph)
+    # The owners of the lists whose entries changed. Entries only point to
+    # their list, so the owners have no triples in the delta.
+    owners: set[rdflib.term.Node] = field(default_factory=set)
+
+    @property
+    def subjects(self) -> set[rdflib.term.Node]:
+        return set(self.added.subjects()) | set(self.removed.subjects()) | self.owners
+
+    def __bool__(self) -> bool:
+        return len(self.added) > 0 or len(self.removed) > 0
+
+
+def _blank_node_keys(g: rdflib.Graph) -> dict[rdflib.BNode, tuple]:
+    """Structural keys for the blank nodes in a graph.
+
+    Two blank nodes have the same key if their subtrees are identical,
+    regardless of the blank node labels used inside them.
+    """
+    keys: dict[rdflib.BNode, tuple] = {}
+
+    def term_key(o: rdflib.term.Node, visiting: set[rdflib.BNode]) -> tuple:
+        if isinstance(o, rdflib.BNode):
+            return ("b", node_key(o, visiting))
+        if isinstance(o, rdflib.Literal):
+            return ("l", str(o), str(o.datatype or ""), o.language or "")
+        return ("u", str(o))
+
+    def node_key(node: rdflib.BNode, visiting: set[rdflib.BNode]) -> tuple:
+        if node in keys:
+            return keys[node]
+        if node in visiting:
+            return ("cycle",)
+        visiting.add(node)
+        key = tuple(
+            sorted(
+                (str(p), term_key(o, visiting)) for p, o in g.predicate_objects(node)
+            )
+        )
+        visiting.discard(node)
+        keys[node] = key
+        return key
+
+    for node in g.all_nodes():
+        if isinstance(node, rdflib.BNode):
+            node_key(node, set())
+    return keys
+
+
+def _closure_graph(g: rdflib.Graph, subjects: set[rdflib.term.Node]) -> rdflib.Graph:
+    closure = rdflib.Graph()
+    pending = list(subjects)
+    visited: set[rdflib.term.Node] = set()
+    while pending:
+        subject = pending.pop()
+        for node in [subject, *blank_node_closure(g, subject)]:
+            if node in visited:
+                continue
+            visited.add(node)
+            for p, o in g.predicate_objects(node):
+                closure.add((node, p, o))
+            # List entries point to the list, so they're outside the closure
+            if is_ordered_list(g, node):
+                pending.extend(g.subjects(LIST, node))
+    return closure
+
+
+def compute_delta(graph: rdflib.Graph, resource: rdflib.Graph) -> Delta:
+    """Compute the changes needed to replace stored resources with new ones.
+
+    Stored blank node subtrees that are structurally identical to the new
+    ones are kept (the new triples are rewritten to use the stored blank
+    nodes) so unchanged subtrees aren't churned.
+    """
+    roots = {s for s in resource.subjects() if not isinstance(s, rdflib.BNode)}
+    stored = _closure_graph(graph, roots)
+    stored_keys = _blank_node_keys(stored)
+    new_keys = _blank_node_keys(resource)
+
+    mapping: dict[rdflib.term.Node, rdflib.term.Node] = {}
+
+    def pair(new_node: rdflib.term.Node, stored_node: rdflib.term.Node) -> None:
+        mapping[new_node] = stored_node
+        for p in set(resource.predicates(new_node)):
+            candidates: dict[tuple, list[Any]] = defaultdict(list)
+            for o in stored.objects(stored_node, p):
+                if isinstance(o, rdflib.BNode):
+                    candidates[stored_keys[o]].append(o)
+            for o in resource.objects(new_node, p):
+                if isinstance(o, rdflib.BNode) and o not in mapping:
+                    if matches := candidates.get(new_keys[o]):
+                        pair(o, matches.pop())
+
+    for root in roots:
+        pair(root, root)
+    for new_node, stored_node in list(mapping.items()):
+        if is_ordered_list(resource, new_node):
+            entries: dict[tuple, list[Any]] = defaultdict(list)
+            for entry in stored.subjects(LIST, stored_node):
+                entries[stored_keys[entry]].append(entry)
+            for entry in resource.subjects(LIST, new_node):
+                if matches := entries.get(new_keys[entry]):
+                    pair(entry, matches.pop())
+
+    rewritten = rdflib.Graph()
+    for s, p, o in resource:
+        rewritten.add((mapping.get(s, s), p, mapping.get(o, o)))
+    delta = Delta(added=rewritten - stored, removed=stored - rewritten)
+    lists = {
+        node
+        for changed in (delta.added, delta.removed)
+        for node in changed.objects(None, LIST)
+    }
+    delta.owners = {
+        owner
+        for g in (stored, rewritten)
+        for node in lists
+        for owner, p in g.subject_predicates(node)
+        if p != LIST
+    }
+    return delta
+
+
+def move_delta(graph: rdflib.Graph, resource: rdflib.Graph) -> Delta:
+    """The changes needed to move stored resources to another graph.
+
+    All the stored triples are removed and all the new ones are added.
+    """
+    roots = {s for s in resource.subjects() if not isinstance(s, rdflib.BNode)}
+    added = rdflib.Graph()
+    added += resource
+    return Delta(added=added, removed=_closure_graph(graph, roots))
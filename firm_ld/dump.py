@@ -0,0 +1,259 @@
+"""Streaming export and import of datasets as N-Quads or NDJSON.
+
+Files ending in .gz are compressed. Exports and imports write a checkpoint
+file next to the data after every chunk so an interrupted run can be
+resumed (resume=True, or --resume on the command line) instead of
+restarted. The checkpoint is removed when the run completes.
+
+Usage: python -m firm_ld.dump {export,import} [options] PATH
+"""
+
+import argparse
+import contextlib
+import gzip
+import itertools
+import json
+import logging
+import os
+from typing import Any, Callable, Iterable, Iterator, TextIO
+
+import rdflib
+from rdflib.graph import DATASET_DEFAULT_GRAPH_ID
+from rdflib.plugins.serializers.nquads import _nq_row
+from rdflib.plugins.serializers.nt import _nt_row
+from rdflib.store import VALID_STORE
+
+from firm_ld.ingest import ingest
+from firm_ld.jsonld_utils import subject_to_jsonld
+
+log = logging.getLogger(__name__)
+
+CHUNK_SIZE = 10_000
+
+
+class _BNodeLabels(dict):
+    """Keeps the blank node labels from the input.
+
+    The labels are unique (they were written by export) so they don't need
+    to be remapped, and nothing is stored per label.
+    """
+
+    def get(self, key: str, default: Any = None) -> str:
+        return key
+
+
+def _batched(items: Iterable[Any], size: int) -> Iterator[list[Any]]:
+    iterator = iter(items)
+    while batch := list(itertools.islice(iterator, size)):
+        yield batch
+
+
+def _read_checkpoint(path: str) -> dict[str, int] | None:
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+
+def _write_checkpoint(path: str, state: dict[str, int]) -> None:
+    with open(path + ".tmp", "w") as f:
+        json.dump(state, f)
+    os.replace(path + ".tmp", path)
+
+
+def _open_text(path: str) -> TextIO:
+    if path.endswith(".gz"):
+        return gzip.open(path, "rt", encoding="utf-8")
+    return open(path, encoding="utf-8")
+
+
+def _export(path: str, lines: Iterable[str], chunk_size: int, resume: bool) -> int:
+    checkpoint = path + ".export-checkpoint"
+    state = _read_checkpoint(checkpoint) if resume else None
+    written = 0
+    if state is not None:
+        # Drop anything written after the last checkpoint. Without the
+        # output, the export starts over.
+        try:
+            with open(path, "r+b") as f:
+                f.truncate(state["offset"])
+        except FileNotFoundError:
+            state = None
+        else:
+            written = state["items"]
+            lines = itertools.islice(lines, written, None)
+    with open(path, "ab" if state else "wb") as f:
+        for chunk in _batched(lines, chunk_size):
+            data = "".join(chunk).encode("utf-8")
+            if path.endswith(".gz"):
+                # Each chunk is a complete gzip member so the file can be
+                # truncated at any checkpoint
+                data = gzip.compress(data)
+            f.write(data)
+            f.flush()
+            written += len(chunk)
+            _write_checkpoint(checkpoint, {"items": written, "offset": f.tell()})
+    with contextlib.suppress(FileNotFoundError):
+        os.remove(checkpoint)
+    log.info("Exported %d items to %s", written, path)
+    return written
+
+
+def _import(
+    path: str,
+    load: Callable[[Iterable[str], Callable[[int], None]], None],
+    resume: bool,
+) -> int:
+    checkpoint = path + ".import-checkpoint"
+    state = _read_checkpoint(checkpoint) if resume else None
+    done = state["items"] if state else 0
+    imported = done
+
+    def loaded(lines: int) -> None:
+        nonlocal imported
+        imported = done + lines
+        _write_checkpoint(checkpoint, {"items": imported})
+
+    with _open_text(path) as f:
+        load(itertools.islice(f, done, None), loaded)
+    with contextlib.suppress(FileNotFoundError):
+        os.remove(checkpoint)
+    log.info("Imported %d lines from %s", imported, path)
+    return imported
+
+
+def _quad_lines(dataset: rdflib.Dataset) -> Iterator[str]:
+    for s, p, o, graph in dataset.quads((None, None, None, None)):
+        if graph is None or graph == DATASET_DEFAULT_GRAPH_ID:
+            yield _nt_row((s, p, o))
+        else:
+            yield _nq_row((s, p, o), graph)
+
+
+def export_nquads(
+    dataset: rdflib.Dataset,
+    path: str,
+    *,
+    chunk_size: int = CHUNK_SIZE,
+    resume: bool = False,
+) -> int:
+    """Write every quad in the dataset, including named graphs."""
+    return _export(path, _quad_lines(dataset), chunk_size, resume)
+
+
+def import_nquads(
+    dataset: rdflib.Dataset,
+    path: str,
+    *,
+    chunk_size: int = CHUNK_SIZE,
+    resume: bool = False,
+) -> int:
+    """Add the quads in the file to the dataset, a chunk per transaction."""
+
+    def load(lines: Iterable[str], loaded: Callable[[int], None]) -> None:
+        count = 0
+        for chunk in _batched(lines, chunk_size):
+            dataset.parse(
+                data="".join(chunk), format="nquads", bnode_context=_BNodeLabels()
+            )
+            if dataset.store.transaction_aware:
+                dataset.commit()
+            count += len(chunk)
+            loaded(count)
+
+    return _import(path, load, resume)
+
+
+def _typed_subjects(graph: rdflib.Graph) -> Iterator[rdflib.URIRef]:
+    # Subjects with several types are yielded once (for their first type)
+    # without keeping a set of every subject seen
+    for subject, resource_type in graph.subject_objects(rdflib.RDF.type):
+        if isinstance(subject, rdflib.URIRef):
+            types = list(graph.objects(subject, rdflib.RDF.type))
+            if len(types) == 1 or resource_type == min(types):
+                yield subject
+
+
+def export_ndjson(
+    graph: rdflib.Graph,
+    path: str,
+    *,
+    serializer: Callable[
+        [rdflib.Graph, str], dict[str, Any] | None
+    ] = subject_to_jsonld,
+    chunk_size: int = CHUNK_SIZE,
+    resume: bool = False,
+) -> int:
+    """Write each typed resource in the graph as a compacted JSON-LD object."""
+
+    def lines() -> Iterator[str]:
+        for subject in _typed_subjects(graph):
+            if (obj := serializer(graph, str(subject))) is not None:
+                yield json.dumps(obj) + "\n"
+
+    return _export(path, lines(), chunk_size, resume)
+
+
+def import_ndjson(
+    graph: rdflib.Graph,
+    path: str,
+    *,
+    resume: bool = False,
+    **kwargs: Any,
+) -> int:
+    """Store the objects in the file (see firm_ld.ingest.ingest for options)."""
+
+    def load(lines: Iterable[str], loaded: Callable[[int], None]) -> None:
+        stats = ingest(
+            lines, graph, progress=lambda stats: loaded(stats.lines), **kwargs
+        )
+        for error in stats.errors:
+            log.warning("Line %d not imported: %s", error.line, error.error)
+
+    return _import(path, load, resume)
+
+
+def main(argv: list[str] | None = None) -> None:
+    parser = argparse.ArgumentParser(
+        prog="python -m firm_ld.dump",
+        description="Export or import an RDF dataset as N-Quads or NDJSON.",
+    )
+    parser.add_argument("command", choices=["export", "import"])
+    parser.add_argument("path", help="data file (compressed if it ends with .gz)")
+    parser.add_argument("--store", default="Memory", help="rdflib store plugin")
+    parser.add_argument(
+        "--store-arg",
+        action="append",
+        default=[],
+        help="argument for opening the store (repeatable)",
+    )
+    parser.add_argument("--format", choices=["nquads", "ndjson"], default="nquads")
+    parser.add_argument(
+        "--graph", help="graph IRI for NDJSON (default graph if not set)"
+    )
+    parser.add_argument("--resume", action="store_true")
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO)
+
+    dataset = rdflib.Dataset(store=args.store)
+    if args.store_arg and dataset.open(*args.store_arg) != VALID_STORE:
+        raise Exception("Store open error")
+    try:
+        if args.format == "nquads":
+            if args.command == "export":
+                export_nquads(dataset, args.path, resume=args.resume)
+            else:
+                import_nquads(dataset, args.path, resume=args.resume)
+        else:
+            graph = dataset.graph(args.graph) if args.graph else dataset.default_context
+            if args.command == "export":
+                export_ndjson(graph, args.path, resume=args.resume)
+            else:
+                import_ndjson(graph, args.path, resume=args.resume)
+    finally:
+        dataset.close()
+
+
+if __name__ == "__main__":
+    main()
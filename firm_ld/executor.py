@@ -0,0 +1,174 @@
+import asyncio
+import concurrent.futures
+import contextlib
+import functools
+import threading
+import time
+from dataclasses import dataclass
+from typing import Any, Callable, Iterator, TypeVar
+
+T = TypeVar("T")
+
+
+class ReadWriteLock:
+    """Allows concurrent readers or a single writer (writers are preferred)."""
+
+    def __init__(self) -> None:
+        self._condition = threading.Condition()
+        self._readers = 0
+        self._writing = False
+        self._waiting_writers = 0
+
+    @contextlib.contextmanager
+    def read(self) -> Iterator[None]:
+        with self._condition:
+            while self._writing or self._waiting_writers:
+                self._condition.wait()
+            self._readers += 1
+        try:
+            yield
+        finally:
+            with self._condition:
+                self._readers -= 1
+                if not self._readers:
+                    self._condition.notify_all()
+
+    @contextlib.contextmanager
+    def write(self) -> Iterator[None]:
+        with self._condition:
+            self._waiting_writers += 1
+            while self._writing or self._readers:
+                self._condition.wait()
+            self._waiting_writers -= 1
+            self._writing = True
+        try:
+            yield
+        finally:
+            with self._condition:
+                self._writing = False
+                self._condition.notify_all()
+
+
+@dataclass
+class QueueStats:
+    pending: int = 0
+    running: int = 0
+    completed: int = 0
+    # Seconds spent waiting in the queue
+    wait_total: float = 0.0
+    wait_max: float = 0.0
+
+    @property
+    def wait_mean(self) -> float:
+        return self.wait_total / self.completed if self.completed else 0.0
+
+
+class _Queue:
+    def __init__(
+        self, executor: concurrent.futures.Executor, timer: Callable[[], float]
+    ):
+        self.executor = executor
+        self._timer = timer
+        self._lock = threading.Lock()
+        self.stats = QueueStats()
+
+    def _started(self, submitted: float) -> None:
+        wait = self._timer() - submitted
+        with self._lock:
+            self.stats.pending -= 1
+            self.stats.running += 1
+            self.stats.wait_total += wait
+            self.stats.wait_max = max(self.stats.wait_max, wait)
+
+    def _finished(self) -> None:
+        with self._lock:
+            self.stats.running -= 1
+            self.stats.completed += 1
+
+    def _call(self, submitted: float, fn: Callable[..., T], *args: Any) -> T:
+        self._started(submitted)
+        try:
+            return fn(*args)
+        finally:
+            self._finished()
+
+    async def run(self, fn: Callable[..., T], *args: Any) -> T:
+        with self._lock:
+            self.stats.pending += 1
+        loop = asyncio.get_running_loop()
+        if isinstance(self.executor, concurrent.futures.ProcessPoolExecutor):
+            # The bookkeeping wrapper can't be sent to another process, so
+            # the work counts as running (with no wait) from submission
+            submitted = self._timer()
+            future = loop.run_in_executor(self.executor, fn, *args)
+            self._started(submitted)
+            try:
+                return await future
+            finally:
+                self._finished()
+        return await loop.run_in_executor(
+            self.executor, functools.partial(self._call, self._timer(), fn, *args)
+        )
+
+
+class StoreExecutor:
+    """Runs blocking store work off the event loop.
+
+    Reads run concurrently on a thread pool. Writes run one at a time on a
+    single writer thread and exclude reads while they modify the graph
+    (see lock). Conversions of JSON-LD objects to graphs, which don't touch
+    the store's graph, can use a separate pool; for example, a
+    ProcessPoolExecutor for CPU-bound conversions of large batches.
+    """
+
+    def __init__(
+        self,
+        readers: int = 4,
+        converter: concurrent.futures.Executor | None = None,
+        timer: Callable[[], float] = time.monotonic,
+    ):
+        self.lock = ReadWriteLock()
+        self._reads = _Queue(
+            concurrent.futures.ThreadPoolExecutor(
+                readers, thread_name_prefix="store-reader"
+            ),
+            timer,
+        )
+        self._writes = _Queue(
+            concurrent.futures.ThreadPoolExecutor(1, thread_name_prefix="store-writer"),
+            timer,
+        )
+        self._conversions = (
+            _Queue(converter, timer) if converter is not None else self._reads
+        )
+
+    async def read(self, fn: Callable[..., T], *args: Any) -> T:
+        return await self._reads.run(self._locked, self.lock.read, fn, *args)
+
+    async def write(self, fn: Callable[..., T], *args: Any) -> T:
+        return await self._writes.run(self._locked, self.lock.write, fn, *args)
+
+    async def convert(self, fn: Callable[..., T], *args: Any) -> T:
+        return await self._conversions.run(fn, *args)
+
+    @staticmethod
+    def _locked(
+        lock: Callable[[], contextlib.AbstractContextManager],
+        fn: Callable[..., T],
+        *args: Any,
+    ) -> T:
+        with lock():
+            return fn(*args)
+
+    def stats(self) -> dict[str, QueueStats]:
+        """Queue depth and wait times for the reads, writes and conversions."""
+        stats = {"reads": self._reads.stats, "writes": self._writes.stats}
+        if self._conversions is not self._reads:
+            stats["conversions"] = self._conversions.stats
+        return {name: QueueStats(**vars(s)) for name, s in stats.items()}
+
+    def shutdown(self) -> None:
+        self._reads.executor.shutdown()
+        self._writes.executor.shutdown()
+        if self._conversions is not self._reads:
+            self._conversions.executor.shutdown()
@@ -0,0 +1,170 @@
+import asyncio
+import time
+from dataclasses import dataclass, field
+from typing import Any, Awaitable, Callable
+
+import rdflib
+
+from firm_ld.partition import resource_root
+
+
+@dataclass
+class GroupCommitStats:
+    batches: int = 0
+    operations: int = 0
+    batch_max: int = 0
+    # Seconds from queueing an operation until its batch committed
+    latency_total: float = 0.0
+    latency_max: float = 0.0
+    # Seconds since the queue was created
+    elapsed: float = 0.0
+
+    @property
+    def batch_mean(self) -> float:
+        return self.operations / self.batches if self.batches else 0.0
+
+    @property
+    def latency_mean(self) -> float:
+        return self.latency_total / self.operations if self.operations else 0.0
+
+    @property
+    def commits_per_second(self) -> float:
+        return self.batches / self.elapsed if self.elapsed else 0.0
+
+
+@dataclass
+class WriteBatch:
+    """The writes to commit in one transaction.
+
+    Like put_many, a later write of a URI replaces an earlier one.
+    """
+
+    removals: set[rdflib.term.Node] = field(default_factory=set)
+    additions: dict[Any, rdflib.Graph] = field(default_factory=dict)
+    # When each operation was queued
+    queued: list[float] = field(default_factory=list)
+    uris: set[str] = field(default_factory=set)
+    done: asyncio.Future = field(
+        default_factory=lambda: asyncio.get_running_loop().create_future()
+    )
+
+    def put(self, resource: rdflib.Graph) -> None:
+        self.removals.update(resource.subjects())
+        root = resource_root(resource)
+        self.additions[root if root is not None else id(resource)] = resource
+
+    def remove(self, uri: rdflib.URIRef) -> None:
+        self.removals.add(uri)
+        self.additions.pop(uri, None)
+
+
+class WriteQueue:
+    """Gathers concurrent writes into batches committed together (group commit).
+
+    A batch is committed when it has max_batch operations or max_delay
+    seconds after its first one, so each write waits at most about
+    max_delay for others to join it. Callers return when their batch is
+    committed. Reads of a URI with a pending write can wait for it (see
+    settle), so a write is visible to later reads even if the writer
+    didn't wait for it.
+    """
+
+    def __init__(
+        self,
+        commit: Callable[[WriteBatch], Awaitable[None]],
+        *,
+        max_batch: int = 100,
+        max_delay: float = 0.005,
+        timer: Callable[[], float] = time.monotonic,
+    ):
+        self._commit = commit
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+        self._timer = timer
+        self._created = timer()
+        self._current: WriteBatch | None = None
+        self._timeout: asyncio.TimerHandle | None = None
+        # The latest batch writing each URI
+        self._pending: dict[str, WriteBatch] = {}
+        self._tasks: set[asyncio.Future] = set()
+        self._stats = GroupCommitStats()
+
+    def _batch(self, uri: str | None) -> WriteBatch:
+        if (batch := self._current) is None:
+            batch = self._current = WriteBatch()
+            self._timeout = asyncio.get_running_loop().call_later(
+                self.max_delay, self._flush, batch
+            )
+        batch.queued.append(self._timer())
+        if uri is not None:
+            self._pending[uri] = batch
+            batch.uris.add(uri)
+        return batch
+
+    async def _join(self, batch: WriteBatch) -> None:
+        if len(batch.queued) >= self.max_batch:
+            self._flush(batch)
+        # A cancelled caller doesn't cancel the batch
+        await asyncio.shield(batch.done)
+
+    def _flush(self, batch: WriteBatch) -> None:
+        if batch is not self._current:
+            return
+        self._current = None
+        if self._timeout is not None:
+            self._timeout.cancel()
+            self._timeout = None
+        task = asyncio.ensure_future(self._run(batch))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _run(self, batch: WriteBatch) -> None:
+        try:
+            await self._commit(batch)
+        except Exception as ex:
+            batch.done.set_exception(ex)
+        else:
+            batch.done.set_result(None)
+        now = self._timer()
+        stats = self._stats
+        stats.batches += 1
+        stats.operations += len(batch.queued)
+        stats.batch_max = max(stats.batch_max, len(batch.queued))
+        for queued in batch.queued:
+            stats.latency_total += now - queued
+            stats.latency_max = max(stats.latency_max, now - queued)
+        for uri in batch.uris:
+            if self._pending.get(uri) is batch:
+                del self._pending[uri]
+
+    async def put(self, resource: rdflib.Graph) -> None:
+        root = resource_root(resource)
+        batch = self._batch(str(root) if root is not None else None)
+        batch.put(resource)
+        await self._join(batch)
+
+    async def remove(self, uri: str) -> None:
+        batch = self._batch(uri)
+        batch.remove(rdflib.URIRef(uri))
+        await self._join(batch)
+
+    async def settle(self, uri: str) -> None:
+        """Wait for a pending write of the URI (committing it now)."""
+        if (batch := self._pending.get(uri)) is None:
+            return
+        self._flush(batch)
+        # Failures are reported to the writers
+        await asyncio.wait([batch.done])
+
+    async def settle_all(self) -> None:
+        """Wait for all pending writes (committing them now)."""
+        if self._current is not None:
+            self._flush(self._current)
+        if self._tasks:
+            # Failures are reported to the writers
+            await asyncio.wait(set(self._tasks))
+
+    def stats(self) -> GroupCommitStats:
+        stats = GroupCommitStats(**vars(self._stats))
+        stats.elapsed = self._timer() - self._created
+        return stats
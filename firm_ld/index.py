@@ -0,0 +1,123 @@
+import sys
+import threading
+from dataclasses import dataclass
+from typing import Iterable
+
+import rdflib
+
+Key = tuple[rdflib.term.Node, rdflib.term.Node]
+
+
+@dataclass
+class IndexStats:
+    predicates: int
+    keys: int
+    entries: int
+    bytes: int
+    rebuilds: int
+
+
+class PropertyIndex:
+    """An in-memory (predicate, object) -> subjects index over a graph.
+
+    Only named (non-blank) subjects are indexed.
+    Predicates are IRIs, or namespaces ending in "*" to index every
+    predicate in the namespace. The index isn't updated by writes directly.
+    Changed subjects are invalidated (see RdfDataSet.notify_write) and
+    refreshed from the graph on the next lookup.
+    """
+
+    def __init__(self, graph: rdflib.Graph, predicates: Iterable[str]):
+        self.graph = graph
+        self.predicates: set[rdflib.URIRef] = set()
+        self.namespaces: list[str] = []
+        for predicate in predicates:
+            if predicate.endswith("*"):
+                self.namespaces.append(predicate[:-1])
+            else:
+                self.predicates.add(rdflib.URIRef(predicate))
+        self._lock = threading.Lock()
+        self._subjects: dict[Key, set[rdflib.term.Node]] = {}
+        self._keys: dict[rdflib.term.Node, set[Key]] = {}
+        self._dirty: set[rdflib.term.Node] = set()
+        self._stale = True
+        self.rebuilds = 0
+
+    def indexes(self, predicate: rdflib.term.Node) -> bool:
+        return predicate in self.predicates or any(
+            predicate.startswith(namespace) for namespace in self.namespaces
+        )
+
+    def invalidate(self, subjects: Iterable[str] | None = None) -> None:
+        """Mark subjects (or, if None, the whole index) as out of date."""
+        with self._lock:
+            if subjects is None:
+                self._stale = True
+                self._dirty.clear()
+            elif not self._stale:
+                self._dirty.update(rdflib.URIRef(subject) for subject in subjects)
+
+    def _add(
+        self, s: rdflib.term.Node, p: rdflib.term.Node, o: rdflib.term.Node
+    ) -> None:
+        if isinstance(s, rdflib.BNode):
+            return
+        self._subjects.setdefault((p, o), set()).add(s)
+        self._keys.setdefault(s, set()).add((p, o))
+
+    def _rebuild(self) -> None:
+        self._subjects.clear()
+        self._keys.clear()
+        if self.namespaces:
+            triples = self.graph.triples((None, None, None))
+        else:
+            triples = (
+                triple
+                for predicate in self.predicates
+                for triple in self.graph.triples((None, predicate, None))
+            )
+        for s, p, o in triples:
+            if self.indexes(p):
+                self._add(s, p, o)
+        self._stale = False
+        self.rebuilds += 1
+
+    def _refresh(self, subject: rdflib.term.Node) -> None:
+        for key in self._keys.pop(subject, ()):
+            subjects = self._subjects[key]
+            subjects.discard(subject)
+            if not subjects:
+                del self._subjects[key]
+        for p, o in self.graph.predicate_objects(subject):
+            if self.indexes(p):
+                self._add(subject, p, o)
+
+    def _sync(self) -> None:
+        if self._stale:
+            self._rebuild()
+        while self._dirty:
+            self._refresh(self._dirty.pop())
+
+    def subjects(
+        self, predicate: rdflib.term.Node, obj: rdflib.term.Node
+    ) -> set[rdflib.term.Node] | None:
+        """The subjects with the property value, or None if not indexed."""
+        if not self.indexes(predicate):
+            return None
+        with self._lock:
+            self._sync()
+            return set(self._subjects.get((predicate, obj), ()))
+
+    def stats(self) -> IndexStats:
+        with self._lock:
+            self._sync()
+            size = sys.getsizeof(self._subjects) + sys.getsizeof(self._keys)
+            size += sum(sys.getsizeof(s) for s in self._subjects.values())
+            size += sum(sys.getsizeof(k) for k in self._keys.values())
+            return IndexStats(
+                predicates=len(self.predicates) + len(self.namespaces),
+                keys=len(self._subjects),
+                entries=sum(len(s) for s in self._subjects.values()),
+                bytes=size,
+                rebuilds=self.rebuilds,
+            )
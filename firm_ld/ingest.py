@@ -0,0 +1,227 @@
+"""Bulk ingestion of newline-delimited JSON-LD (e.g., an instance archive)."""
+
+import collections
+import concurrent.futures
+import json
+import logging
+import os
+import time
+from dataclasses import dataclass, field
+from typing import Any, Callable, Iterable, Iterator
+
+import rdflib
+
+from firm_ld.jsonld_utils import blank_node_closure, convert_document, jsonld_to_graph
+from firm_ld.ordered import remove_ordered_lists
+from firm_ld.search import SearchEngine
+
+log = logging.getLogger(__name__)
+
+Triple = tuple[rdflib.term.Node, rdflib.term.Node, rdflib.term.Node]
+Converter = Callable[[dict[str, Any]], rdflib.Graph]
+
+
+@dataclass
+class IngestError:
+    line: int
+    error: str
+
+
+@dataclass
+class IngestStats:
+    lines: int = 0
+    objects: int = 0
+    triples: int = 0
+    commits: int = 0
+    errors: list[IngestError] = field(default_factory=list)
+    started: float = field(default_factory=time.monotonic)
+
+    @property
+    def elapsed(self) -> float:
+        return time.monotonic() - self.started
+
+    @property
+    def rate(self) -> float:
+        """Objects per second."""
+        return self.objects / self.elapsed if self.elapsed else 0.0
+
+
+@dataclass
+class _Batch:
+    lines: int
+    # The id (if any) and triples of each converted object
+    objects: list[tuple[str | None, list[Triple]]]
+    errors: list[IngestError]
+
+
+def _convert_batch(converter: Converter, first_line: int, lines: list[str]) -> _Batch:
+    """Convert lines of JSON-LD to triples (runs in a worker process)."""
+    batch = _Batch(len(lines), [], [])
+    # Equal terms share one object so each is pickled only once per batch
+    terms: dict[rdflib.term.Node, rdflib.term.Node] = {}
+    for line_number, line in enumerate(lines, first_line):
+        if not line.strip():
+            continue
+        try:
+            obj = json.loads(line)
+            id_ = obj.get("id", obj.get("@id"))
+            triples = [
+                (terms.setdefault(s, s), terms.setdefault(p, p), terms.setdefault(o, o))
+                for s, p, o in convert_document(converter, obj)
+            ]
+            batch.objects.append((id_, triples))
+        except Exception as ex:
+            batch.errors.append(IngestError(line_number, f"{type(ex).__name__}: {ex}"))
+    return batch
+
+
+class _Writer:
+    """Commits converted objects to the graph in large transactions."""
+
+    def __init__(
+        self,
+        graph: rdflib.Graph,
+        commit_size: int,
+        replace: bool,
+        search: SearchEngine | None,
+        notify: Callable[[Iterable[str]], None] | None,
+        progress: Callable[[IngestStats], None] | None,
+        stats: IngestStats,
+    ):
+        self.graph = graph
+        self.commit_size = commit_size
+        self.replace = replace
+        self.search = search
+        self.notify = notify
+        self.progress = progress
+        self.stats = stats
+        # Later versions of an object replace earlier ones
+        self._objects: dict[Any, list[Triple]] = {}
+        self._triples = 0
+
+    def add(self, batch: _Batch) -> None:
+        self.stats.lines += batch.lines
+        self.stats.errors.extend(batch.errors)
+        for id_, triples in batch.objects:
+            key = id_ or len(self._objects)
+            if previous := self._objects.get(key):
+                self._triples -= len(previous)
+            self._objects[key] = triples
+            self._triples += len(triples)
+        if self._triples >= self.commit_size:
+            self.commit()
+
+    def _remove(self, subject: rdflib.term.Node) -> None:
+        """Remove a subject with its lists and embedded blank nodes."""
+        remove_ordered_lists(self.graph, subject)
+        for node in blank_node_closure(self.graph, subject):
+            self.graph.remove((node, None, None))
+        self.graph.remove((subject, None, None))
+
+    def commit(self) -> None:
+        if not self._objects:
+            return
+        subjects = {
+            s
+            for triples in self._objects.values()
+            for s, _, _ in triples
+            if not isinstance(s, rdflib.BNode)
+        }
+        try:
+            if self.replace:
+                for subject in subjects:
+                    self._remove(subject)
+            self.graph.addN(
+                (s, p, o, self.graph)
+                for triples in self._objects.values()
+                for s, p, o in triples
+            )
+            if self.graph.store.transaction_aware:
+                self.graph.commit()
+        except Exception:
+            if self.graph.store.transaction_aware:
+                self.graph.rollback()
+            raise
+        uris = [str(subject) for subject in subjects]
+        if self.notify:
+            self.notify(uris)
+        if self.search:
+            self.search.update_subjects(uris)
+        self.stats.objects += len(self._objects)
+        self.stats.triples += self._triples
+        self.stats.commits += 1
+        self._objects = {}
+        self._triples = 0
+        if self.progress:
+            self.progress(self.stats)
+
+
+def _batches(lines: Iterable[str], size: int) -> Iterator[tuple[int, list[str]]]:
+    batch: list[str] = []
+    first_line = 1
+    for line_number, line in enumerate(lines, 1):
+        batch.append(line)
+        if len(batch) == size:
+            yield first_line, batch
+            batch = []
+            first_line = line_number + 1
+    if batch:
+        yield first_line, batch
+
+
+def ingest(
+    lines: Iterable[str],
+    graph: rdflib.Graph,
+    *,
+    converter: Converter = jsonld_to_graph,
+    workers: int | None = None,
+    batch_size: int = 200,
+    commit_size: int = 100_000,
+    max_pending: int | None = None,
+    replace: bool = True,
+    search: SearchEngine | None = None,
+    notify: Callable[[Iterable[str]], None] | None = None,
+    progress: Callable[[IngestStats], None] | None = None,
+) -> IngestStats:
+    """Store newline-delimited JSON-LD objects in a graph.
+
+    Batches of lines are converted to triples by a pool of worker processes
+    (workers=0 converts in this process) and committed by this process in
+    transactions of about commit_size triples. At most max_pending batches
+    are in flight, so reading the input waits for slow conversions or
+    commits. Stored objects replace existing ones unless replace is false.
+
+    After each commit, notify (e.g., RdfDataSet.notify_write) is called with
+    the changed subjects and, if given, the search index is updated.
+    Lines that can't be converted are recorded in the stats' errors.
+    """
+    stats = IngestStats()
+    writer = _Writer(graph, commit_size, replace, search, notify, progress, stats)
+    if workers == 0:
+        for first_line, batch in _batches(lines, batch_size):
+            writer.add(_convert_batch(converter, first_line, batch))
+        writer.commit()
+        return stats
+    workers = workers or os.cpu_count() or 1
+    max_pending = max_pending or 2 * workers
+    with concurrent.futures.ProcessPoolExecutor(workers) as executor:
+        pending: collections.deque[concurrent.futures.Future[_Batch]] = (
+            collections.deque()
+        )
+        for first_line, batch in _batches(lines, batch_size):
+            if len(pending) >= max_pending:
+                writer.add(pending.popleft().result())
+            pending.append(
+                executor.submit(_convert_batch, converter, first_line, batch)
+            )
+        while pending:
+            writer.add(pending.popleft().result())
+    writer.commit()
+    log.info(
+        "Ingested %d objects (%d triples, %d errors) in %.1fs",
+        stats.objects,
+        stats.triples,
+        len(stats.errors),
+        stats.elapsed,
+    )
+    return stats
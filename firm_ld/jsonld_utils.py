@@ -1,10 +1,19 @@
+import asyncio
+import functools
+import hashlib
+import importlib.resources
 import json
-from typing import Any
+from typing import Any, Callable, Iterable
 
-import httpx_cache
 import rdflib
 import rdflib.collection
 from pyld import jsonld
+from pyld.context_resolver import ContextResolver
+from pyld.jsonld import _resolved_context_cache
+
+from firm_ld.cache import CacheStats, LRUCache
+from firm_ld.loader import DocumentFetcher
+from firm_ld.ordered import add_ordered_list, inline_items, is_ordered_list
 
 AS2 = rdflib.Namespace("https://www.w3.org/ns/activitystreams#")
 
@@ -20,29 +29,204 @@ JSONLD_COMPACTION_CONTEXT = {
 
 JSONLD_CONTEXT = {"@context": "https://www.w3.org/ns/activitystreams"}
 
-_JSON_LD_ACCEPT = {
-    "Accept": "application/ld+json, application/json;q=0.5",
+# Well-known contexts shipped with the package so they never hit the network
+BUNDLED_CONTEXTS = {
+    "https://www.w3.org/ns/activitystreams": "activitystreams.jsonld",
+    "http://www.w3.org/ns/activitystreams": "activitystreams.jsonld",
+    "https://w3c-ccg.github.io/security-vocab/contexts/security-v1.jsonld": (
+        "security-v1.jsonld"
+    ),
+    "https://w3id.org/security/v1": "security-v1.jsonld",
 }
 
 
-def httpx_document_loader(url: str, options: dict[str, Any]) -> dict[str, Any]:
-    if "headers" in options:
-        options["headers"].update(_JSON_LD_ACCEPT)
-    else:
-        options["headers"] = _JSON_LD_ACCEPT
-    del options["documentLoader"]
-    with httpx_cache.Client(cache=httpx_cache.FileCache(cache_dir="/tmp")) as client:
-        response = client.get(
-            url,
-            **options,
-        )
-        if response.is_success:
+@functools.cache
+def _load_bundled_context(filename: str) -> dict[str, Any]:
+    resource = importlib.resources.files("firm_ld.contexts").joinpath(filename)
+    return json.loads(resource.read_text(encoding="utf-8"))
+
+
+class CachingDocumentLoader:
+    """A pyld document loader that keeps parsed documents in memory.
+
+    Bundled contexts are always served from memory. Other documents are
+    fetched with the wrapped loader (by default, a shared DocumentFetcher)
+    and kept in a bounded LRU cache.
+    """
+
+    def __init__(
+        self,
+        loader: Callable[[str, dict[str, Any]], dict[str, Any]] | None = None,
+        maxsize: int = 256,
+        ttl: float | None = 24 * 60 * 60,
+        bundled: dict[str, str] | None = None,
+    ):
+        self._loader = loader or DocumentFetcher()
+        self._bundled = BUNDLED_CONTEXTS if bundled is None else bundled
+        self.cache: LRUCache[str, dict[str, Any]] = LRUCache(maxsize, ttl)
+
+    def __call__(self, url: str, options: dict[str, Any]) -> dict[str, Any]:
+        if filename := self._bundled.get(url):
+            self.cache.hits += 1
             return {
                 "contextUrl": None,
                 "documentUrl": url,
-                "document": response.json(),
+                "document": _load_bundled_context(filename),
             }
-        raise Exception(f"Failed to load context document from {url}")
+        if (remote_doc := self.cache.get(url)) is None:
+            remote_doc = self._loader(url, dict(options))
+            self.cache.put(url, remote_doc)
+        # pyld may update the returned dict, so the cached copy is not shared
+        return dict(remote_doc)
+
+    async def prefetch(self, urls: Iterable[str]) -> None:
+        """Cache documents (e.g., the contexts of an incoming object).
+
+        pyld loads documents synchronously, so loading them first keeps
+        conversions from blocking on the network. Failures are ignored here
+        and reported by the conversion.
+        """
+        missing = [
+            url for url in urls if url not in self._bundled and url not in self.cache
+        ]
+        aload = getattr(self._loader, "aload", None)
+        if aload is None or not missing:
+            return
+        for url, remote_doc in zip(
+            missing,
+            await asyncio.gather(*map(aload, missing), return_exceptions=True),
+        ):
+            if not isinstance(remote_doc, BaseException):
+                self.cache.put(url, remote_doc)
+
+    def stats(self) -> CacheStats:
+        return self.cache.stats()
+
+    def clear(self) -> None:
+        self.cache.clear()
+
+
+document_loader = CachingDocumentLoader()
+
+
+def context_urls(context: Any) -> list[str]:
+    """The remote contexts referenced by a JSON-LD @context value."""
+    if isinstance(context, str):
+        return [context]
+    if isinstance(context, list):
+        return [url for item in context for url in context_urls(item)]
+    return []
+
+
+def httpx_document_loader(url: str, options: dict[str, Any]) -> dict[str, Any]:
+    return document_loader(url, options)
+
+
+def context_fingerprint(context: Any) -> str:
+    """A stable key for a JSON-LD context value."""
+    canonical = json.dumps(context, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+class ContextCache:
+    """Memoizes processed (active) JSON-LD contexts across expand/compact calls.
+
+    pyld reprocesses every ``@context`` from scratch for each operation. This
+    keeps the processed form keyed by a fingerprint of the context value and
+    drives pyld's expansion and compaction algorithms with it directly.
+    """
+
+    def __init__(
+        self,
+        maxsize: int = 32,
+        loader: Callable[[str, dict[str, Any]], dict[str, Any]] = (
+            httpx_document_loader
+        ),
+    ):
+        self._loader = loader
+        self.cache: LRUCache[str, dict[str, Any]] = LRUCache(maxsize)
+
+    def _options(self) -> dict[str, Any]:
+        return {
+            "base": "",
+            "isFrame": False,
+            "keepFreeFloatingNodes": False,
+            "compactArrays": True,
+            "graph": False,
+            "link": False,
+            "processingMode": "json-ld-1.1",
+            "documentLoader": self._loader,
+            "contextResolver": ContextResolver(_resolved_context_cache, self._loader),
+        }
+
+    def active_context(self, context: Any) -> dict[str, Any]:
+        if isinstance(context, dict) and "@context" in context:
+            context = context["@context"]
+        key = context_fingerprint(context)
+        if (active_ctx := self.cache.get(key)) is None:
+            processor = jsonld.JsonLdProcessor()
+            options = self._options()
+            active_ctx = processor.process_context(
+                processor._get_initial_context(options), context, options
+            )
+            self.cache.put(key, active_ctx)
+        return active_ctx
+
+    def expand(self, doc: dict[str, Any], expand_context: Any = None) -> list[Any]:
+        contexts = []
+        if expand_context is not None:
+            contexts.append(expand_context)
+        if "@context" in doc:
+            doc = dict(doc)
+            contexts.append(doc.pop("@context"))
+        context = contexts[0] if len(contexts) == 1 else contexts
+        expanded = jsonld.JsonLdProcessor()._expand(
+            self.active_context(context), None, doc, self._options()
+        )
+        if isinstance(expanded, dict) and "@graph" in expanded and len(expanded) == 1:
+            expanded = expanded["@graph"]
+        elif expanded is None:
+            expanded = []
+        return jsonld.JsonLdProcessor.arrayify(expanded)
+
+    def compact(self, doc: Any, context: Any) -> dict[str, Any]:
+        if isinstance(context, dict) and "@context" in context:
+            context = context["@context"]
+        active_ctx = self.active_context(context)
+        processor = jsonld.JsonLdProcessor()
+        expanded = processor._expand(active_ctx, None, doc, self._options())
+        compacted = processor._compact(active_ctx, None, expanded, self._options())
+        if isinstance(compacted, list):
+            if len(compacted) == 1:
+                compacted = compacted[0]
+            elif len(compacted) == 0:
+                compacted = {}
+            else:
+                compacted = {processor._compact_iri(active_ctx, "@graph"): compacted}
+        return {"@context": context, **compacted}
+
+    def invalidate(self, context: Any = None) -> None:
+        """Drop one processed context, or all of them if none is given."""
+        if context is None:
+            self.cache.clear()
+        else:
+            if isinstance(context, dict) and "@context" in context:
+                context = context["@context"]
+            self.cache.invalidate(context_fingerprint(context))
+
+    def stats(self) -> CacheStats:
+        return self.cache.stats()
+
+
+context_cache = ContextCache()
+
+
+def _insert_item(g: rdflib.Graph, item: dict[str, Any]) -> rdflib.term.Node:
+    if "@value" in item:
+        return rdflib.Literal(item["@value"])
+    if len(item) == 1 and "@id" in item:
+        return rdflib.URIRef(item["@id"])
+    return _insert_resource(g, item)
 
 
 def _insert_resource(g: rdflib.Graph, resource: dict[str, Any]) -> rdflib.URIRef:
@@ -60,26 +244,14 @@ def _insert_resource(g: rdflib.Graph, resource: dict[str, Any]) -> rdflib.URIRef
                 for obj in value:
                     if len(obj) == 1:
                         if "@list" in obj:
-                            if len(obj["@list"]) > 0:
-                                # TODO This list should be handled differently
-                                # if it's LIFO vs FIFO
-                                # AP OrderedCollection could be either depending on
-                                # the specific collection
-                                # items_uri = list(g.objects(subject, AS2.orderedItems))
-                                # first_item = None
-                                # if len(items_uri) == 0:
-                                #     items_uri = rdflib.BNode()
-                                #     g.add((subject, AS2.orderedItems, items_uri))
-                                # else:
-                                #     items_uri = items_uri[0]
-                                #     first_item = next(g.objects((items_uri,
-                                #         rdflib.RDF.first)))
-                                # c = rdflib.collection.Collection(g, items_uri)
-                                # for item in obj["@list"]:
-                                #     item_uri = item["@id"]
-                                raise Exception("@list not supported")
-                            else:
-                                continue
+                            # Stored as positioned entries (see firm_ld.ordered)
+                            add_ordered_list(
+                                g,
+                                subject,
+                                rdflib.URIRef(key),
+                                (_insert_item(g, item) for item in obj["@list"]),
+                            )
+                            continue
                         if "@id" in obj:
                             obj = rdflib.URIRef(obj["@id"])
                         elif "@value" in obj:
@@ -98,48 +270,118 @@ def _insert_resource(g: rdflib.Graph, resource: dict[str, Any]) -> rdflib.URIRef
 
 
 def jsonld_to_graph(doc: dict[str, Any]) -> rdflib.Graph:
-    expanded = jsonld.expand(
-        doc,
-        {"documentLoader": httpx_document_loader},
-    )
+    expanded = context_cache.expand(doc)
     g = rdflib.Graph()
     for resource in expanded:
         _insert_resource(g, resource)
     return g
 
 
+def convert_document(
+    converter: Callable[[dict[str, Any]], rdflib.Graph], obj: dict[str, Any]
+) -> rdflib.Graph:
+    """Convert a document to a graph with the contexts stored documents use."""
+    if "@context" not in obj:
+        obj.update(JSONLD_CONTEXT)
+    # TODO Review the context setup
+    context = obj["@context"]
+    obj["@context"] = [
+        *(context if isinstance(context, list) else [context]),
+        "https://w3c-ccg.github.io/security-vocab/contexts/security-v1.jsonld",
+        {"firm": "https://firm.stevebate.dev#"},
+    ]
+    return converter(obj)
+
+
+_NATIVE_DATATYPES = {
+    rdflib.XSD.integer,
+    rdflib.XSD.boolean,
+    rdflib.XSD.double,
+}
+
+
+def literal_to_jsonld(obj: rdflib.Literal) -> dict[str, Any]:
+    """Convert a literal to an expanded JSON-LD value object."""
+    if obj.language:
+        return {"@value": str(obj), "@language": obj.language}
+    if obj.datatype is None or obj.datatype == rdflib.XSD.string:
+        return {"@value": str(obj)}
+    if obj.datatype in _NATIVE_DATATYPES:
+        value = obj.toPython()
+        if isinstance(value, (bool, int, float)):
+            return {"@value": value}
+    return {"@value": str(obj), "@type": str(obj.datatype)}
+
+
 def node_to_python(obj: rdflib.term.Node) -> Any:
+    """The expanded JSON-LD value of an object node.
+
+    Blank nodes are node references ({"@id": "_:b0"}), like IRIs, rather
+    than "_:b0" strings, which expanded JSON-LD reads as string values.
+    Literals are value objects (see literal_to_jsonld).
+    """
     if isinstance(obj, rdflib.BNode):
-        return f"_:{obj}"
+        return {"@id": f"_:{obj}"}
     if isinstance(obj, rdflib.Literal):
-        return obj.toPython()
+        return literal_to_jsonld(obj)
     if isinstance(obj, rdflib.URIRef):
         return {"@id": str(obj)}
     return str(obj)
 
 
+def _subject_to_expanded(
+    g: rdflib.Graph, subject: rdflib.term.Node, visited: set[rdflib.term.Node]
+) -> dict[str, Any]:
+    visited.add(subject)
+    node: dict[str, Any] = {}
+    if not isinstance(subject, rdflib.BNode):
+        node["@id"] = str(subject)
+    for p, o in g.predicate_objects(subject):
+        if p == rdflib.RDF.type:
+            node.setdefault("@type", []).append(str(o))
+        elif is_ordered_list(g, o):
+            # Large lists are read by pages (see RdfResourceStore.items)
+            if (items := inline_items(g, o)) is not None:
+                node.setdefault(str(p), []).append(
+                    {
+                        "@list": [
+                            (
+                                _subject_to_expanded(g, item, visited)
+                                if isinstance(item, rdflib.BNode)
+                                else node_to_python(item)
+                            )
+                            for item in items
+                        ]
+                    }
+                )
+        elif isinstance(o, rdflib.BNode) and o not in visited:
+            node.setdefault(str(p), []).append(_subject_to_expanded(g, o, visited))
+        else:
+            node.setdefault(str(p), []).append(node_to_python(o))
+    return node
+
+
+def blank_node_closure(g: rdflib.Graph, subject: rdflib.term.Node) -> set[rdflib.BNode]:
+    """The blank nodes in the concise bounded description of a subject."""
+    closure: set[rdflib.BNode] = set()
+    pending = [subject]
+    while pending:
+        for o in g.objects(pending.pop()):
+            if isinstance(o, rdflib.BNode) and o not in closure:
+                closure.add(o)
+                pending.append(o)
+    return closure
+
+
 def subject_to_jsonld(g: rdflib.Graph, uri: str) -> dict[str, Any] | None:
-    resource = g.cbd(rdflib.URIRef(uri))
-    jsonld_resources = []
-    for subject in resource.subjects(unique=True):
-        # TODO Review this blank node hack
-        if True or not isinstance(subject, rdflib.BNode):
-            subject_doc = {"@id": str(subject)}
-            for p, o in resource.predicate_objects(subject):
-                if p == rdflib.RDF.type:
-                    subject_doc["@type"] = str(subject)
-                else:
-                    subject_doc[str(p)] = node_to_python(o)
-            jsonld_resources.append(subject_doc)
-    if len(jsonld_resources) == 0:
+    """Compact the concise bounded description of a subject using pyld.
+
+    Blank nodes are embedded in the object that references them.
+    """
+    subject = rdflib.URIRef(uri)
+    if (subject, None, None) not in g:
         return None
-    jsonld_graph = {"@graph": jsonld_resources}
-    compacted: dict[str, Any] = jsonld.compact(
-        jsonld_graph,
-        JSONLD_COMPACTION_CONTEXT,
-        dict(
-            documentLoader=httpx_document_loader,
-        ),
-    )
+    expanded = _subject_to_expanded(g, subject, set())
+    compacted = context_cache.compact(expanded, JSONLD_COMPACTION_CONTEXT)
     compacted.update(JSONLD_COMPACTION_CONTEXT)
     return compacted
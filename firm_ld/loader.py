@@ -0,0 +1,172 @@
+import asyncio
+import importlib.util
+import threading
+import time
+from dataclasses import dataclass
+from typing import Any, Callable
+
+import httpx
+import httpx_cache
+
+JSON_LD_ACCEPT = {
+    "Accept": "application/ld+json, application/json;q=0.5",
+}
+
+RemoteDocument = dict[str, Any]
+
+
+class DocumentLoadError(Exception):
+    pass
+
+
+@dataclass
+class FetchStats:
+    requests: int = 0
+    # Loads that waited for a request already in flight
+    coalesced: int = 0
+    failures: int = 0
+    # Loads that failed immediately because of a recent failure
+    negative_hits: int = 0
+
+
+@dataclass
+class _Failure:
+    error: DocumentLoadError
+    count: int
+    retry_at: float
+
+
+class DocumentFetcher:
+    """Fetches remote JSON-LD documents with a shared, pooled HTTP client.
+
+    Concurrent loads of a URL share one request. A failed URL isn't
+    requested again until its backoff (doubling with each consecutive
+    failure, up to max_backoff seconds) has passed; until then, loads fail
+    with the previous error.
+
+    The client runs on its own event loop thread, so documents can be
+    loaded from async code (aload) and from pyld, which calls the loader
+    synchronously (__call__).
+    """
+
+    def __init__(
+        self,
+        *,
+        max_connections: int = 20,
+        max_keepalive_connections: int = 10,
+        timeout: float = 10.0,
+        http2: bool | None = None,
+        cache_dir: str | None = "/tmp",
+        backoff: float = 30.0,
+        max_backoff: float = 60 * 60,
+        timer: Callable[[], float] = time.monotonic,
+        transport: httpx.AsyncBaseTransport | None = None,
+    ):
+        self._client_options: dict[str, Any] = {
+            "limits": httpx.Limits(
+                max_connections=max_connections,
+                max_keepalive_connections=max_keepalive_connections,
+            ),
+            "timeout": timeout,
+            # HTTP/2 needs the optional h2 package
+            "http2": (
+                importlib.util.find_spec("h2") is not None if http2 is None else http2
+            ),
+            "headers": JSON_LD_ACCEPT,
+            "follow_redirects": True,
+            "transport": transport,
+        }
+        self._cache_dir = cache_dir
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self._timer = timer
+        self._lock = threading.Lock()
+        self._loop: asyncio.AbstractEventLoop | None = None
+        self._client: httpx.AsyncClient | None = None
+        # Only used on the fetcher's loop
+        self._in_flight: dict[str, asyncio.Future[RemoteDocument]] = {}
+        self._failures: dict[str, _Failure] = {}
+        self.stats = FetchStats()
+
+    def _start(self) -> asyncio.AbstractEventLoop:
+        with self._lock:
+            if self._loop is None:
+                loop = asyncio.new_event_loop()
+                threading.Thread(
+                    target=loop.run_forever, name="document-fetcher", daemon=True
+                ).start()
+                self._loop = loop
+            return self._loop
+
+    def _get_client(self) -> httpx.AsyncClient:
+        if self._client is None:
+            if self._cache_dir is None:
+                self._client = httpx.AsyncClient(**self._client_options)
+            else:
+                self._client = httpx_cache.AsyncClient(
+                    cache=httpx_cache.FileCache(cache_dir=self._cache_dir),
+                    **self._client_options,
+                )
+        return self._client
+
+    async def _request(
+        self, url: str, headers: dict[str, str] | None
+    ) -> RemoteDocument:
+        self.stats.requests += 1
+        try:
+            response = await self._get_client().get(url, headers=headers)
+            if not response.is_success:
+                raise DocumentLoadError(
+                    f"Failed to load document from {url} ({response.status_code})"
+                )
+            document = response.json()
+        except Exception as ex:
+            self.stats.failures += 1
+            error = (
+                ex
+                if isinstance(ex, DocumentLoadError)
+                else DocumentLoadError(f"Failed to load document from {url}: {ex}")
+            )
+            previous = self._failures.get(url)
+            count = previous.count + 1 if previous else 1
+            delay = min(self.backoff * 2 ** (count - 1), self.max_backoff)
+            self._failures[url] = _Failure(error, count, self._timer() + delay)
+            raise error from ex
+        self._failures.pop(url, None)
+        return {"contextUrl": None, "documentUrl": url, "document": document}
+
+    async def _load(self, url: str, headers: dict[str, str] | None) -> RemoteDocument:
+        if (failure := self._failures.get(url)) and self._timer() < failure.retry_at:
+            self.stats.negative_hits += 1
+            raise failure.error
+        if (future := self._in_flight.get(url)) is not None:
+            self.stats.coalesced += 1
+            return dict(await asyncio.shield(future))
+        future = asyncio.ensure_future(self._request(url, headers))
+        self._in_flight[url] = future
+        future.add_done_callback(lambda _: self._in_flight.pop(url, None))
+        # A cancelled load doesn't cancel the request for the other loads
+        return dict(await asyncio.shield(future))
+
+    async def aload(
+        self, url: str, headers: dict[str, str] | None = None
+    ) -> RemoteDocument:
+        """Load a document without blocking the calling event loop."""
+        return await asyncio.wrap_future(
+            asyncio.run_coroutine_threadsafe(self._load(url, headers), self._start())
+        )
+
+    def __call__(self, url: str, options: dict[str, Any]) -> RemoteDocument:
+        return asyncio.run_coroutine_threadsafe(
+            self._load(url, options.get("headers")), self._start()
+        ).result()
+
+    def close(self) -> None:
+        with self._lock:
+            loop, self._loop = self._loop, None
+        if loop is None:
+            return
+        if self._client is not None:
+            asyncio.run_coroutine_threadsafe(self._client.aclose(), loop).result()
+            self._client = None
+        loop.call_soon_threadsafe(loop.stop)
@@ -0,0 +1,196 @@
+"""Ordered lists (e.g., AS2 orderedItems) stored as positioned entries.
+
+With rdf:List, every prepend or append would walk the list. Instead, a list
+is a blank node referenced by its owner, and each item has an entry node
+that points to the list:
+
+    <collection> as:orderedItems _:list .
+    _:list a firm:OrderedList .
+    _:entry firm:list _:list ; firm:position 3 ; rdf:value <item> .
+
+The entries aren't part of the owner's concise bounded description, so
+reading the owner doesn't read the items. Small lists are reassembled when
+the owner is serialized (see inline_items). Larger ones are read by pages
+using an OrderedListIndex.
+"""
+
+import itertools
+import threading
+from bisect import bisect_left
+from typing import Iterable, Iterator
+
+import rdflib
+
+FIRM = rdflib.Namespace("https://firm.stevebate.dev#")
+ORDERED_LIST = FIRM.OrderedList
+LIST = FIRM.list
+POSITION = FIRM.position
+
+# Lists with more items than this aren't reassembled into their owner
+INLINE_ITEMS = 100
+
+Entry = tuple[int, rdflib.term.Node]
+
+
+def is_ordered_list(g: rdflib.Graph, node: rdflib.term.Node) -> bool:
+    return isinstance(node, rdflib.BNode) and (node, rdflib.RDF.type, ORDERED_LIST) in g
+
+
+def add_entry(
+    g: rdflib.Graph, node: rdflib.BNode, position: int, item: rdflib.term.Node
+) -> None:
+    entry = rdflib.BNode()
+    g.add((entry, LIST, node))
+    g.add((entry, POSITION, rdflib.Literal(position)))
+    g.add((entry, rdflib.RDF.value, item))
+
+
+def add_ordered_list(
+    g: rdflib.Graph,
+    subject: rdflib.term.Node,
+    predicate: rdflib.URIRef,
+    items: Iterable[rdflib.term.Node],
+) -> rdflib.BNode:
+    node = rdflib.BNode()
+    g.add((subject, predicate, node))
+    g.add((node, rdflib.RDF.type, ORDERED_LIST))
+    for position, item in enumerate(items):
+        add_entry(g, node, position, item)
+    return node
+
+
+def list_entries(g: rdflib.Graph, node: rdflib.term.Node) -> Iterator[Entry]:
+    """The (position, item) entries of a list, unordered."""
+    for entry in g.subjects(LIST, node):
+        position = g.value(entry, POSITION)
+        item = g.value(entry, rdflib.RDF.value)
+        if position is not None and item is not None:
+            yield int(position), item
+
+
+def inline_items(
+    g: rdflib.Graph, node: rdflib.term.Node, limit: int = INLINE_ITEMS
+) -> list[rdflib.term.Node] | None:
+    """The items of a list in order, or None if it has more than limit."""
+    entries = list(itertools.islice(list_entries(g, node), limit + 1))
+    if len(entries) > limit:
+        return None
+    return [item for _, item in sorted(entries, key=lambda entry: entry[0])]
+
+
+def _remove_tree(g: rdflib.Graph, node: rdflib.term.Node) -> None:
+    children = [o for o in g.objects(node) if isinstance(o, rdflib.BNode)]
+    g.remove((node, None, None))
+    for child in children:
+        _remove_tree(g, child)
+
+
+def remove_ordered_lists(g: rdflib.Graph, subject: rdflib.term.Node) -> None:
+    """Remove a subject's lists with their entries (and embedded items)."""
+    for node in list(g.objects(subject)):
+        if is_ordered_list(g, node):
+            for entry in list(g.subjects(LIST, node)):
+                _remove_tree(g, entry)
+            g.remove((node, None, None))
+            g.remove((subject, None, node))
+
+
+class OrderedItems:
+    """The items of a list by rank, with O(1) pushes at either end.
+
+    Items before position 0 are kept in reverse order, so prepending and
+    appending are both list appends.
+    """
+
+    def __init__(self, entries: Iterable[Entry] = ()):
+        ordered = sorted(entries, key=lambda entry: entry[0])
+        split = bisect_left([position for position, _ in ordered], 0)
+        self._front = ordered[:split][::-1]
+        self._back = ordered[split:]
+
+    def __len__(self) -> int:
+        return len(self._front) + len(self._back)
+
+    def next_position(self, first: bool = False) -> int:
+        """The position for an item added at the start (or end) of the list."""
+        if first:
+            if self._front:
+                return self._front[-1][0] - 1
+            return self._back[0][0] - 1 if self._back else -1
+        if self._back:
+            return self._back[-1][0] + 1
+        return self._front[0][0] + 1 if self._front else 0
+
+    def push(self, position: int, item: rdflib.term.Node, first: bool = False) -> None:
+        if first:
+            self._front.append((position, item))
+        else:
+            self._back.append((position, item))
+
+    def page(self, offset: int = 0, limit: int | None = None) -> list[rdflib.term.Node]:
+        """The items ranked from offset (up to limit of them)."""
+        end = len(self) if limit is None else min(offset + limit, len(self))
+        front = len(self._front)
+        items = []
+        if offset < front:
+            items = [
+                item
+                for _, item in self._front[front - min(end, front) : front - offset]
+            ]
+            items.reverse()
+        if end > front:
+            items.extend(
+                item for _, item in self._back[max(offset - front, 0) : end - front]
+            )
+        return items
+
+
+class OrderedListIndex:
+    """The ordered lists of a graph by owner and predicate.
+
+    Lists are loaded from the graph when they're first read. Like the
+    PropertyIndex, lists are invalidated when their owners change (see
+    RdfDataSet.notify_write).
+    """
+
+    def __init__(self, graph: rdflib.Graph):
+        self.graph = graph
+        self._lock = threading.Lock()
+        self._lists: dict[
+            rdflib.term.Node, dict[rdflib.term.Node, tuple[rdflib.BNode, OrderedItems]]
+        ] = {}
+
+    def get(
+        self, owner: rdflib.term.Node, predicate: rdflib.URIRef
+    ) -> tuple[rdflib.BNode, OrderedItems] | None:
+        """The list node and items, or None if the owner has no list."""
+        with self._lock:
+            if (found := self._lists.get(owner, {}).get(predicate)) is not None:
+                return found
+        for node in self.graph.objects(owner, predicate):
+            if is_ordered_list(self.graph, node):
+                found = node, OrderedItems(list_entries(self.graph, node))
+                with self._lock:
+                    return self._lists.setdefault(owner, {}).setdefault(
+                        predicate, found
+                    )
+        return None
+
+    def put(
+        self,
+        owner: rdflib.term.Node,
+        predicate: rdflib.URIRef,
+        node: rdflib.BNode,
+        items: OrderedItems,
+    ) -> None:
+        """Restore a list the store has updated (after its invalidation)."""
+        with self._lock:
+            self._lists.setdefault(owner, {})[predicate] = node, items
+
+    def invalidate(self, subjects: Iterable[str] | None = None) -> None:
+        with self._lock:
+            if subjects is None:
+                self._lists.clear()
+            else:
+                for subject in subjects:
+                    self._lists.pop(rdflib.URIRef(subject), None)
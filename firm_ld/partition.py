@@ -0,0 +1,203 @@
+"""Partitioning of stored objects into named graphs.
+
+A partition policy chooses the named graph for each stored object (e.g.,
+its actor's graph). Objects stay together with their blank nodes, so
+reading, deleting or exporting a partition only touches its own graph.
+"""
+
+import threading
+from dataclasses import dataclass
+from typing import Any, Iterable, Mapping, Protocol
+from urllib.parse import urlsplit
+
+import rdflib
+from rdflib.graph import DATASET_DEFAULT_GRAPH_ID
+
+from firm_ld.as2 import UnsupportedDocument, term_table
+from firm_ld.criteria import CRITERIA_CONTEXT, expand_property
+from firm_ld.jsonld_utils import AS2
+
+ACTOR_TYPES = frozenset(
+    AS2[name] for name in ("Application", "Group", "Organization", "Person", "Service")
+)
+
+
+class PartitionPolicy(Protocol):
+    def partition(
+        self, resource: rdflib.Graph, subject: rdflib.term.Node
+    ) -> str | None:
+        """The graph IRI for a resource, or None for the default graph."""
+        ...
+
+    def partitions(self, criteria: Mapping[str, Any]) -> list[str | None] | None:
+        """The graphs that can hold matches for criteria (None if any can).
+
+        A None in the list is the default graph.
+        """
+        ...
+
+
+def resource_root(resource: rdflib.Graph) -> rdflib.term.Node | None:
+    """The named subject of a resource that isn't embedded in another."""
+    subjects = [
+        s for s in resource.subjects(unique=True) if isinstance(s, rdflib.URIRef)
+    ]
+    for subject in subjects:
+        if not any(
+            isinstance(s, rdflib.URIRef) for s in resource.subjects(None, subject)
+        ):
+            return subject
+    return subjects[0] if subjects else None
+
+
+@dataclass
+class ByActor:
+    """Objects are stored in the graph of their actor.
+
+    The actor is the value of the first of the predicates the object has.
+    Objects with several actors for that predicate have no single owner, so
+    they're stored in the default graph. Actors are stored in their own
+    graphs and anything else in the default graph. Queries with an equality
+    criterion for the first predicate (e.g., {"attributedTo": actor}) only
+    search that actor's graph and the default graph.
+    """
+
+    predicates: tuple[str, ...] = ("attributedTo", "actor")
+
+    def __post_init__(self) -> None:
+        self._iris = [expand_property(term) for term in self.predicates]
+
+    def partition(
+        self, resource: rdflib.Graph, subject: rdflib.term.Node
+    ) -> str | None:
+        for predicate in self._iris:
+            actors = {
+                o
+                for o in resource.objects(subject, predicate)
+                if isinstance(o, rdflib.URIRef)
+            }
+            if len(actors) == 1:
+                return str(actors.pop())
+            if actors:
+                return None
+        if any(t in ACTOR_TYPES for t in resource.objects(subject, rdflib.RDF.type)):
+            return str(subject)
+        return None
+
+    def partitions(self, criteria: Mapping[str, Any]) -> list[str | None] | None:
+        # An object with a later predicate may be in another actor's graph
+        table = term_table(CRITERIA_CONTEXT)
+        for key, value in criteria.items():
+            if key in table.id_aliases or key in table.type_aliases:
+                continue
+            try:
+                predicate = expand_property(key)
+            except UnsupportedDocument:
+                # Criteria the plans don't support are matched generically
+                # (see match_subjects), so any graph can hold matches
+                return None
+            if isinstance(value, str) and predicate == self._iris[0]:
+                return [value, None]
+        return None
+
+
+@dataclass
+class ByDomain:
+    """Objects are stored in a graph per domain (e.g., https://server.test/)."""
+
+    def partition(
+        self, resource: rdflib.Graph, subject: rdflib.term.Node
+    ) -> str | None:
+        url = urlsplit(str(subject))
+        return f"{url.scheme}://{url.netloc}/" if url.netloc else None
+
+    def partitions(self, criteria: Mapping[str, Any]) -> list[str | None] | None:
+        return None
+
+
+@dataclass
+class ByPath:
+    """Objects are stored in a graph per URI path prefix.
+
+    For example, with 2 segments, https://server.test/actors/alice/outbox/1
+    is stored in https://server.test/actors/alice/ (a pod or collection).
+    Objects with shorter paths are stored in the default graph.
+    """
+
+    segments: int = 2
+
+    def partition(
+        self, resource: rdflib.Graph, subject: rdflib.term.Node
+    ) -> str | None:
+        url = urlsplit(str(subject))
+        segments = url.path.split("/")[1:]
+        if not url.netloc or len(segments) <= self.segments:
+            return None
+        prefix = "/".join(segments[: self.segments])
+        return f"{url.scheme}://{url.netloc}/{prefix}/"
+
+    def partitions(self, criteria: Mapping[str, Any]) -> list[str | None] | None:
+        return None
+
+
+class GraphDirectory:
+    """Maps stored subjects to the named graphs holding them.
+
+    Entries are set by the store's writes. Other subjects are looked up in
+    the dataset when needed, so the directory is a cache (invalidated by
+    RdfDataSet.notify_write) rather than a record that must be persisted.
+    """
+
+    def __init__(self, dataset: rdflib.Dataset):
+        self.dataset = dataset
+        self._lock = threading.Lock()
+        self._graphs: dict[str, str] = {}
+        self._members: dict[str, set[str]] = {}
+
+    def _find(self, uri: str) -> str | None:
+        for _, _, _, graph in self.dataset.quads(
+            (rdflib.URIRef(uri), None, None, None)
+        ):
+            identifier = getattr(graph, "identifier", graph)
+            if identifier is not None and identifier != DATASET_DEFAULT_GRAPH_ID:
+                return str(identifier)
+        return None
+
+    def _discard(self, uri: str) -> None:
+        if (previous := self._graphs.pop(uri, None)) is not None:
+            members = self._members[previous]
+            members.discard(uri)
+            if not members:
+                del self._members[previous]
+
+    def get(self, uri: str) -> str | None:
+        """The graph holding a subject, or None if it's in the default graph."""
+        with self._lock:
+            if (partition := self._graphs.get(uri)) is not None:
+                return partition
+        # Misses aren't cached, so lookups of unknown URIs don't grow it
+        if (partition := self._find(uri)) is not None:
+            self.set([uri], partition)
+        return partition
+
+    def set(self, uris: Iterable[str], partition: str | None) -> None:
+        with self._lock:
+            for uri in uris:
+                self._discard(uri)
+                if partition is not None:
+                    self._graphs[uri] = partition
+                    self._members.setdefault(partition, set()).add(uri)
+
+    def remove_partition(self, partition: str) -> None:
+        with self._lock:
+            for uri in self._members.pop(partition, ()):
+                del self._graphs[uri]
+
+    def invalidate(self, subjects: Iterable[str] | None = None) -> None:
+        with self._lock:
+            if subjects is None:
+                self._graphs.clear()
+                self._members.clear()
+            else:
+                for subject in subjects:
+                    self._discard(subject)
@@ -1,7 +1,19 @@
+import asyncio
+import concurrent.futures
+import contextlib
+import functools
+import hashlib
+import itertools
+import json
 import logging
+import os
+import pathlib
+import queue
 import sqlite3
-from dataclasses import dataclass
-from typing import Any, Sequence, cast
+import threading
+import time
+from dataclasses import dataclass, field
+from typing import Any, Iterable, Iterator, Sequence, cast
 
 import rdflib
 from starlette.responses import JSONResponse
@@ -9,6 +21,21 @@ from starlette.responses import JSONResponse
 log = logging.getLogger(__name__)
 
 
+def _batched(items: Iterable[Any], size: int) -> Iterator[list[Any]]:
+    iterator = iter(items)
+    while batch := list(itertools.islice(iterator, size)):
+        yield batch
+
+
+def _has_fts_table(index: sqlite3.Connection) -> bool:
+    return (
+        index.execute(
+            "SELECT 1 FROM sqlite_master WHERE name = 'resource_fts'"
+        ).fetchone()
+        is not None
+    )
+
+
 def _ensure_uri(value: rdflib.URIRef | str) -> rdflib.URIRef:
     if not isinstance(value, rdflib.URIRef):
         return rdflib.URIRef(value)
@@ -21,26 +48,181 @@ class IndexedResource:
     indexed: Sequence[rdflib.URIRef | str]
     projected: Sequence[rdflib.URIRef | str]
     context: Any = None
+    # Relevance weights for indexed predicates (the default is 1.0)
+    weights: dict[rdflib.URIRef | str, float] = field(default_factory=dict)
 
     def __post_init__(self):
         self.type = _ensure_uri(self.type)
         self.indexed = [_ensure_uri(pred) for pred in self.indexed]
         self.projected = [_ensure_uri(pred) for pred in self.projected]
+        self.weights = {_ensure_uri(p): w for p, w in self.weights.items()}
+
+
+@dataclass
+class SearchPage:
+    results: list[dict]
+    # Pass to search to get the next page (None if this is the last page)
+    cursor: str | None = None
+
+
+# The type, FTS column texts and projection indexed for a resource
+Entry = tuple[str, dict[str, str], dict[str, Any]]
+
+# Incremented when the index tables change so old index files are rebuilt
+SCHEMA_VERSION = 4
+
+DEFAULT_LIMIT = 50
+SNIPPET_TOKENS = 12
+
+# SQLite virtual machine instructions between search timeout checks
+PROGRESS_INSTRUCTIONS = 1000
+
+
+class SearchTimeout(Exception):
+    pass
+
+
+# Rows per executemany call when writing index updates
+BATCH_SIZE = 1000
 
 
 class SearchEngine:
-    """A simple full-text search engine for RDF resources that indexes text objects."""
+    """A simple full-text search engine for RDF resources that indexes text objects.
 
-    def __init__(self, graph: rdflib.Graph):
-        self._index = sqlite3.connect(":memory:", check_same_thread=False)
-        self._index.row_factory = sqlite3.Row
-        self._index.execute(
-            "CREATE VIRTUAL TABLE IF NOT EXISTS "
-            "resource_fts USING fts4(uri, type, text)"
+    By default the index is in memory. If a path is given, the index is
+    kept in an SQLite database file (using WAL journaling) and sync_index
+    only re-indexes the resources that changed since the last run. An index
+    file that is corrupt or from another schema version is rebuilt.
+
+    Index updates use a single writer connection. With an index file,
+    searches use a pool of up to `readers` read-only connections and run
+    concurrently with each other and with updates. An in-memory index is
+    searched through the writer connection, one query at a time. Searches
+    taking longer than `timeout` seconds are interrupted.
+    """
+
+    def __init__(
+        self,
+        graph: rdflib.Graph,
+        path: str | None = None,
+        *,
+        readers: int = 4,
+        timeout: float | None = None,
+    ):
+        self._path = path or ":memory:"
+        self._index = self._open()
+        self._lock = threading.Lock()
+        self.timeout = timeout
+        self._readers: queue.LifoQueue[sqlite3.Connection] = queue.LifoQueue()
+        self._reader_slots = threading.BoundedSemaphore(readers)
+        self._executor = concurrent.futures.ThreadPoolExecutor(
+            readers, thread_name_prefix="search"
         )
         self._indexed_resources: dict[rdflib.URIRef, IndexedResource] = {}
         self._graph = graph
 
+    def _connect(self) -> sqlite3.Connection:
+        index = sqlite3.connect(self._path, check_same_thread=False)
+        index.row_factory = sqlite3.Row
+        if self._path != ":memory:":
+            index.execute("PRAGMA journal_mode=WAL")
+            index.execute("PRAGMA synchronous=NORMAL")
+        with index:
+            # The resource_fts table is created when the index is configured
+            # since it has a column per indexed predicate. The digest of the
+            # indexed entry for each resource is used to skip unchanged
+            # resources when syncing.
+            index.execute(
+                "CREATE TABLE IF NOT EXISTS resource_index"
+                "(docid INTEGER PRIMARY KEY, uri TEXT UNIQUE, digest TEXT,"
+                " projection TEXT)"
+            )
+            index.execute(
+                "CREATE TABLE IF NOT EXISTS index_state"
+                "(key TEXT PRIMARY KEY, value TEXT)"
+            )
+            index.execute(
+                "INSERT OR IGNORE INTO index_state VALUES ('schema_version', ?)",
+                (str(SCHEMA_VERSION),),
+            )
+        return index
+
+    def _check(self, index: sqlite3.Connection) -> None:
+        row = index.execute(
+            "SELECT value FROM index_state WHERE key = 'schema_version'"
+        ).fetchone()
+        if row["value"] != str(SCHEMA_VERSION):
+            raise sqlite3.DatabaseError(f"Index schema version {row['value']}")
+        if (result := index.execute("PRAGMA quick_check").fetchone()[0]) != "ok":
+            raise sqlite3.DatabaseError(result)
+        if _has_fts_table(index):
+            index.execute(
+                "INSERT INTO resource_fts(resource_fts) VALUES('integrity-check')"
+            )
+
+    def _open(self) -> sqlite3.Connection:
+        if self._path == ":memory:":
+            return self._connect()
+        index: sqlite3.Connection | None = None
+        try:
+            index = self._connect()
+            self._check(index)
+            return index
+        except sqlite3.DatabaseError as ex:
+            log.warning("Rebuilding search index %s: %s", self._path, ex)
+            if index is not None:
+                index.close()
+            for suffix in ("", "-wal", "-shm"):
+                with contextlib.suppress(FileNotFoundError):
+                    os.remove(self._path + suffix)
+            return self._connect()
+
+    def close(self) -> None:
+        self._executor.shutdown()
+        while not self._readers.empty():
+            self._readers.get().close()
+        self._index.close()
+
+    @staticmethod
+    def _execute(
+        index: sqlite3.Connection,
+        sql: str,
+        params: list[Any],
+        timeout: float | None,
+    ) -> list[sqlite3.Row]:
+        if timeout is None:
+            return index.execute(sql, params).fetchall()
+        deadline = time.monotonic() + timeout
+        index.set_progress_handler(
+            lambda: time.monotonic() > deadline, PROGRESS_INSTRUCTIONS
+        )
+        try:
+            return index.execute(sql, params).fetchall()
+        except sqlite3.OperationalError as ex:
+            if time.monotonic() > deadline:
+                raise SearchTimeout(f"Search exceeded {timeout}s") from ex
+            raise
+        finally:
+            index.set_progress_handler(None, 0)
+
+    @contextlib.contextmanager
+    def _reader(self) -> Iterator[sqlite3.Connection]:
+        if self._path == ":memory:":
+            with self._lock:
+                yield self._index
+            return
+        with self._reader_slots:
+            try:
+                index = self._readers.get_nowait()
+            except queue.Empty:
+                uri = pathlib.Path(self._path).absolute().as_uri() + "?mode=ro"
+                index = sqlite3.connect(uri, uri=True, check_same_thread=False)
+                index.row_factory = sqlite3.Row
+            try:
+                yield index
+            finally:
+                self._readers.put(index)
+
     def add_index(self, resource_config: IndexedResource) -> None:
         self._indexed_resources[resource_config.type] = resource_config
 
@@ -50,59 +232,346 @@ class SearchEngine:
         objs = list(self._graph.objects(subject=subject, predicate=predicate))
         return objs[0] if len(objs) > 0 else None
 
+    def _columns(self) -> dict[rdflib.URIRef, str]:
+        """The FTS column for each indexed predicate."""
+        predicates = {
+            pred
+            for config in self._indexed_resources.values()
+            for pred in config.indexed
+        }
+        return {pred: f"c{i}" for i, pred in enumerate(sorted(predicates))}
+
+    def _weights(self, columns: dict[rdflib.URIRef, str]) -> list[float]:
+        weights = {pred: 1.0 for pred in columns}
+        for config in self._indexed_resources.values():
+            for pred, weight in config.weights.items():
+                weights[cast(rdflib.URIRef, pred)] = weight
+        return [weights[pred] for pred in columns]
+
+    def _projection(
+        self, subject: rdflib.URIRef, subject_type: str, config: IndexedResource
+    ) -> dict[str, Any]:
+        result: dict[str, Any] = {"id": str(subject), "type": subject_type}
+        for pred in cast(list[rdflib.URIRef], config.projected):
+            values: list[str] | str = [
+                str(obj) for obj in self._graph.objects(subject, pred)
+            ]
+            if values:
+                result[pred.fragment or str(pred)] = (
+                    values[0] if len(values) == 1 else values
+                )
+        return result
+
+    def _entry(self, subject: rdflib.URIRef) -> Entry | None:
+        """The type, column texts and projection to index for a subject."""
+        resource_type = self._get_object(subject, rdflib.RDF.type)
+        if config := self._indexed_resources.get(resource_type):
+            columns = self._columns()
+            texts = {}
+            for pred in config.indexed:
+                if objects := list(self._graph.objects(subject, pred)):
+                    texts[columns[cast(rdflib.URIRef, pred)]] = " ".join(objects)
+            projection = self._projection(subject, str(resource_type), config)
+            return str(resource_type), texts, projection
+        return None
+
+    def _state(self, key: str) -> str | None:
+        row = self._index.execute(
+            "SELECT value FROM index_state WHERE key = ?", (key,)
+        ).fetchone()
+        return row["value"] if row else None
+
+    def _set_state(self, key: str, value: str) -> None:
+        self._index.execute(
+            "INSERT OR REPLACE INTO index_state VALUES (?, ?)", (key, value)
+        )
+
+    def _configure(self) -> bool:
+        """(Re)create an empty index if the indexed resources changed.
+
+        Returns whether the index was recreated. Must be called in a
+        transaction.
+        """
+        columns = self._columns()
+        weights = self._weights(columns)
+        config = sorted(
+            (str(c.type), [str(p) for p in c.indexed])
+            for c in self._indexed_resources.values()
+        )
+        fingerprint = hashlib.sha256(json.dumps([config, weights]).encode()).hexdigest()
+        if self._state("config") == fingerprint:
+            return False
+        self._index.execute("DROP TABLE IF EXISTS resource_fts")
+        self._index.execute(
+            "CREATE VIRTUAL TABLE resource_fts USING fts5"
+            f"(uri UNINDEXED, type UNINDEXED, {', '.join(columns.values())})"
+        )
+        # The uri and type columns don't contribute to the bm25 ranking
+        bm25_weights = ", ".join(map(str, [0.0, 0.0, *weights]))
+        self._index.execute(
+            "INSERT INTO resource_fts(resource_fts, rank) VALUES('rank', ?)",
+            (f"bm25({bm25_weights})",),
+        )
+        self._index.execute("DELETE FROM resource_index")
+        self._set_state("config", fingerprint)
+        return True
+
+    def _digest(self, entry: Entry) -> str:
+        return hashlib.sha256(json.dumps(entry, sort_keys=True).encode()).hexdigest()
+
+    def _write(
+        self,
+        upserts: list[tuple[str, str, dict[str, str], dict[str, Any], str]],
+        deletes: list[str],
+    ) -> None:
+        """Replace (uri, type, texts, projection, digest) rows and delete rows.
+
+        A resource keeps its rowid when it's re-indexed. Must be called in
+        a transaction.
+        """
+        for batch in _batched([u[0] for u in upserts] + deletes, BATCH_SIZE):
+            self._index.executemany(
+                "DELETE FROM resource_fts WHERE rowid = "
+                "(SELECT docid FROM resource_index WHERE uri = ?)",
+                ((uri,) for uri in batch),
+            )
+        for batch in _batched(deletes, BATCH_SIZE):
+            self._index.executemany(
+                "DELETE FROM resource_index WHERE uri = ?", ((uri,) for uri in batch)
+            )
+        columns = list(self._columns().values())
+        for batch in _batched(upserts, BATCH_SIZE):
+            self._index.executemany(
+                "INSERT INTO resource_index(uri, digest, projection) VALUES (?, ?, ?) "
+                "ON CONFLICT(uri) DO UPDATE "
+                "SET digest = excluded.digest, projection = excluded.projection",
+                (
+                    (uri, digest, json.dumps(projection))
+                    for uri, _, _, projection, digest in batch
+                ),
+            )
+            self._index.executemany(
+                f"INSERT INTO resource_fts(rowid, uri, type, {', '.join(columns)}) "
+                f"SELECT docid, uri, ?, {', '.join('?' * len(columns))} "
+                "FROM resource_index WHERE uri = ?",
+                (
+                    (type_, *(texts.get(c, "") for c in columns), uri)
+                    for uri, type_, texts, _, _ in batch
+                ),
+            )
+
+    def sync_index(self) -> int:
+        """Bring the index up to date with the graph.
+
+        Only resources whose indexed text changed since they were last
+        indexed are written. The whole index is rebuilt if the indexed
+        resource configuration changed. Returns the number of resources
+        (re)indexed or removed.
+        """
+        with self._lock, self._index:
+            self._configure()
+            changed = self._sync()
+        log.info("Search index synced, %d resources changed", changed)
+        return changed
+
+    def _sync(self) -> int:
+        """Index the changed resources of the whole graph.
+
+        Must be called with the lock held, in a transaction.
+        """
+        stored = {
+            row["uri"]: row["digest"]
+            for row in self._index.execute("SELECT uri, digest FROM resource_index")
+        }
+        upserts = []
+        for subject in self._graph.subjects(predicate=rdflib.RDF.type, unique=True):
+            if (entry := self._entry(subject)) is None:
+                continue
+            uri = str(subject)
+            digest = self._digest(entry)
+            if stored.pop(uri, None) != digest:
+                upserts.append((uri, *entry, digest))
+        self._write(upserts, list(stored))
+        return len(upserts) + len(stored)
+
+    def update_subjects(self, uris: Iterable[str]) -> None:
+        """Re-index resources, or remove them if they're no longer indexed.
+
+        The whole graph is indexed instead if the indexed resource
+        configuration changed, since that empties the index.
+        """
+        upserts = []
+        deletes = []
+        for uri in set(uris):
+            if entry := self._entry(rdflib.URIRef(uri)):
+                upserts.append((uri, *entry, self._digest(entry)))
+            else:
+                deletes.append(uri)
+        with self._lock, self._index:
+            if self._configure():
+                changed = self._sync()
+                log.info("Search index rebuilt, %d resources indexed", changed)
+                return
+            self._write(upserts, deletes)
+        log.debug("Indexed %d, removed %d", len(upserts), len(deletes))
+
     def update_index(self, subject: rdflib.URIRef | None = None) -> None:
         if subject is None:
-            subjects = self._graph.subjects(predicate=rdflib.RDF.type, unique=True)
+            self.sync_index()
         else:
-            subjects = [subject]
-
-        for subject in subjects:
-            resource_type = self._get_object(subject, rdflib.RDF.type)
-            if config := self._indexed_resources.get(resource_type):
-                text = ""
-                for pred in config.indexed:
-                    if objects := list(self._graph.objects(subject, pred)):
-                        text += " " + ",".join(objects)
-                self._index.execute(
-                    "INSERT INTO resource_fts(uri, type, text) VALUES (?, ?, ?)",
-                    (subject.toPython(), resource_type, text),
-                )
-                log.info("Indexed %s", subject)
-
-    def _projection(self, uri: str, subject_type: str) -> dict:
-        result: dict[str, Any] = {"id": uri, "type": subject_type}
-        subject = _ensure_uri(uri)
-        if config := self._indexed_resources.get(_ensure_uri(subject_type)):
-            for pred in cast(rdflib.URIRef, config.projected):
-                values: list[str] | str = [
-                    str(obj) for obj in self._graph.objects(subject, pred)
-                ]
-                if len(values) == 1:
-                    values = values[0]
-                result[pred.fragment] = values
-        return result
+            self.update_subjects([str(subject)])
+
+    def search(
+        self,
+        query: str,
+        *,
+        types: Iterable[rdflib.URIRef | str] | None = None,
+        limit: int = DEFAULT_LIMIT,
+        cursor: str | None = None,
+        highlight: tuple[str, str] = ("<b>", "</b>"),
+        timeout: float | None = None,
+    ) -> SearchPage:
+        """Search the index, most relevant (bm25) results first.
+
+        Each result includes a snippet of the matching text with the
+        matched terms highlighted.
+        """
+        sql = (
+            "SELECT resource_fts.rowid AS rowid, type, rank, projection, "
+            "snippet(resource_fts, -1, ?, ?, '…', ?) AS snippet "
+            "FROM resource_fts JOIN resource_index ON docid = resource_fts.rowid "
+            "WHERE resource_fts MATCH ?"
+        )
+        params: list[Any] = [*highlight, SNIPPET_TOKENS, query]
+        if types is not None:
+            types = [str(t) for t in types]
+            sql += f" AND type IN ({', '.join('?' * len(types))})"
+            params.extend(types)
+        if cursor is not None:
+            rank, _, rowid = cursor.rpartition(":")
+            sql += " AND (rank > ? OR (rank = ? AND resource_fts.rowid > ?))"
+            params.extend([float(rank), float(rank), int(rowid)])
+        sql += " ORDER BY rank, resource_fts.rowid LIMIT ?"
+        params.append(limit + 1)
+        with self._reader() as index:
+            if not _has_fts_table(index):
+                return SearchPage([])
+            rows = self._execute(
+                index, sql, params, self.timeout if timeout is None else timeout
+            )
+        page = SearchPage(
+            [
+                json.loads(row["projection"]) | {"snippet": row["snippet"]}
+                for row in rows[:limit]
+            ]
+        )
+        if len(rows) > limit:
+            last = rows[limit - 1]
+            page.cursor = f"{last['rank']!r}:{last['rowid']}"
+        return page
 
-    def search(self, query: str) -> list[dict]:
-        cursor = self._index.execute(
-            "SELECT uri, type from resource_fts WHERE text MATCH ?",
-            (query,),
+    async def asearch(self, query: str, **kwargs: Any) -> SearchPage:
+        """Search without blocking the event loop (see search)."""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            self._executor, functools.partial(self.search, query, **kwargs)
         )
-        return [self._projection(row["uri"], row["type"]) for row in cursor.fetchall()]
 
-    def __call__(self, query: str) -> JSONResponse:
-        subjects = self.search(query)
+    def _response(self, page: SearchPage) -> JSONResponse:
+        """The page's results, with the cursor for the next page (if any)
+        in the X-Next-Cursor header."""
         results = []
-        for subject in subjects:
-            subject_uri = rdflib.URIRef(subject)
-            resource_type = self._get_object(subject_uri, rdflib.RDF.type)
-            if config := self._indexed_resources.get(resource_type):
-                resource = {}
-                if config.context:
-                    resource["@context"] = config.context
-                resource["id"] = subject
-                for pred in cast(rdflib.URIRef, config.projected):
-                    if objects := list(self._graph.objects(subject_uri, pred)):
-                        key = pred.fragment or str(pred)
-                        resource[key] = ",".join(objects)
-                results.append(resource)
-        return JSONResponse(results)
+        for result in page.results:
+            del result["snippet"]
+            config = self._indexed_resources.get(_ensure_uri(result["type"]))
+            if config and config.context:
+                result = {"@context": config.context} | result
+            results.append(result)
+        headers = {"X-Next-Cursor": page.cursor} if page.cursor else None
+        return JSONResponse(results, headers=headers)
+
+    def __call__(
+        self, query: str, limit: int = DEFAULT_LIMIT, cursor: str | None = None
+    ) -> JSONResponse:
+        return self._response(self.search(query, limit=limit, cursor=cursor))
+
+    async def response(
+        self, query: str, limit: int = DEFAULT_LIMIT, cursor: str | None = None
+    ) -> JSONResponse:
+        return self._response(await self.asearch(query, limit=limit, cursor=cursor))
+
+
+class IndexUpdater:
+    """Applies search index updates for changed resources in the background.
+
+    Register it with RdfDataSet.register_cache so store writes enqueue
+    updates. Changes arriving within the delay are coalesced into one
+    batched index write. If the changed resources aren't known, the index
+    is synced with the graph. Failed updates are kept and retried after the
+    next delay.
+
+    RdfDataSet only holds registered caches weakly, so the caller must keep
+    a reference to the updater for as long as it should run.
+    """
+
+    def __init__(self, engine: SearchEngine, delay: float = 0.5):
+        self.engine = engine
+        self.delay = delay
+        self._pending: set[str] = set()
+        self._sync = False
+        self._condition = threading.Condition()
+        self._closed = False
+        self._thread = threading.Thread(
+            target=self._run, name="search-index-updater", daemon=True
+        )
+        self._thread.start()
+
+    def invalidate(self, subjects: Iterable[str] | None = None) -> None:
+        with self._condition:
+            if subjects is None:
+                self._sync = True
+            else:
+                self._pending.update(subjects)
+            self._condition.notify()
+
+    def flush(self) -> None:
+        """Apply the pending updates now."""
+        with self._condition:
+            pending, self._pending = self._pending, set()
+            sync, self._sync = self._sync, False
+        try:
+            if sync:
+                self.engine.sync_index()
+            elif pending:
+                self.engine.update_subjects(pending)
+        except BaseException:
+            with self._condition:
+                self._pending |= pending
+                self._sync |= sync
+            raise
+
+    def _run(self) -> None:
+        while True:
+            with self._condition:
+                while not (self._pending or self._sync or self._closed):
+                    self._condition.wait()
+                if self._closed:
+                    return
+                # Wait for more changes to coalesce
+                deadline = time.monotonic() + self.delay
+                while (
+                    not self._closed and (remaining := deadline - time.monotonic()) > 0
+                ):
+                    self._condition.wait(remaining)
+            try:
+                self.flush()
+            except Exception:
+                log.exception("Search index update failed")
+
+    def close(self) -> None:
+        """Stop the worker after applying the pending updates."""
+        with self._condition:
+            self._closed = True
+            self._condition.notify()
+        self._thread.join()
+        self.flush()
@@ -1,16 +1,59 @@
-from rdflib_endpoint import SparqlEndpoint
+from typing import Any, Mapping
 
+from rdflib.plugins.sparql import prepareQuery
+from rdflib.plugins.sparql.sparql import Query
+from rdflib_endpoint import SparqlEndpoint, sparql_router
+
+from firm_ld.cache import QueryCache
 from firm_ld.store import RdfDataSet
+from firm_ld.streaming import BudgetProcessor, query_stream_endpoint
+
+
+def _prepare_query(
+    query: str, initNs: Mapping[str, Any] | None = None, base: str | None = None
+) -> Query:
+    """Prepares the endpoint's queries with the dataset's query cache."""
+    query_cache = getattr(RdfDataSet.VALUE, "query_cache", None)
+    if query_cache is None or base is not None:
+        return prepareQuery(query, initNs=initNs, base=base)
+    return query_cache.prepare(query, initNs)
 
 
-def create_sparql_endpoint(public_url: str, **kwargs) -> SparqlEndpoint:
+def create_sparql_endpoint(
+    public_url: str,
+    cache_size: int | None = 256,
+    stream_path: str = "/stream",
+    timeout: float | None = None,
+    max_rows: int | None = None,
+    **kwargs,
+) -> SparqlEndpoint:
+    """Create an endpoint for the configured dataset.
+
+    Unless cache_size is None, prepared queries and results are cached
+    (see QueryCache) until the next write. Queries are limited by the
+    timeout (seconds) and max_rows. Their results are also streamed from
+    stream_path.
+    """
     dataset = RdfDataSet.VALUE
     if dataset is None:
         raise Exception("Dataset is not initialize")
-    return SparqlEndpoint(
+    if cache_size is not None:
+        dataset.query_cache = QueryCache(cache_size)
+        RdfDataSet.register_cache(dataset.query_cache)
+        # The query route prepares queries itself, with this module global
+        sparql_router.prepareQuery = _prepare_query
+    if timeout is not None or max_rows is not None:
+        kwargs.setdefault("processor", BudgetProcessor(dataset, timeout, max_rows))
+    endpoint = SparqlEndpoint(
         graph=dataset,
         description="A SPARQL endpoint for serving pod data.",
         enable_update=True,
         public_url=public_url,
         **kwargs,
     )
+    endpoint.add_route(
+        stream_path,
+        query_stream_endpoint(dataset, timeout=timeout, max_rows=max_rows),
+        methods=["GET", "POST"],
+    )
+    return endpoint
@@ -1,16 +1,40 @@
+import asyncio
+import contextlib
+import itertools
 import logging
+import weakref
+from dataclasses import dataclass
+from typing import Any, AsyncIterator, Callable, Iterable, Iterator, TypeVar
 
 import rdflib
 from firm.interfaces import JSONObject, QueryCriteria, ResourceStore
 from firm.store.base import ResourceStoreBase
-from pyld import jsonld
+from rdflib.plugins.sparql.processor import SPARQLProcessor
+from rdflib.plugins.sparql.sparql import Query
+from rdflib.query import Result
 
+from firm_ld.cache import Invalidatable, ObjectCache, QueryCache
+from firm_ld.criteria import expand_property, match_subjects
+from firm_ld.delta import Delta, compute_delta, move_delta
+from firm_ld.executor import StoreExecutor
+from firm_ld.group_commit import WriteBatch, WriteQueue
+from firm_ld.index import PropertyIndex
 from firm_ld.jsonld_utils import (
-    JSONLD_CONTEXT,
-    httpx_document_loader,
+    blank_node_closure,
+    context_urls,
+    convert_document,
+    document_loader,
     jsonld_to_graph,
     subject_to_jsonld,
 )
+from firm_ld.ordered import (
+    ORDERED_LIST,
+    OrderedItems,
+    OrderedListIndex,
+    add_entry,
+    remove_ordered_lists,
+)
+from firm_ld.partition import GraphDirectory, PartitionPolicy, resource_root
 
 # This store must assume that the objects being provided are
 # JSON-LD. If there is no @context, the store will add a default
@@ -19,13 +43,98 @@ from firm_ld.jsonld_utils import (
 
 log = logging.getLogger(__name__)
 
+T = TypeVar("T")
+
+DEFAULT_INDEX_PREDICATES = (
+    "type",
+    "attributedTo",
+    "inReplyTo",
+    "object",
+    "actor",
+    "firm:*",
+)
+
+
+@dataclass
+class BatchResult:
+    """The outcome of storing or removing one object in a bulk operation."""
+
+    uri: str | None
+    error: Exception | None = None
+
+    @property
+    def ok(self) -> bool:
+        return self.error is None
+
+
+def _batched(items: Iterable[Any], size: int) -> Iterator[list[Any]]:
+    iterator = iter(items)
+    while batch := list(itertools.islice(iterator, size)):
+        yield batch
+
+
+# A dictionary-encoded in-memory store (see firm_ld.triple_store)
+rdflib.plugin.register(
+    "Compact", rdflib.store.Store, "firm_ld.triple_store", "CompactStore"
+)
+
+
+class _Dataset(rdflib.Dataset):
+    # Set by create_sparql_endpoint
+    query_cache: QueryCache | None = None
+
+    def query(self, query_object: Any, *args: Any, **kwargs: Any) -> Result:
+        text, init_ns, base = query_object, kwargs.get("initNs"), None
+        prepared = None
+        if isinstance(query_object, Query):
+            # The endpoint prepares queries itself (see rdflib_endpoint).
+            # A prepared query keeps its text and namespaces.
+            text, init_ns, base = getattr(
+                query_object, "_original_args", (None, None, None)
+            )
+            prepared = query_object
+        # The endpoint's processor can apply a budget (see BudgetProcessor)
+        processor = kwargs.get("processor", "sparql")
+        if (
+            self.query_cache is None
+            or not isinstance(text, str)
+            or base is not None
+            or args
+            or set(kwargs) - {"initNs", "initBindings", "processor"}
+            or not (processor == "sparql" or isinstance(processor, SPARQLProcessor))
+        ):
+            return super().query(query_object, *args, **kwargs)
+        init_ns = init_ns or dict(self.namespaces())
+        init_bindings = kwargs.get("initBindings") or {}
+        return self.query_cache.query(
+            text,
+            lambda prepared: super(_Dataset, self).query(
+                prepared,
+                processor=processor,
+                initNs=init_ns,
+                initBindings=init_bindings,
+            ),
+            init_ns,
+            init_bindings,
+            prepared,
+            processor,
+        )
+
+    def update(self, *args: Any, **kwargs: Any) -> None:
+        # SPARQL updates (e.g., from the endpoint) don't report what changed
+        try:
+            super().update(*args, **kwargs)
+        finally:
+            RdfDataSet.notify_write()
+
 
 class RdfDataSet:
     VALUE: rdflib.Graph | None = None
+    _caches: "weakref.WeakSet[Invalidatable]" = weakref.WeakSet()
 
     @classmethod
     def configure(cls, store_name: str, store_args: list[str]) -> None:
-        dataset = rdflib.Dataset(store=store_name)
+        dataset = _Dataset(store=store_name)
         result = dataset.open(*store_args)
         if result != 1:  # TODO
             raise Exception("Store open error")
@@ -37,11 +146,76 @@ class RdfDataSet:
             cls.VALUE.close()
         cls.VALUE = None
 
+    @classmethod
+    def register_cache(cls, cache: Invalidatable) -> None:
+        cls._caches.add(cache)
+
+    @classmethod
+    def notify_write(cls, subjects: Iterable[str] | None = None) -> None:
+        """Invalidate cached objects (and indexes) after a write.
+
+        If the changed subjects aren't known, all cached objects are dropped.
+        Anything else that tracks stored resources, like a search
+        IndexUpdater, can be registered with register_cache too.
+        """
+        if subjects is not None:
+            subjects = list(subjects)
+        for cache in list(cls._caches):
+            cache.invalidate(subjects)
+
 
 class RdfResourceStore(ResourceStoreBase, ResourceStore):
-    def __init__(self, graph: str | rdflib.Graph | None = None) -> None:
-        if isinstance(graph, rdflib.Dataset):
-            # TODO support named graphs
+    def __init__(
+        self,
+        graph: str | rdflib.Graph | None = None,
+        *,
+        converter: Callable[[JSONObject], rdflib.Graph] = jsonld_to_graph,
+        serializer: Callable[
+            [rdflib.Graph, str], JSONObject | None
+        ] = subject_to_jsonld,
+        cache_size: int | None = None,
+        batch_size: int = 500,
+        delta_writes: bool = False,
+        index_predicates: Iterable[str] | None = None,
+        executor: StoreExecutor | None = None,
+        partition: PartitionPolicy | None = None,
+        group_commit: float | None = None,
+        group_commit_size: int = 100,
+    ) -> None:
+        # converter and serializer can be firm_ld.as2.as2_to_graph
+        # and firm_ld.as2.graph_to_as2 for the AS2 fast paths
+        self._converter = converter
+        # Without an executor, the work is done on the event loop
+        self.executor = executor
+        self._serializer = serializer
+        self.batch_size = batch_size
+        self.delta_writes = delta_writes
+        # Concurrent puts and removes within group_commit seconds (or up to
+        # group_commit_size of them) are committed in one transaction
+        self.write_queue: WriteQueue | None = None
+        if group_commit is not None:
+            if delta_writes:
+                raise Exception("Delta writes can't be grouped")
+            self.write_queue = WriteQueue(
+                self._commit_batch, max_batch=group_commit_size, max_delay=group_commit
+            )
+        self.cache = ObjectCache(cache_size) if cache_size else None
+        if self.cache is not None:
+            RdfDataSet.register_cache(self.cache)
+        # With a partition policy (see firm_ld.partition), objects are stored
+        # in the named graphs of a dataset (the configured one by default)
+        self.partition = partition
+        self.directory: GraphDirectory | None = None
+        if partition is not None:
+            dataset = RdfDataSet.VALUE if graph is None else graph
+            if not isinstance(dataset, rdflib.Dataset):
+                raise Exception("Partitioning needs a dataset")
+            self.dataset = dataset
+            # Reads and queries that aren't limited to a partition use the union
+            self.graph = rdflib.Dataset(store=dataset.store, default_union=True)
+            self.directory = GraphDirectory(dataset)
+            RdfDataSet.register_cache(self.directory)
+        elif isinstance(graph, rdflib.Dataset):
             self.graph = graph.default_context
         elif isinstance(graph, rdflib.Graph):
             self.graph = graph
@@ -51,66 +225,428 @@ class RdfResourceStore(ResourceStoreBase, ResourceStore):
             self.graph = RdfDataSet.VALUE.graph(graph)
         else:
             raise Exception(f"Incorrect graph type {type(graph)}")
+        # Ordered collections are read by pages from this side index
+        self.ordered_lists = OrderedListIndex(self.graph)
+        RdfDataSet.register_cache(self.ordered_lists)
+        # Property terms (e.g., "attributedTo") or namespaces (e.g., "firm:*")
+        # to index for equality criteria. See DEFAULT_INDEX_PREDICATES.
+        self.index: PropertyIndex | None = None
+        if index_predicates is not None:
+            self.index = PropertyIndex(
+                self.graph,
+                (
+                    (
+                        expand_property(term[:-1]) + "*"
+                        if term.endswith("*")
+                        else expand_property(term)
+                    )
+                    for term in index_predicates
+                ),
+            )
+            RdfDataSet.register_cache(self.index)
+
+    async def _read(self, fn: Callable[..., T], *args: Any) -> T:
+        if self.executor is None:
+            return fn(*args)
+        return await self.executor.read(fn, *args)
+
+    async def _write(self, fn: Callable[..., T], *args: Any) -> T:
+        if self.executor is None:
+            return fn(*args)
+        return await self.executor.write(fn, *args)
+
+    async def _convert(self, obj: JSONObject) -> rdflib.Graph:
+        # Remote contexts are loaded without blocking the event loop
+        await document_loader.prefetch(context_urls(obj.get("@context")))
+        if self.executor is None:
+            return convert_document(self._converter, obj)
+        return await self.executor.convert(convert_document, self._converter, obj)
 
     async def get(self, uri: str) -> JSONObject | None:
         """Retrieve Object based on uri"""
-        return subject_to_jsonld(self.graph, uri)
+        if self.write_queue is not None:
+            await self.write_queue.settle(uri)
+        return await self._read(self._get, uri)
+
+    def _partition_graph(self, partition: str | None) -> rdflib.Graph:
+        if partition is None:
+            return self.dataset.default_context
+        return self.dataset.get_context(rdflib.URIRef(partition))
+
+    def _graph_for(self, subject: rdflib.term.Node) -> rdflib.Graph:
+        """The graph holding a subject (its partition, if partitioned)."""
+        if self.directory is None:
+            return self.graph
+        if isinstance(subject, rdflib.BNode):
+            return self.dataset.default_context
+        return self._partition_graph(self.directory.get(str(subject)))
+
+    def _partition_of(self, resource: rdflib.Graph) -> str | None:
+        assert self.partition is not None
+        if (root := resource_root(resource)) is None:
+            return None
+        return self.partition.partition(resource, root)
+
+    def _update_directory(self, resource: rdflib.Graph, partition: str | None) -> None:
+        if self.directory is not None:
+            self.directory.set(
+                (
+                    str(s)
+                    for s in set(resource.subjects())
+                    if isinstance(s, rdflib.URIRef)
+                ),
+                partition,
+            )
+
+    def partition_graph(self, partition: str) -> rdflib.Graph:
+        """The named graph of a partition (e.g., to export it)."""
+        if self.directory is None:
+            raise Exception("The store isn't partitioned")
+        return self._partition_graph(partition)
+
+    def _get(self, uri: str) -> JSONObject | None:
+        graph = self._graph_for(rdflib.URIRef(uri))
+        if self.cache is None:
+            return self._serializer(graph, uri)
+        if (obj := self.cache.get(uri)) is not None:
+            return obj
+        generation = self.cache.generation
+        obj = self._serializer(graph, uri)
+        if obj is not None:
+            closure = blank_node_closure(graph, rdflib.URIRef(uri))
+            self.cache.put(uri, obj, map(str, closure), generation)
+        return obj
+
+    def _get_many(self, uris: list[str]) -> list[JSONObject | None]:
+        """Read several objects in one call (one executor round trip).
+
+        Each object's description is still read and compacted separately.
+        """
+        return [self._get(uri) for uri in uris]
 
     async def is_stored(self, uri: str) -> bool:
-        return (rdflib.URIRef(uri), None, None) in self.graph
-
-    async def put(self, obj: JSONObject) -> None:
-        """Store an AP Object"""
-        # Should replace existing triples (maybe patch?)
-        if "@context" not in obj:
-            obj.update(JSONLD_CONTEXT)
-        # TODO Review the context setup
-        obj["@context"] = [
-            obj["@context"],
-            "https://w3c-ccg.github.io/security-vocab/contexts/security-v1.jsonld",
-            {"firm": "https://firm.stevebate.dev#"},
-        ]
-        resource = jsonld_to_graph(obj)
-        for subject in resource.subjects():
-            self.graph.remove((subject, None, None))
-        self.graph += resource
+        if self.write_queue is not None:
+            await self.write_queue.settle(uri)
+        return await self._read(
+            self.graph.__contains__, (rdflib.URIRef(uri), None, None)
+        )
+
+    @contextlib.contextmanager
+    def _transaction(self, subjects: set[rdflib.term.Node]) -> Iterator[None]:
+        """Commit (or roll back) the writes in the block as one transaction.
+
+        Cached objects for the subjects added to the set are invalidated.
+        """
+        try:
+            yield
+            if self.graph.store.transaction_aware:
+                self.graph.commit()
+        except Exception:
+            if self.graph.store.transaction_aware:
+                self.graph.rollback()
+            raise
+        finally:
+            RdfDataSet.notify_write(str(subject) for subject in subjects)
+
+    def _apply(
+        self, removals: Iterable[rdflib.term.Node], additions: Iterable[rdflib.Graph]
+    ) -> None:
+        """Replace the triples of the removed subjects with the additions."""
+        removed = set(removals)
+        if self.partition is None:
+            with self._transaction(removed):
+                for subject in removed:
+                    remove_ordered_lists(self.graph, subject)
+                    self.graph.remove((subject, None, None))
+                self.graph.addN(
+                    (s, p, o, self.graph)
+                    for resource in additions
+                    for s, p, o in resource
+                )
+            return
+        placed = [(resource, self._partition_of(resource)) for resource in additions]
+        with self._transaction(removed):
+            for subject in removed:
+                graph = self._graph_for(subject)
+                remove_ordered_lists(graph, subject)
+                graph.remove((subject, None, None))
+            for resource, partition in placed:
+                graph = self._partition_graph(partition)
+                graph.addN((s, p, o, graph) for s, p, o in resource)
+        # After the transaction, which invalidates the removed subjects
+        for resource, partition in placed:
+            self._update_directory(resource, partition)
+
+    def _apply_delta(
+        self,
+        delta: Delta,
+        source: rdflib.Graph | None = None,
+        target: rdflib.Graph | None = None,
+    ) -> None:
+        """Remove triples from the source graph and add them to the target."""
+        source = self.graph if source is None else source
+        target = self.graph if target is None else target
+        with self._transaction(delta.subjects):
+            for triple in delta.removed:
+                source.remove(triple)
+            target.addN((s, p, o, target) for s, p, o in delta.added)
+
+    async def put(self, obj: JSONObject) -> Delta | None:
+        """Store an AP Object
+
+        With delta writes enabled, only the changed triples are written and
+        the delta is returned.
+        """
+        if self.write_queue is not None:
+            await self.write_queue.put(await self._convert(obj))
+            return None
+        return await self._write(self._put, await self._convert(obj))
+
+    def _put(self, resource: rdflib.Graph) -> Delta | None:
+        if self.delta_writes:
+            if self.partition is None:
+                delta = compute_delta(self.graph, resource)
+                if delta:
+                    self._apply_delta(delta)
+                return delta
+            partition = self._partition_of(resource)
+            target = self._partition_graph(partition)
+            root = resource_root(resource)
+            source = target if root is None else self._graph_for(root)
+            if source.identifier == target.identifier:
+                delta = compute_delta(source, resource)
+            else:
+                # The object moved to another partition (e.g., a new actor)
+                delta = move_delta(source, resource)
+            if delta:
+                self._apply_delta(delta, source, target)
+                self._update_directory(resource, partition)
+            return delta
+        self._apply(resource.subjects(), [resource])
+        return None
+
+    async def put_many(
+        self, objs: Iterable[JSONObject], batch_size: int | None = None
+    ) -> list[BatchResult]:
+        """Store objects, committing each batch in one transaction."""
+        results: list[BatchResult] = []
+        for batch in _batched(objs, batch_size or self.batch_size):
+            # Later versions of an object in the batch replace earlier ones
+            resources: dict[Any, rdflib.Graph] = {}
+            batch_results: list[BatchResult] = []
+            conversions = await asyncio.gather(
+                *(self._convert(obj) for obj in batch), return_exceptions=True
+            )
+            for index, (obj, resource) in enumerate(zip(batch, conversions)):
+                result = BatchResult(obj.get("id") or obj.get("@id"))
+                if isinstance(resource, Exception):
+                    result.error = resource
+                else:
+                    resources[result.uri or index] = resource
+                batch_results.append(result)
+            try:
+                await self._write(
+                    self._apply,
+                    [s for resource in resources.values() for s in resource.subjects()],
+                    list(resources.values()),
+                )
+            except Exception as ex:
+                for result in batch_results:
+                    result.error = result.error or ex
+            results.extend(batch_results)
+        return results
 
     async def remove(self, uri: str) -> None:
         """Remove an object from the store"""
-        subject = rdflib.URIRef(uri)
-        self.graph.remove((subject, None, None))
-
-    async def query(self, criteria: QueryCriteria) -> list[JSONObject]:
-        # TODO Make prefixes configurable
-        query = """
-PREFIX firm: <https://firm.stevebate.dev#>
-Select ?subject
-Where {
-"""
-        expanded_criteria = jsonld.expand(
+        if self.write_queue is not None:
+            await self.write_queue.remove(uri)
+            return
+        await self._write(self._apply, [rdflib.URIRef(uri)], [])
+
+    async def _commit_batch(self, batch: WriteBatch) -> None:
+        await self._write(self._apply, batch.removals, list(batch.additions.values()))
+
+    async def remove_many(
+        self, uris: Iterable[str], batch_size: int | None = None
+    ) -> list[BatchResult]:
+        """Remove objects, committing each batch in one transaction."""
+        results: list[BatchResult] = []
+        for batch in _batched(uris, batch_size or self.batch_size):
+            batch_results = [BatchResult(uri) for uri in batch]
+            try:
+                await self._write(
+                    self._apply, [rdflib.URIRef(uri) for uri in batch], []
+                )
+            except Exception as ex:
+                for result in batch_results:
+                    result.error = ex
+            results.extend(batch_results)
+        return results
+
+    async def insert_item(
+        self,
+        collection: str,
+        item: str,
+        *,
+        first: bool = False,
+        predicate: str = "orderedItems",
+    ) -> None:
+        """Add an item URI to the end (or start) of an ordered collection.
+
+        Use first for newest-first collections, like outboxes. The list is
+        created if the (stored) collection doesn't have one.
+        """
+        await self._write(
+            self._insert_item,
+            rdflib.URIRef(collection),
+            expand_property(predicate),
+            rdflib.URIRef(item),
+            first,
+        )
+
+    def _insert_item(
+        self,
+        owner: rdflib.URIRef,
+        predicate: rdflib.URIRef,
+        item: rdflib.URIRef,
+        first: bool,
+    ) -> None:
+        found = self.ordered_lists.get(owner, predicate)
+        if found is None and (owner, None, None) not in self.graph:
+            raise Exception(f"Collection not stored: {owner}")
+        node, items = found or (rdflib.BNode(), OrderedItems())
+        position = items.next_position(first)
+        graph = self._graph_for(owner)
+        with self._transaction({owner}):
+            if found is None:
+                graph.add((owner, predicate, node))
+                graph.add((node, rdflib.RDF.type, ORDERED_LIST))
+            add_entry(graph, node, position, item)
+        # The transaction invalidated the owner's lists
+        items.push(position, item, first)
+        self.ordered_lists.put(owner, predicate, node, items)
+
+    async def items(
+        self,
+        collection: str,
+        *,
+        offset: int = 0,
+        limit: int | None = None,
+        predicate: str = "orderedItems",
+    ) -> list[str]:
+        """A page of the items of an ordered collection.
+
+        Unlike get, which only includes the items of small collections
+        (see firm_ld.ordered), this reads a range without loading the rest.
+        """
+        return await self._read(
+            self._items,
+            rdflib.URIRef(collection),
+            expand_property(predicate),
+            offset,
+            limit,
+        )
+
+    def _items(
+        self,
+        owner: rdflib.URIRef,
+        predicate: rdflib.URIRef,
+        offset: int,
+        limit: int | None,
+    ) -> list[str]:
+        if (found := self.ordered_lists.get(owner, predicate)) is None:
+            return []
+        return [str(item) for item in found[1].page(offset, limit)]
+
+    async def remove_partition(self, partition: str) -> None:
+        """Remove a partition (e.g., all of an actor's objects) and its graph."""
+        await self._write(self._remove_partition, partition)
+
+    def _remove_partition(self, partition: str) -> None:
+        graph = self.partition_graph(partition)
+        assert self.directory is not None
+        with self._transaction(set(graph.subjects(unique=True))):
+            self.dataset.remove_graph(graph)
+        self.directory.remove_partition(partition)
+
+    async def query(
+        self,
+        criteria: QueryCriteria,
+        *,
+        order_by: str | None = None,
+        descending: bool = False,
+        after: str | None = None,
+        offset: int = 0,
+        limit: int | None = None,
+    ) -> list[JSONObject]:
+        """Find the objects matching the criteria.
+
+        The results can be ordered by a property (e.g. "published") and
+        paged with offset/limit or with after, the URI of the last object
+        of the previous page.
+        """
+        return [
+            match
+            async for match in self.iter_query(
+                criteria,
+                order_by=order_by,
+                descending=descending,
+                after=after,
+                offset=offset,
+                limit=limit,
+            )
+        ]
+
+    async def iter_query(
+        self,
+        criteria: QueryCriteria,
+        *,
+        order_by: str | None = None,
+        descending: bool = False,
+        after: str | None = None,
+        offset: int = 0,
+        limit: int | None = None,
+    ) -> AsyncIterator[JSONObject]:
+        """Like query, but objects are compacted lazily as they're consumed.
+
+        The matching URIs are found first. Their objects are then read in
+        batches of batch_size, one batch at a time as the previous one is
+        consumed (nothing is prefetched). Pending group commit writes are
+        committed before the matches are found and before each batch is
+        read, so the results include earlier writes.
+        """
+        if self.write_queue is not None:
+            await self.write_queue.settle_all()
+        uris = await self._read(
+            match_subjects,
+            self._query_graph(criteria),
             criteria,
-            dict(
-                expandContext=JSONLD_CONTEXT["@context"],
-                documentLoader=httpx_document_loader,
-            ),
+            order_by,
+            descending,
+            after,
+            offset,
+            limit,
+            self.index,
+        )
+        for batch in _batched(uris, self.batch_size):
+            if self.write_queue is not None:
+                for uri in batch:
+                    await self.write_queue.settle(uri)
+            for match in await self._read(self._get_many, batch):
+                if match is not None:
+                    yield match
+
+    def _query_graph(self, criteria: QueryCriteria) -> rdflib.Graph:
+        """The graph to search: the partitions that can hold the matches."""
+        if self.partition is None:
+            return self.graph
+        if (partitions := self.partition.partitions(criteria)) is None:
+            return self.graph
+        if len(partitions) == 1:
+            return self._partition_graph(partitions[0])
+        return rdflib.graph.ReadOnlyGraphAggregate(
+            [self._partition_graph(partition) for partition in partitions]
         )
-        for pred, (obj,) in expanded_criteria[0].items():
-            if "@value" in obj:
-                if isinstance(obj["@value"], str):
-                    value = obj["@value"]
-                    obj = f'"{value}"'
-            elif "@id" in obj:
-                obj = f"<{obj['@id']}>"
-            if pred == "@type":
-                pred = rdflib.RDF.type
-            query += f"  ?subject <{pred}> {obj} .\n"
-        query += "}"
-        matches: list[JSONObject] = []
-        for result in self.graph.query(query):
-            match = await self.get(str(result[0]))
-            if match:
-                matches.append(match)
-        return matches
 
     def close(self) -> None:
         RdfDataSet.close()
@@ -0,0 +1,450 @@
+"""Streaming SPARQL results with time and row budgets.
+
+Solutions are serialized as the evaluator produces them instead of being
+collected into a result first. A query that runs out of time or rows
+ends the result early (but well-formed) and is reported as truncated.
+
+The same budgets can be applied to queries that aren't streamed (e.g.,
+the endpoint's query route) with a BudgetProcessor.
+"""
+
+import contextlib
+import copy
+import csv
+import io
+import itertools
+import json
+import logging
+import threading
+import time
+import urllib.parse
+from dataclasses import dataclass, field
+from typing import Any, Awaitable, Callable, Iterable, Iterator, Mapping
+
+import rdflib
+import rdflib.plugins.sparql
+from rdflib.plugins.serializers.nt import _nt_row
+from rdflib.plugins.sparql import prepareQuery
+from rdflib.plugins.sparql.algebra import translateQuery
+from rdflib.plugins.sparql.evaluate import _fillTemplate, evalPart, evalQuery
+from rdflib.plugins.sparql.parser import parseQuery
+from rdflib.plugins.sparql.processor import SPARQLProcessor
+from rdflib.plugins.sparql.sparql import Query
+from starlette.requests import Request
+from starlette.responses import PlainTextResponse, Response, StreamingResponse
+from starlette.types import Receive, Scope, Send
+
+log = logging.getLogger(__name__)
+
+TRUNCATED_HEADER = "X-Query-Truncated"
+ERROR_HEADER = "X-Query-Error"
+
+# Rows serialized per chunk of the response
+CHUNK_ROWS = 500
+
+MEDIA_TYPES = {
+    "json": "application/sparql-results+json",
+    "csv": "text/csv",
+    "nt": "application/n-triples",
+}
+
+
+class QueryTimeout(Exception):
+    pass
+
+
+@dataclass
+class QueryBudget:
+    """Limits on the evaluation time (seconds) and rows of a query."""
+
+    timeout: float | None = None
+    max_rows: int | None = None
+    timer: Callable[[], float] = time.monotonic
+    deadline: float | None = field(default=None, init=False)
+
+    def start(self) -> None:
+        if self.timeout is not None:
+            self.deadline = self.timer() + self.timeout
+
+    def check(self) -> None:
+        if self.deadline is not None and self.timer() > self.deadline:
+            raise QueryTimeout(f"Query exceeded {self.timeout}s")
+
+
+def _budget_eval(ctx: Any, part: Any) -> Any:
+    """Checks the budget as each part of the query is evaluated.
+
+    Operators like joins evaluate their parts once per solution, so the
+    check runs often enough to stop a long evaluation. CONSTRUCT queries
+    produce their triples lazily instead of building a graph.
+    """
+    budget = getattr(ctx.prologue, "budget", None)
+    if budget is None:
+        raise NotImplementedError()
+    budget.check()
+    if part.name == "ConstructQuery":
+        template = part.template or part.p.p.triples
+        return {
+            "type_": "CONSTRUCT",
+            "triples": (
+                triple
+                for solution in evalPart(ctx, part.p)
+                for triple in _fillTemplate(template, solution)
+            ),
+        }
+    raise NotImplementedError()
+
+
+_hook_lock = threading.Lock()
+_hook_users = 0
+
+
+@contextlib.contextmanager
+def _budget_hook() -> Iterator[None]:
+    """Registers the budget check while budgeted queries are evaluated.
+
+    Other queries evaluated at the same time skip the check, since they
+    have no budget.
+    """
+    global _hook_users
+    with _hook_lock:
+        _hook_users += 1
+        rdflib.plugins.sparql.CUSTOM_EVALS["firm_ld.budget"] = _budget_eval
+    try:
+        yield
+    finally:
+        with _hook_lock:
+            _hook_users -= 1
+            if not _hook_users:
+                del rdflib.plugins.sparql.CUSTOM_EVALS["firm_ld.budget"]
+
+
+def _with_budget(query: Query, budget: QueryBudget) -> Query:
+    # The prologue is copied so the (possibly shared) prepared query
+    # doesn't hold the budget
+    prologue = copy.copy(query.prologue)
+    prologue.budget = budget  # type: ignore
+    return Query(prologue, query.algebra)
+
+
+class BudgetProcessor(SPARQLProcessor):
+    """Evaluates queries within a time and row budget.
+
+    Unlike a ResultStream, the results are collected, so a query that runs
+    out of time fails (with QueryTimeout). Only the first max_rows
+    solutions (or CONSTRUCT triples) are returned, like a LIMIT.
+    """
+
+    def __init__(
+        self,
+        graph: rdflib.Graph,
+        timeout: float | None = None,
+        max_rows: int | None = None,
+    ):
+        super().__init__(graph)
+        self.timeout = timeout
+        self.max_rows = max_rows
+
+    def query(  # type: ignore[override]
+        self,
+        strOrQuery: str | Query,
+        initBindings: Mapping[str, Any] | None = None,
+        initNs: Mapping[str, Any] | None = None,
+        base: str | None = None,
+        DEBUG: bool = False,
+    ) -> Mapping[str, Any]:
+        if isinstance(strOrQuery, str):
+            strOrQuery = translateQuery(parseQuery(strOrQuery), base, initNs)
+        budget = QueryBudget(self.timeout, self.max_rows)
+        budget.start()
+        with _budget_hook():
+            result = evalQuery(
+                self.graph, _with_budget(strOrQuery, budget), initBindings, base
+            )
+            if result["type_"] == "SELECT":
+                result["bindings"] = list(self._limited(result["bindings"], budget))
+            elif "triples" in result:
+                graph = rdflib.Graph()
+                for triple in self._limited(result.pop("triples"), budget):
+                    graph.add(triple)
+                result["graph"] = graph
+        return result
+
+    @staticmethod
+    def _limited(rows: Iterable[Any], budget: QueryBudget) -> Iterator[Any]:
+        for row in itertools.islice(rows, budget.max_rows):
+            budget.check()
+            yield row
+
+
+class ResultStream:
+    """The serialized results of a query, evaluated as they're read."""
+
+    def __init__(
+        self,
+        graph: rdflib.Graph,
+        query: Query,
+        budget: QueryBudget,
+        format: str,
+        init_bindings: Mapping[str, Any] | None = None,
+        chunk_rows: int = CHUNK_ROWS,
+    ):
+        self.graph = graph
+        self.query = _with_budget(query, budget)
+        self.budget = budget
+        self.format = format
+        self.init_bindings = init_bindings
+        self.chunk_rows = chunk_rows
+        self.rows = 0
+        self.truncated = False
+        self.error: str | None = None
+
+    def _limited(self, rows: Iterable[Any]) -> Iterator[Any]:
+        try:
+            for row in rows:
+                if (
+                    self.budget.max_rows is not None
+                    and self.rows >= self.budget.max_rows
+                ):
+                    self.truncated = True
+                    return
+                self.budget.check()
+                self.rows += 1
+                yield row
+        except QueryTimeout as ex:
+            log.info("Truncated query results: %s", ex)
+            self.truncated = True
+        except Exception as ex:
+            # The response has started, so it can only be ended early
+            log.exception("Query evaluation failed")
+            self.truncated = True
+            self.error = f"{type(ex).__name__}: {ex}"
+
+    def _chunks(self, lines: Iterator[str]) -> Iterator[bytes]:
+        buffer: list[str] = []
+        for line in lines:
+            buffer.append(line)
+            if len(buffer) >= self.chunk_rows:
+                yield "".join(buffer).encode("utf-8")
+                buffer = []
+        if buffer:
+            yield "".join(buffer).encode("utf-8")
+
+    def __iter__(self) -> Iterator[bytes]:
+        # Solutions are evaluated while the chunks are read
+        with _budget_hook():
+            yield from self._evaluate()
+
+    def _evaluate(self) -> Iterator[bytes]:
+        self.budget.start()
+        result = evalQuery(self.graph, self.query, self.init_bindings)
+        if result["type_"] == "SELECT":
+            if self.format == "csv":
+                lines = _csv_lines(
+                    result["vars_"], self._limited(result["bindings"]), self
+                )
+            else:
+                lines = _json_lines(
+                    result["vars_"], self._limited(result["bindings"]), self
+                )
+        elif result["type_"] == "ASK":
+            lines = iter([json.dumps({"head": {}, "boolean": result["askAnswer"]})])
+        else:
+            triples = result.get("triples", result.get("graph"))
+            lines = _nt_lines(self._limited(triples), self)
+        yield from self._chunks(lines)
+
+
+def _term_json(term: rdflib.term.Node) -> dict[str, str]:
+    if isinstance(term, rdflib.URIRef):
+        return {"type": "uri", "value": str(term)}
+    if isinstance(term, rdflib.BNode):
+        return {"type": "bnode", "value": str(term)}
+    value = {"type": "literal", "value": str(term)}
+    if term.language:
+        value["xml:lang"] = term.language
+    elif term.datatype:
+        value["datatype"] = str(term.datatype)
+    return value
+
+
+def _json_lines(
+    variables: list[rdflib.Variable], rows: Iterator[Any], stream: ResultStream
+) -> Iterator[str]:
+    yield json.dumps({"head": {"vars": [str(v) for v in variables]}})[:-1]
+    yield ', "results": {"bindings": ['
+    separator = ""
+    for row in rows:
+        binding = {
+            str(v): _term_json(row[v]) for v in variables if row.get(v) is not None
+        }
+        yield separator + json.dumps(binding)
+        separator = ",\n"
+    # Not part of the SPARQL results format, clients ignore them
+    end = {"truncated": stream.truncated}
+    if stream.error is not None:
+        end["error"] = stream.error
+    yield "]}, " + json.dumps(end)[1:] + "\n"
+
+
+def _end_comments(stream: ResultStream) -> Iterator[str]:
+    """Comment lines reporting an incomplete result (line-based formats)."""
+    if stream.error is not None:
+        yield "# error: " + " ".join(stream.error.split()) + "\n"
+    if stream.truncated:
+        yield "# truncated\n"
+
+
+def _csv_lines(
+    variables: list[rdflib.Variable], rows: Iterator[Any], stream: ResultStream
+) -> Iterator[str]:
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+
+    def line(values: list[str]) -> str:
+        buffer.seek(0)
+        buffer.truncate()
+        writer.writerow(values)
+        return buffer.getvalue()
+
+    yield line([str(v) for v in variables])
+    for row in rows:
+        yield line(
+            [
+                (
+                    ""
+                    if (term := row.get(v)) is None
+                    else term.n3() if isinstance(term, rdflib.BNode) else str(term)
+                )
+                for v in variables
+            ]
+        )
+    yield from _end_comments(stream)
+
+
+def _nt_lines(triples: Iterator[Any], stream: ResultStream) -> Iterator[str]:
+    for triple in triples:
+        yield _nt_row(triple)
+    yield from _end_comments(stream)
+
+
+class ResultResponse(StreamingResponse):
+    """Streams a ResultStream.
+
+    Whether the results were truncated (or evaluation failed) is only
+    known at the end, so it's reported at the end of the body: as members
+    of the JSON result, or as comment lines in CSV and N-Triples. It's
+    also sent as HTTP trailers if the server supports them.
+    """
+
+    def __init__(self, results: ResultStream):
+        headers = {}
+        if results.budget.timeout is not None:
+            headers["X-Query-Timeout"] = str(results.budget.timeout)
+        if results.budget.max_rows is not None:
+            headers["X-Query-Row-Limit"] = str(results.budget.max_rows)
+        super().__init__(
+            results, media_type=MEDIA_TYPES[results.format], headers=headers
+        )
+        self.results = results
+        self.trailers = False
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        self.trailers = "http.response.trailers" in scope.get("extensions", {})
+        if self.trailers:
+            self.headers["Trailer"] = f"{TRUNCATED_HEADER}, {ERROR_HEADER}"
+        await super().__call__(scope, receive, send)
+
+    async def stream_response(self, send: Send) -> None:
+        await send(
+            {
+                "type": "http.response.start",
+                "status": self.status_code,
+                "headers": self.raw_headers,
+                "trailers": self.trailers,
+            }
+        )
+        async for chunk in self.body_iterator:
+            await send({"type": "http.response.body", "body": chunk, "more_body": True})
+        await send({"type": "http.response.body", "body": b"", "more_body": False})
+        if self.trailers:
+            truncated = b"true" if self.results.truncated else b"false"
+            trailers = [(TRUNCATED_HEADER.lower().encode(), truncated)]
+            if (error := self.results.error) is not None:
+                trailers.append(
+                    (ERROR_HEADER.lower().encode(), " ".join(error.split()).encode())
+                )
+            await send(
+                {
+                    "type": "http.response.trailers",
+                    "headers": trailers,
+                    "more_trailers": False,
+                }
+            )
+
+
+def _limit(configured: float | None, requested: str | None) -> float | None:
+    """The requested limit, which can only lower the configured one."""
+    if not requested:
+        return configured
+    value = float(requested)
+    return value if configured is None else min(value, configured)
+
+
+def _format(request: Request, query: Query) -> str:
+    if query.algebra.name in ("ConstructQuery", "DescribeQuery"):
+        return "nt"
+    requested = request.query_params.get("format") or request.headers.get("accept", "")
+    if query.algebra.name == "SelectQuery" and "csv" in requested:
+        return "csv"
+    return "json"
+
+
+def query_stream_endpoint(
+    graph: rdflib.Graph,
+    *,
+    timeout: float | None = None,
+    max_rows: int | None = None,
+) -> Callable[[Request], Awaitable[Response]]:
+    """A Starlette endpoint that streams query results.
+
+    The query is the query parameter (GET) or form field or body (POST).
+    Requests can lower the configured budget with the timeout and
+    max_rows parameters.
+    """
+
+    async def endpoint(request: Request) -> Response:
+        text = request.query_params.get("query")
+        if text is None and request.method == "POST":
+            body = (await request.body()).decode("utf-8")
+            if request.headers.get("content-type", "").startswith(
+                "application/sparql-query"
+            ):
+                text = body
+            else:
+                text = urllib.parse.parse_qs(body).get("query", [None])[0]
+        if not text:
+            return PlainTextResponse("No query", status_code=400)
+        try:
+            budget = QueryBudget(
+                _limit(timeout, request.query_params.get("timeout")),
+                (
+                    int(limit)
+                    if (limit := _limit(max_rows, request.query_params.get("max_rows")))
+                    is not None
+                    else None
+                ),
+            )
+            query_cache = getattr(graph, "query_cache", None)
+            prepared = (
+                query_cache.prepare(text, dict(graph.namespaces()))
+                if query_cache is not None
+                else prepareQuery(text, initNs=dict(graph.namespaces()))
+            )
+        except Exception as ex:
+            return PlainTextResponse(f"Bad query: {ex}", status_code=400)
+        return ResultResponse(
+            ResultStream(graph, prepared, budget, _format(request, prepared))
+        )
+
+    return endpoint
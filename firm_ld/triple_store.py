@@ -0,0 +1,383 @@
+"""A compact, dictionary-encoded in-memory rdflib store.
+
+Terms are interned to integer IDs. Each graph keeps its triples in three
+sorted indexes (SPO, POS and OSP). Each index is a pair of arrays: one
+holds the first two IDs packed into 64-bit keys, the other holds the
+third ID as 32 bits. The arrays use about 36 bytes per triple, plus the
+terms, much less than the nested dictionaries of the Memory store.
+
+Writes go to a small hashed delta (additions and tombstones). The delta is
+merged into the arrays when it grows past a fraction of the graph. Call
+compact() after bulk loads to merge it immediately.
+
+Registered as the "Compact" store plugin (e.g., for RdfDataSet.configure).
+"""
+
+import itertools
+from array import array
+from bisect import bisect_left, bisect_right
+from typing import Any, Iterable, Iterator
+
+import rdflib
+from rdflib.graph import DATASET_DEFAULT_GRAPH_ID
+from rdflib.store import VALID_STORE, Store
+from rdflib.term import Node
+
+IdTriple = tuple[int, int, int]
+
+_MASK = 0xFFFFFFFF
+
+# The delta is merged when it's larger than this or a quarter of the graph
+MERGE_MIN = 65_536
+
+
+class _Index:
+    """Triples, in one ordering, as sorted (a << 32 | b, c) arrays."""
+
+    def __init__(self, keys: array | None = None, values: array | None = None):
+        self.keys = keys if keys is not None else array("Q")
+        self.values = values if values is not None else array("I")
+
+    def __len__(self) -> int:
+        return len(self.keys)
+
+    def match(self, a: int | None, b: int | None, c: int | None) -> Iterator[IdTriple]:
+        """Triples (in the index's order) matching a bound prefix."""
+        keys, values = self.keys, self.values
+        if a is None:
+            lo, hi = 0, len(keys)
+        elif b is None:
+            lo = bisect_left(keys, a << 32)
+            hi = bisect_left(keys, (a + 1) << 32, lo)
+        else:
+            key = a << 32 | b
+            lo = bisect_left(keys, key)
+            hi = bisect_right(keys, key, lo)
+            if c is not None:
+                i = bisect_left(values, c, lo, hi)
+                if i < hi and values[i] == c:
+                    yield a, b, c
+                return
+        for i in range(lo, hi):
+            key = keys[i]
+            yield key >> 32, key & _MASK, values[i]
+
+    def merged(
+        self, added: Iterable[IdTriple], removed: Iterable[IdTriple]
+    ) -> "_Index":
+        # Sorting whole packed triples is much faster than merging in Python
+        packed = [key << 32 | value for key, value in zip(self.keys, self.values)]
+        if removed_packed := {a << 64 | b << 32 | c for a, b, c in removed}:
+            packed = [t for t in packed if t not in removed_packed]
+        packed.extend(a << 64 | b << 32 | c for a, b, c in added)
+        packed.sort()
+        return _Index(
+            array("Q", [t >> 32 for t in packed]),
+            array("I", [t & _MASK for t in packed]),
+        )
+
+
+# Reorder an SPO triple for the POS and OSP indexes. Applying _pos to an
+# OSP triple (or _osp to a POS triple) restores the SPO order.
+def _pos(t: IdTriple) -> IdTriple:
+    return t[1], t[2], t[0]
+
+
+def _osp(t: IdTriple) -> IdTriple:
+    return t[2], t[0], t[1]
+
+
+class _Partition:
+    """The triples of one graph."""
+
+    def __init__(self) -> None:
+        self.spo = _Index()
+        self.pos = _Index()
+        self.osp = _Index()
+        self.added: set[IdTriple] = set()
+        self.removed: set[IdTriple] = set()
+        # The added triples by subject, predicate and object
+        self._by: tuple[dict[int, set[IdTriple]], ...] = ({}, {}, {})
+
+    def __len__(self) -> int:
+        return len(self.spo) - len(self.removed) + len(self.added)
+
+    def _in_main(self, t: IdTriple) -> bool:
+        return next(self.spo.match(*t), None) is not None
+
+    def __contains__(self, t: IdTriple) -> bool:
+        return t in self.added or (t not in self.removed and self._in_main(t))
+
+    def add(self, t: IdTriple) -> bool:
+        if t in self.added:
+            return False
+        if t in self.removed:
+            self.removed.discard(t)
+        elif self._in_main(t):
+            return False
+        else:
+            self.added.add(t)
+            for position, by in enumerate(self._by):
+                by.setdefault(t[position], set()).add(t)
+        self._maybe_merge()
+        return True
+
+    def remove(self, t: IdTriple) -> None:
+        if t in self.added:
+            self.added.discard(t)
+            for position, by in enumerate(self._by):
+                triples = by[t[position]]
+                triples.discard(t)
+                if not triples:
+                    del by[t[position]]
+        elif t not in self.removed and self._in_main(t):
+            self.removed.add(t)
+            self._maybe_merge()
+
+    def match(self, s: int | None, p: int | None, o: int | None) -> Iterator[IdTriple]:
+        if s is not None:
+            if o is not None and p is None:
+                main = map(_pos, self.osp.match(o, s, None))
+            else:
+                main = self.spo.match(s, p, o)
+        elif p is not None:
+            main = map(_osp, self.pos.match(p, o, None))
+        elif o is not None:
+            main = map(_pos, self.osp.match(o, None, None))
+        else:
+            main = self.spo.match(None, None, None)
+        if self.removed:
+            main = (t for t in main if t not in self.removed)
+        if not self.added:
+            return main
+        # The delta is copied so the partition can change during iteration
+        if s is not None:
+            candidates = list(self._by[0].get(s, ()))
+        elif p is not None:
+            candidates = list(self._by[1].get(p, ()))
+        elif o is not None:
+            candidates = list(self._by[2].get(o, ()))
+        else:
+            candidates = list(self.added)
+        delta = [
+            t
+            for t in candidates
+            if (p is None or t[1] == p) and (o is None or t[2] == o)
+        ]
+        return itertools.chain(main, delta)
+
+    def _maybe_merge(self) -> None:
+        if len(self.added) + len(self.removed) > max(MERGE_MIN, len(self.spo) // 4):
+            self.merge()
+
+    def merge(self) -> None:
+        if not self.added and not self.removed:
+            return
+        self.spo = self.spo.merged(self.added, self.removed)
+        self.pos = self.pos.merged(map(_pos, self.added), map(_pos, self.removed))
+        self.osp = self.osp.merged(map(_osp, self.added), map(_osp, self.removed))
+        self.added = set()
+        self.removed = set()
+        self._by = ({}, {}, {})
+
+
+class CompactStore(Store):
+    """An in-memory, context-aware store with dictionary-encoded terms.
+
+    Like the Memory store, it isn't safe for concurrent writes (see
+    StoreExecutor). Terms aren't removed from the dictionary when the
+    triples using them are.
+    """
+
+    context_aware = True
+    graph_aware = True
+    formula_aware = False
+    transaction_aware = False
+
+    def __init__(
+        self, configuration: str | None = None, identifier: Node | None = None
+    ):
+        super().__init__(configuration)
+        self.identifier = identifier
+        self._ids: dict[Node, int] = {}
+        self._terms: list[Node] = []
+        self._partitions: dict[int, _Partition] = {}
+        self._graphs: dict[int, rdflib.Graph] = {}
+        self._namespace: dict[str, rdflib.URIRef] = {}
+        self._prefix: dict[rdflib.URIRef, str] = {}
+
+    def open(self, configuration: str, create: bool = False) -> int:
+        # Nothing to open, but RdfDataSet.configure expects a valid store
+        return VALID_STORE
+
+    def _intern(self, term: Node) -> int:
+        if (term_id := self._ids.get(term)) is None:
+            term_id = self._ids[term] = len(self._terms)
+            if term_id > _MASK:
+                raise Exception("Too many terms for the compact store")
+            self._terms.append(term)
+        return term_id
+
+    @staticmethod
+    def _graph_term(context: Any) -> Node:
+        identifier = getattr(context, "identifier", context)
+        return DATASET_DEFAULT_GRAPH_ID if identifier is None else identifier
+
+    def _graph_id(self, context: Any) -> int:
+        return self._intern(self._graph_term(context))
+
+    def _find_partition(self, context: Any) -> _Partition | None:
+        """The partition of a graph, if it has one (without interning it)."""
+        if (graph_id := self._ids.get(self._graph_term(context))) is None:
+            return None
+        return self._partitions.get(graph_id)
+
+    def _partition(self, context: Any) -> _Partition:
+        graph_id = self._graph_id(context)
+        if (partition := self._partitions.get(graph_id)) is None:
+            partition = self._partitions[graph_id] = _Partition()
+            self._graphs[graph_id] = (
+                context
+                if isinstance(context, rdflib.Graph)
+                else rdflib.Graph(store=self, identifier=self._terms[graph_id])
+            )
+        return partition
+
+    def _decode(self, t: IdTriple) -> tuple[Node, Node, Node]:
+        terms = self._terms
+        return terms[t[0]], terms[t[1]], terms[t[2]]
+
+    def _encode_pattern(self, pattern: Any) -> tuple[int | None, ...] | None:
+        """The IDs of the bound terms, or None if any term is unknown."""
+        ids = []
+        for term in pattern:
+            if term is None:
+                ids.append(None)
+            elif (term_id := self._ids.get(term)) is None:
+                return None
+            else:
+                ids.append(term_id)
+        return tuple(ids)
+
+    def add(self, triple: Any, context: Any, quoted: bool = False) -> None:
+        if quoted:
+            raise Exception("The compact store doesn't support formulas")
+        Store.add(self, triple, context, quoted)
+        s, p, o = triple
+        self._partition(context).add(
+            (self._intern(s), self._intern(p), self._intern(o))
+        )
+
+    def addN(self, quads: Iterable[Any]) -> None:
+        for s, p, o, context in quads:
+            self.add((s, p, o), context)
+
+    def remove(self, triple_pattern: Any, context: Any = None) -> None:
+        if (ids := self._encode_pattern(triple_pattern)) is None:
+            return
+        if context is None:
+            partitions = list(self._partitions.values())
+        elif (partition := self._find_partition(context)) is None:
+            return
+        else:
+            partitions = [partition]
+        for partition in partitions:
+            for t in list(partition.match(*ids)):
+                partition.remove(t)
+
+    def _contexts(
+        self,
+        t: IdTriple,
+        partitions: list[tuple[int, _Partition]] | None = None,
+    ) -> Iterator[rdflib.Graph]:
+        """The graphs (of partitions, by default all of them) holding a triple.
+
+        It's a generator, so the partitions are only checked if the caller
+        reads the contexts.
+        """
+        if partitions is None:
+            partitions = list(self._partitions.items())
+        for graph_id, partition in partitions:
+            if t in partition:
+                yield self._graphs[graph_id]
+
+    def triples(self, triple_pattern: Any, context: Any = None) -> Iterator[Any]:
+        if (ids := self._encode_pattern(triple_pattern)) is None:
+            return
+        if context is not None:
+            if (partition := self._find_partition(context)) is None:
+                return
+            for t in partition.match(*ids):
+                yield self._decode(t), self._contexts(t)
+            return
+        partitions = list(self._partitions.items())
+        if len(partitions) == 1:
+            for t in partitions[0][1].match(*ids):
+                yield self._decode(t), self._contexts(t, partitions)
+            return
+        # The union of the graphs, with each triple yielded once. A triple
+        # first found in a partition isn't in the earlier ones, so only the
+        # later ones can add contexts.
+        seen: set[int] = set()
+        for n, (_, partition) in enumerate(partitions):
+            for t in partition.match(*ids):
+                packed = t[0] << 64 | t[1] << 32 | t[2]
+                if packed not in seen:
+                    seen.add(packed)
+                    yield self._decode(t), self._contexts(t, partitions[n:])
+
+    def __len__(self, context: Any = None) -> int:
+        if context is not None:
+            partition = self._find_partition(context)
+            return len(partition) if partition is not None else 0
+        if len(self._partitions) == 1:
+            return len(next(iter(self._partitions.values())))
+        return sum(1 for _ in self.triples((None, None, None)))
+
+    def contexts(self, triple: Any = None) -> Iterator[rdflib.Graph]:
+        if triple is None or triple == (None, None, None):
+            return iter(list(self._graphs.values()))
+        if (ids := self._encode_pattern(triple)) is None:
+            return iter(())
+        return self._contexts(ids)  # type: ignore
+
+    def add_graph(self, graph: rdflib.Graph) -> None:
+        self._partition(graph)
+
+    def remove_graph(self, graph: rdflib.Graph) -> None:
+        if (graph_id := self._ids.get(self._graph_term(graph))) is None:
+            return
+        self._partitions.pop(graph_id, None)
+        self._graphs.pop(graph_id, None)
+
+    def compact(self) -> None:
+        """Merge the pending writes into the sorted indexes."""
+        for partition in self._partitions.values():
+            partition.merge()
+
+    def bind(self, prefix: str, namespace: Any, override: bool = True) -> None:
+        bound_namespace = self._namespace.get(prefix)
+        bound_prefix = self._prefix.get(namespace)
+        if bound_prefix is None and bound_namespace is not None:
+            bound_prefix = self._prefix.get(bound_namespace)
+        if override:
+            if bound_prefix is not None:
+                del self._namespace[bound_prefix]
+            if bound_namespace is not None:
+                del self._prefix[bound_namespace]
+            self._prefix[namespace] = prefix
+            self._namespace[prefix] = namespace
+        else:
+            namespace = bound_namespace if bound_namespace is not None else namespace
+            prefix = bound_prefix if bound_prefix is not None else prefix
+            self._prefix[namespace] = prefix
+            self._namespace[prefix] = namespace
+
+    def namespace(self, prefix: str) -> rdflib.URIRef | None:
+        return self._namespace.get(prefix)
+
+    def prefix(self, namespace: Any) -> str | None:
+        return self._prefix.get(namespace)
+
+    def namespaces(self) -> Iterator[tuple[str, rdflib.URIRef]]:
+        return iter(list(self._namespace.items()))
@@ -0,0 +1,163 @@
+import pytest
+import rdflib
+from rdflib.compare import isomorphic
+
+from firm_ld.as2 import (
+    UnsupportedDocument,
+    as2_to_graph,
+    compile_context,
+    fast_as2_to_graph,
+    graph_to_as2,
+)
+from firm_ld.jsonld_utils import AS2, jsonld_to_graph, subject_to_jsonld
+
+AS2_CONTEXT = "https://www.w3.org/ns/activitystreams"
+
+STORE_CONTEXT = [
+    AS2_CONTEXT,
+    "https://w3c-ccg.github.io/security-vocab/contexts/security-v1.jsonld",
+    {"firm": "https://firm.stevebate.dev#"},
+]
+
+# Documents the fast path must handle without falling back
+SUPPORTED_DOCS = [
+    {
+        "@context": AS2_CONTEXT,
+        "id": "https://server.test/activity",
+        "type": "Create",
+        "actor": "https://server.test/actor",
+        "object": {
+            "type": "Note",
+            "content": "Hello, world!",
+        },
+    },
+    {
+        "@context": STORE_CONTEXT,
+        "id": "https://server.test/note",
+        "type": "Note",
+        "attributedTo": "https://server.test/actor",
+        "to": ["as:Public", "https://server.test/actor/followers"],
+        "cc": [],
+        "inReplyTo": None,
+        "published": "2024-01-01T00:00:00Z",
+        "contentMap": {"en": "Hello", "fr": "Bonjour"},
+        "firm:flagged": False,
+        "firm:role": "admin",
+        "tag": [
+            {"type": "Mention", "href": "https://server.test/other", "name": "@o"},
+            {"id": "https://server.test/tags/foo"},
+        ],
+    },
+    {
+        "@context": STORE_CONTEXT,
+        "id": "https://server.test/actor",
+        "type": ["Person", "https://server.test/types#Custom"],
+        "preferredUsername": "actor",
+        "inbox": "https://server.test/actor/inbox",
+        "publicKey": {
+            "id": "https://server.test/actor#main-key",
+            "owner": "https://server.test/actor",
+            "publicKeyPem": "-----BEGIN PUBLIC KEY-----",
+        },
+        "icon": {"type": "Image", "url": "https://server.test/icon.png"},
+        "https://example.test/ns#extension": 42,
+    },
+    {
+        "@context": [AS2_CONTEXT, {"@vocab": "https://example.test/ns#"}],
+        "id": "https://server.test/thing",
+        "type": "Thing",
+        "customProperty": 1.5,
+    },
+]
+
+# Documents that need the generic path
+UNSUPPORTED_DOCS = [
+    {
+        "@context": AS2_CONTEXT,
+        "id": "https://server.test/note",
+        "type": "Note",
+        "unknownTerm": "value",
+    },
+    {
+        "@context": AS2_CONTEXT,
+        "id": "https://server.test/collection",
+        "type": "OrderedCollection",
+        "orderedItems": [],
+    },
+    {
+        "@context": AS2_CONTEXT,
+        "id": "https://server.test/note",
+        "type": "Note",
+        "content": {"@value": "Hello", "@language": "en"},
+    },
+    {
+        "@context": [AS2_CONTEXT, {"scoped": {"@id": "as:scoped", "@context": {}}}],
+        "id": "https://server.test/note",
+        "scoped": {"id": "https://server.test/other", "type": "Note"},
+    },
+]
+
+
+@pytest.mark.parametrize("doc", SUPPORTED_DOCS)
+def test_fast_path_matches_pyld(doc):
+    assert isomorphic(fast_as2_to_graph(doc), jsonld_to_graph(doc))
+
+
+@pytest.mark.parametrize("doc", UNSUPPORTED_DOCS)
+def test_fast_path_falls_back(doc):
+    with pytest.raises(UnsupportedDocument):
+        fast_as2_to_graph(doc)
+    assert isomorphic(as2_to_graph(doc), jsonld_to_graph(doc))
+
+
+def test_compile_context():
+    table = compile_context(STORE_CONTEXT)
+    assert "id" in table.id_aliases
+    assert "type" in table.type_aliases
+    assert table.terms["to"].coercion == "@id"
+    assert table.terms["contentMap"].container == "@language"
+    assert table.prefixes["firm"] == "https://firm.stevebate.dev#"
+    assert table.expand_vocab("firm:role") == "https://firm.stevebate.dev#role"
+
+
+@pytest.mark.parametrize("doc", SUPPORTED_DOCS)
+def test_serializer_matches_pyld(doc):
+    g = jsonld_to_graph(doc)
+    assert graph_to_as2(g, doc["id"]) == subject_to_jsonld(g, doc["id"])
+
+
+def test_serializer_ordered_items():
+    doc = {
+        "@context": AS2_CONTEXT,
+        "id": "https://server.test/outbox",
+        "type": "OrderedCollection",
+        "orderedItems": [
+            "https://server.test/b",
+            "https://server.test/a",
+            {"type": "Note", "content": "Embedded"},
+        ],
+    }
+    g = jsonld_to_graph(doc)
+    serialized = graph_to_as2(g, doc["id"])
+    assert serialized == subject_to_jsonld(g, doc["id"])
+    assert serialized["orderedItems"] == doc["orderedItems"]
+
+
+def test_serializer_literals_and_multiple_values():
+    g = jsonld_to_graph(SUPPORTED_DOCS[1])
+    subject = rdflib.URIRef(SUPPORTED_DOCS[1]["id"])
+    published = rdflib.Literal("2024-01-01T00:00:00Z", datatype=rdflib.XSD.dateTime)
+    g.add((subject, AS2.published, published))
+    g.add((subject, AS2.summary, rdflib.Literal("Bonjour", lang="fr")))
+    g.add((subject, AS2.summary, rdflib.Literal("Hello", lang="en")))
+    g.add((subject, AS2.totalItems, rdflib.Literal(3)))
+    doc = graph_to_as2(g, str(subject))
+    assert doc == subject_to_jsonld(g, str(subject))
+    assert sorted(doc["to"]) == ["as:Public", "https://server.test/actor/followers"]
+    assert len(doc["tag"]) == 2
+    assert doc["summaryMap"] == {"fr": "Bonjour", "en": "Hello"}
+    assert doc["published"] == "2024-01-01T00:00:00+00:00"
+
+
+def test_serializer_missing_subject():
+    assert graph_to_as2(rdflib.Graph(), "https://server.test/missing") is None
@@ -0,0 +1,142 @@
+import pytest
+import rdflib
+
+from firm_ld.cache import LRUCache, ObjectCache, QueryCache, normalize_query
+
+EX = rdflib.Namespace("https://server.test/")
+
+
+class FakeTimer:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_lru_eviction():
+    cache = LRUCache(maxsize=2)
+    cache.put("a", 1)
+    cache.put("b", 2)
+    assert cache.get("a") == 1
+    cache.put("c", 3)
+    assert "b" not in cache
+    assert cache.get("a") == 1
+    assert cache.get("c") == 3
+    assert cache.stats().evictions == 1
+
+
+def test_ttl_expiry():
+    timer = FakeTimer()
+    cache = LRUCache(maxsize=2, ttl=10, timer=timer)
+    cache.put("a", 1)
+    timer.now = 5
+    assert cache.get("a") == 1
+    timer.now = 11
+    assert cache.get("a") is None
+    stats = cache.stats()
+    assert (stats.hits, stats.misses, stats.size) == (1, 1, 0)
+    assert stats.hit_ratio == 0.5
+
+
+def test_invalidate():
+    cache = LRUCache()
+    cache.put("a", 1)
+    assert cache.invalidate("a")
+    assert not cache.invalidate("a")
+    assert len(cache) == 0
+
+
+def test_invalid_maxsize():
+    with pytest.raises(ValueError):
+        LRUCache(maxsize=0)
+
+
+def test_object_cache_returns_copies():
+    cache = ObjectCache()
+    cache.put("https://server.test/a", {"id": "https://server.test/a"})
+    obj = cache.get("https://server.test/a")
+    obj["name"] = "changed"
+    assert cache.get("https://server.test/a") == {"id": "https://server.test/a"}
+
+
+def test_object_cache_dependencies():
+    cache = ObjectCache()
+    cache.put("https://server.test/a", {"id": "a"}, dependencies=["_b1"])
+    cache.put("https://server.test/c", {"id": "c"})
+    cache.invalidate(["_b1"])
+    assert cache.get("https://server.test/a") is None
+    assert cache.get("https://server.test/c") is not None
+    cache.invalidate()
+    assert len(cache) == 0
+    assert cache.stats().bytes == 0
+
+
+def test_object_cache_stale_put():
+    cache = ObjectCache()
+    generation = cache.generation
+    cache.invalidate(["https://server.test/a"])
+    cache.put("https://server.test/a", {"id": "a"}, generation=generation)
+    assert cache.get("https://server.test/a") is None
+
+
+def test_object_cache_stats():
+    cache = ObjectCache(maxsize=1)
+    cache.put("https://server.test/a", {"id": "a"})
+    cache.put("https://server.test/b", {"id": "b"})
+    assert cache.get("https://server.test/a") is None
+    assert cache.get("https://server.test/b") == {"id": "b"}
+    stats = cache.stats()
+    assert (stats.size, stats.evictions, stats.hit_ratio) == (1, 1, 0.5)
+    assert stats.bytes == len('{"id": "b"}')
+
+
+def test_normalize_query():
+    assert (
+        normalize_query(
+            """
+        SELECT ?s  # comment
+        WHERE {
+            ?s <https://server.test/p#x>  "a  # b" .
+        }
+        """
+        )
+        == 'SELECT ?s WHERE { ?s <https://server.test/p#x> "a  # b" . }'
+    )
+    assert normalize_query("ASK { ?a ?b ?c FILTER (?c < 3) }") == (
+        "ASK { ?a ?b ?c FILTER (?c < 3) }"
+    )
+
+
+def test_query_cache():
+    graph = rdflib.Graph()
+    graph.add((EX.a, EX.p, rdflib.Literal(1)))
+    cache = QueryCache(maxsize=2)
+    evaluations = []
+
+    def evaluate(prepared):
+        evaluations.append(prepared)
+        return graph.query(prepared)
+
+    query = "SELECT ?s WHERE { ?s ?p ?o }"
+    results = [cache.query(text, evaluate) for text in (query, f"  {query}\n")]
+    assert len(evaluations) == 1
+    assert [row.s for row in results[1]] == [EX.a]
+    assert [row.s for row in results[1]] == [EX.a]
+    # Initial bindings are part of the key but the prepared query is reused
+    cache.query(query, evaluate, init_bindings={"o": rdflib.Literal(2)})
+    assert len(evaluations) == 2 and evaluations[0] is evaluations[1]
+    graph.add((EX.b, EX.p, rdflib.Literal(1)))
+    cache.invalidate()
+    assert len(cache.query(query, evaluate)) == 2
+    assert len(evaluations) == 3
+    stats = cache.stats()
+    assert (stats["results"].hits, stats["plans"].hits) == (1, 2)
+
+
+def test_query_cache_volatile():
+    graph = rdflib.Graph()
+    cache = QueryCache()
+    query = "SELECT (RAND() AS ?r) WHERE {}"
+    first = cache.query(query, graph.query)
+    assert cache.query(query, graph.query) is not first
@@ -0,0 +1,139 @@
+import pytest
+import rdflib
+
+from firm_ld.as2 import as2_to_graph
+from firm_ld.criteria import _bind_expanded, compile_criteria, match_subjects
+
+AS2_CONTEXT = "https://www.w3.org/ns/activitystreams"
+
+
+@pytest.fixture
+def graph():
+    graph = rdflib.Graph()
+    for i in range(10):
+        graph += as2_to_graph(
+            {
+                "@context": AS2_CONTEXT,
+                "id": f"https://server.test/obj-{i}",
+                "type": "Note" if i % 2 else "Article",
+                "name": f"Note-{i}",
+                "attributedTo": f"https://server.test/actor-{i % 3}",
+                "tag": {"type": "Mention", "name": "tagged"},
+            }
+        )
+    return graph
+
+
+def test_match_literal(graph):
+    assert match_subjects(graph, {"name": "Note-3"}) == ["https://server.test/obj-3"]
+    assert match_subjects(graph, {"name": "Thing-999"}) == []
+
+
+def test_match_multiple_patterns(graph):
+    assert match_subjects(
+        graph, {"type": "Note", "attributedTo": "https://server.test/actor-0"}
+    ) == ["https://server.test/obj-3", "https://server.test/obj-9"]
+
+
+def test_match_id_reference(graph):
+    assert match_subjects(
+        graph, {"attributedTo": {"id": "https://server.test/actor-1"}}
+    ) == [
+        "https://server.test/obj-1",
+        "https://server.test/obj-4",
+        "https://server.test/obj-7",
+    ]
+
+
+def test_match_subject(graph):
+    uri = "https://server.test/obj-2"
+    assert match_subjects(graph, {"id": uri}) == [uri]
+    assert match_subjects(graph, {"id": uri, "type": "Article"}) == [uri]
+    assert match_subjects(graph, {"id": uri, "type": "Note"}) == []
+    assert match_subjects(graph, {"id": "https://server.test/missing"}) == []
+
+
+def test_blank_nodes_excluded(graph):
+    assert match_subjects(graph, {"name": "tagged"}) == []
+
+
+def test_empty_criteria(graph):
+    assert match_subjects(graph, {}) == []
+
+
+def test_values_are_not_interpolated(graph):
+    assert match_subjects(graph, {"name": 'Note-3" . ?s ?p ?o . "'}) == []
+
+
+def test_plan_reused_for_shape():
+    plan = compile_criteria({"name": "a", "type": "Note"})
+    assert compile_criteria({"type": "Article", "name": "b"}) is plan
+    assert compile_criteria({"name": "a"}) is not plan
+
+
+def test_plan_binding_matches_expansion():
+    criteria = {
+        "type": "Note",
+        "name": "Note-1",
+        "attributedTo": "https://server.test/actor-1",
+        "firm:flagged": True,
+    }
+    subject, patterns = compile_criteria(criteria).bind(criteria)
+    assert subject is None
+    assert sorted(patterns) == sorted(_bind_expanded(criteria)[1])
+
+
+def test_order_by_property(graph):
+    published = rdflib.URIRef("https://www.w3.org/ns/activitystreams#published")
+    for i in range(10):
+        graph.add(
+            (
+                rdflib.URIRef(f"https://server.test/obj-{i}"),
+                published,
+                rdflib.Literal(
+                    f"2024-01-{10 + (i * 7) % 10}T00:00:00Z",
+                    datatype=rdflib.XSD.dateTime,
+                ),
+            )
+        )
+    uris = match_subjects(graph, {"type": "Note"}, order_by="published")
+    assert uris == [f"https://server.test/obj-{i}" for i in (3, 9, 5, 1, 7)]
+    uris = match_subjects(
+        graph, {"type": "Note"}, order_by="published", descending=True, limit=2
+    )
+    assert uris == ["https://server.test/obj-7", "https://server.test/obj-1"]
+
+
+def test_missing_order_values_sort_last(graph):
+    graph.add(
+        (
+            rdflib.URIRef("https://server.test/obj-9"),
+            rdflib.URIRef("https://www.w3.org/ns/activitystreams#published"),
+            rdflib.Literal("2024-01-01T00:00:00Z", datatype=rdflib.XSD.dateTime),
+        )
+    )
+    uris = match_subjects(graph, {"type": "Note"}, order_by="published")
+    assert uris[0] == "https://server.test/obj-9"
+    uris = match_subjects(
+        graph, {"type": "Note"}, order_by="published", descending=True
+    )
+    assert uris[0] == "https://server.test/obj-9"
+
+
+def test_unknown_order_by(graph):
+    with pytest.raises(ValueError, match="Unknown order_by property: bogus"):
+        match_subjects(graph, {"type": "Note"}, order_by="bogus")
+
+
+def test_paging(graph):
+    all_uris = match_subjects(graph, {"type": "Article"})
+    assert match_subjects(graph, {"type": "Article"}, offset=1, limit=2) == (
+        all_uris[1:3]
+    )
+    assert match_subjects(graph, {"type": "Article"}, after=all_uris[1]) == (
+        all_uris[2:]
+    )
+    assert (
+        match_subjects(graph, {"type": "Article"}, descending=True, after=all_uris[1])
+        == all_uris[:1]
+    )
@@ -0,0 +1,93 @@
+import rdflib
+from rdflib.compare import isomorphic
+
+from firm_ld.delta import compute_delta
+from firm_ld.jsonld_utils import AS2, jsonld_to_graph
+
+ID = "https://server.test/note"
+
+
+def make_note(**properties):
+    return {
+        "@context": "https://www.w3.org/ns/activitystreams",
+        "id": ID,
+        "type": "Note",
+        "content": "Hello",
+        "tag": [{"type": "Mention", "href": "https://server.test/actor"}],
+        **properties,
+    }
+
+
+def apply(graph, delta):
+    graph -= delta.removed
+    graph += delta.added
+
+
+def test_unchanged_object():
+    graph = jsonld_to_graph(make_note())
+    delta = compute_delta(graph, jsonld_to_graph(make_note()))
+    assert not delta
+
+
+def test_single_property_change():
+    graph = jsonld_to_graph(make_note())
+    resource = jsonld_to_graph(make_note(content="Updated"))
+    delta = compute_delta(graph, resource)
+    assert set(delta.removed) == {
+        (rdflib.URIRef(ID), AS2.content, rdflib.Literal("Hello"))
+    }
+    assert set(delta.added) == {
+        (rdflib.URIRef(ID), AS2.content, rdflib.Literal("Updated"))
+    }
+    apply(graph, delta)
+    assert isomorphic(graph, resource)
+
+
+def test_blank_node_subtree_change():
+    graph = jsonld_to_graph(make_note())
+    graph += jsonld_to_graph(
+        {
+            "@context": "https://www.w3.org/ns/activitystreams",
+            "id": "https://server.test/other",
+            "type": "Note",
+        }
+    )
+    resource = jsonld_to_graph(
+        make_note(tag=[{"type": "Hashtag", "href": "https://server.test/tags/x"}])
+    )
+    delta = compute_delta(graph, resource)
+    # The old tag node and its link are replaced
+    assert len(delta.removed) == 3
+    assert len(delta.added) == 3
+    apply(graph, delta)
+    assert len(list(graph.subjects(AS2.href, None))) == 1
+    assert (rdflib.URIRef("https://server.test/other"), None, None) in graph
+
+
+def test_unchanged_blank_nodes_are_kept():
+    graph = jsonld_to_graph(make_note())
+    tag = next(graph.objects(rdflib.URIRef(ID), AS2.tag))
+    delta = compute_delta(graph, jsonld_to_graph(make_note(content="Updated")))
+    apply(graph, delta)
+    assert next(graph.objects(rdflib.URIRef(ID), AS2.tag)) == tag
+
+
+def test_ordered_list_entries():
+    collection = {
+        "@context": "https://www.w3.org/ns/activitystreams",
+        "id": ID,
+        "type": "OrderedCollection",
+        "orderedItems": ["https://server.test/a", "https://server.test/b"],
+    }
+    graph = jsonld_to_graph(collection)
+    assert not compute_delta(graph, jsonld_to_graph(collection))
+    collection["orderedItems"].append("https://server.test/c")
+    resource = jsonld_to_graph(collection)
+    delta = compute_delta(graph, resource)
+    # Only the new entry is added
+    assert len(delta.added) == 3
+    assert len(delta.removed) == 0
+    # The collection changed, although only its list entries did
+    assert rdflib.URIRef(ID) in delta.subjects
+    apply(graph, delta)
+    assert isomorphic(graph, resource)
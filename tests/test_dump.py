@@ -0,0 +1,150 @@
+import gzip
+import json
+import os
+
+import pytest
+import rdflib
+from rdflib import RDF, BNode, Literal, URIRef
+
+from firm_ld import dump
+from firm_ld.as2 import as2_to_graph, graph_to_as2
+from firm_ld.dump import export_ndjson, export_nquads, import_ndjson, import_nquads
+from firm_ld.jsonld_utils import AS2
+
+EX = rdflib.Namespace("https://server.test/")
+
+
+def make_dataset(count=25):
+    dataset = rdflib.Dataset()
+    named = dataset.graph(EX.named)
+    for n in range(count):
+        node = BNode(f"b{n}")
+        dataset.add((EX[f"s{n}"], EX.value, Literal(f'line\n{n} "quoted"')))
+        dataset.add((EX[f"s{n}"], EX.node, node))
+        named.add((node, EX.number, Literal(n)))
+    return dataset
+
+
+def quads(dataset):
+    return {(s, p, o, g) for s, p, o, g in dataset.quads((None, None, None, None))}
+
+
+@pytest.mark.parametrize("filename", ["data.nq", "data.nq.gz"])
+def test_nquads_round_trip(tmp_path, filename):
+    source = make_dataset()
+    path = str(tmp_path / filename)
+    assert export_nquads(source, path, chunk_size=7) == 75
+    if filename.endswith(".gz"):
+        with gzip.open(path, "rt") as f:
+            assert len(f.readlines()) == 75
+    target = rdflib.Dataset()
+    assert import_nquads(target, path, chunk_size=10) == 75
+    assert quads(target) == quads(source)
+    # Blank node labels are kept across chunks
+    assert (EX.s3, EX.node, BNode("b3")) in target
+    assert not os.path.exists(path + ".import-checkpoint")
+    assert not os.path.exists(path + ".export-checkpoint")
+
+
+@pytest.mark.parametrize("filename", ["data.nq", "data.nq.gz"])
+def test_resume_export(tmp_path, filename, monkeypatch):
+    source = make_dataset()
+    path = str(tmp_path / filename)
+    write_checkpoint = dump._write_checkpoint
+    checkpoints = 0
+
+    def interrupt(checkpoint, state):
+        nonlocal checkpoints
+        write_checkpoint(checkpoint, state)
+        checkpoints += 1
+        if checkpoints == 2:
+            # Partial output after the checkpoint is discarded on resume
+            with open(path, "ab") as f:
+                f.write(b"<partial")
+            raise KeyboardInterrupt()
+
+    monkeypatch.setattr(dump, "_write_checkpoint", interrupt)
+    with pytest.raises(KeyboardInterrupt):
+        export_nquads(source, path, chunk_size=10)
+    monkeypatch.setattr(dump, "_write_checkpoint", write_checkpoint)
+    assert export_nquads(source, path, chunk_size=10, resume=True) == 75
+    target = rdflib.Dataset()
+    import_nquads(target, path)
+    assert quads(target) == quads(source)
+
+
+def test_resume_export_without_output(tmp_path):
+    source = make_dataset()
+    path = str(tmp_path / "data.nq")
+    dump._write_checkpoint(path + ".export-checkpoint", {"items": 20, "offset": 99})
+    assert export_nquads(source, path, chunk_size=10, resume=True) == 75
+    target = rdflib.Dataset()
+    import_nquads(target, path)
+    assert quads(target) == quads(source)
+
+
+def test_resume_import(tmp_path, monkeypatch):
+    path = str(tmp_path / "data.nq")
+    export_nquads(make_dataset(), path)
+    target = rdflib.Dataset()
+    parse = target.parse
+    chunks = 0
+
+    def interrupt(*args, **kwargs):
+        nonlocal chunks
+        chunks += 1
+        if chunks == 3:
+            raise KeyboardInterrupt()
+        return parse(*args, **kwargs)
+
+    monkeypatch.setattr(target, "parse", interrupt)
+    with pytest.raises(KeyboardInterrupt):
+        import_nquads(target, path, chunk_size=10)
+    with open(path + ".import-checkpoint") as f:
+        assert json.load(f) == {"items": 20}
+    monkeypatch.setattr(target, "parse", parse)
+    assert len(quads(target)) == 20
+    assert import_nquads(target, path, chunk_size=10, resume=True) == 75
+    assert quads(target) == quads(make_dataset())
+
+
+def test_ndjson_round_trip(tmp_path):
+    source = rdflib.Graph()
+    for n in range(5):
+        source += as2_to_graph(
+            {
+                "@context": "https://www.w3.org/ns/activitystreams",
+                "id": f"https://server.test/notes/{n}",
+                "type": "Note",
+                "content": f"Note number {n}",
+                "tag": {"type": "Hashtag", "name": "#test"},
+            }
+        )
+    # Exported once even with several types
+    source.add((URIRef("https://server.test/notes/0"), RDF.type, AS2.Article))
+    path = str(tmp_path / "data.ndjson.gz")
+    assert export_ndjson(source, path, serializer=graph_to_as2) == 5
+    with gzip.open(path, "rt") as f:
+        objects = [json.loads(line) for line in f]
+    assert sorted(obj["id"] for obj in objects) == [
+        f"https://server.test/notes/{n}" for n in range(5)
+    ]
+    target = rdflib.Graph()
+    assert import_ndjson(target, path, converter=as2_to_graph, workers=0) == 5
+    assert set(target.subjects(RDF.type, AS2.Note)) == set(
+        source.subjects(RDF.type, AS2.Note)
+    )
+    assert len(target) == len(source)
+
+
+def test_cli(tmp_path, monkeypatch):
+    path = str(tmp_path / "data.nq")
+    with open(path, "w") as f:
+        f.write(f'<{EX.s}> <{EX.p}> "o" <{EX.g}> .\n')
+    dataset = rdflib.Dataset()
+    monkeypatch.setattr(dump.rdflib, "Dataset", lambda store: dataset)
+    dump.main(["import", path])
+    assert (EX.s, EX.p, Literal("o"), EX.g) in dataset
+    dump.main(["export", str(tmp_path / "out.nq.gz")])
+    with gzip.open(tmp_path / "out.nq.gz", "rt") as f, open(path) as expected:
+        assert f.read() == expected.read()
@@ -0,0 +1,44 @@
+import rdflib
+from starlette.testclient import TestClient
+
+from firm_ld.sparql import create_sparql_endpoint
+from firm_ld.store import RdfDataSet, _Dataset
+
+
+def test_endpoint_query_cache():
+    dataset = RdfDataSet.VALUE = _Dataset()
+    subject = rdflib.URIRef("http://server.test/obj1")
+    dataset.add((subject, rdflib.RDFS.label, rdflib.Literal("foo")))
+    client = TestClient(create_sparql_endpoint("http://server.test/sparql"))
+    query = "SELECT ?o WHERE { ?s <http://www.w3.org/2000/01/rdf-schema#label> ?o }"
+    headers = {"accept": "application/json"}
+    try:
+        for _ in range(2):
+            response = client.get("/", params={"query": query}, headers=headers)
+            bindings = response.json()["results"]["bindings"]
+            assert [b["o"]["value"] for b in bindings] == ["foo"]
+        stats = dataset.query_cache.stats()
+        assert (stats["plans"].hits, stats["results"].hits) == (1, 1)
+        dataset.update(f"DELETE WHERE {{ <{subject}> ?p ?o }}")
+        response = client.get("/", params={"query": query}, headers=headers)
+        assert response.json()["results"]["bindings"] == []
+    finally:
+        RdfDataSet.close()
+
+
+def test_endpoint_query_budget():
+    dataset = RdfDataSet.VALUE = _Dataset()
+    for n in range(5):
+        subject = rdflib.URIRef(f"http://server.test/obj{n}")
+        dataset.add((subject, rdflib.RDFS.label, rdflib.Literal(n)))
+    client = TestClient(
+        create_sparql_endpoint("http://server.test/sparql", max_rows=2, timeout=10)
+    )
+    query = "SELECT ?o WHERE { ?s <http://www.w3.org/2000/01/rdf-schema#label> ?o }"
+    try:
+        response = client.get(
+            "/", params={"query": query}, headers={"accept": "application/json"}
+        )
+        assert len(response.json()["results"]["bindings"]) == 2
+    finally:
+        RdfDataSet.close()
@@ -0,0 +1,81 @@
+import asyncio
+import concurrent.futures
+import threading
+import time
+
+import pytest
+
+from firm_ld.executor import ReadWriteLock, StoreExecutor
+
+
+def test_readers_share_lock():
+    lock = ReadWriteLock()
+    both_reading = threading.Barrier(2, timeout=5)
+
+    def read():
+        with lock.read():
+            both_reading.wait()
+
+    threads = [threading.Thread(target=read) for _ in range(2)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+
+def test_writer_excludes_readers():
+    lock = ReadWriteLock()
+    events = []
+
+    def write():
+        with lock.write():
+            events.append("write-start")
+            time.sleep(0.05)
+            events.append("write-end")
+
+    with lock.read():
+        writer = threading.Thread(target=write)
+        writer.start()
+        time.sleep(0.02)
+        assert events == []
+    writer.join()
+    with lock.read():
+        events.append("read")
+    assert events == ["write-start", "write-end", "read"]
+
+
+@pytest.mark.asyncio
+async def test_single_writer():
+    executor = StoreExecutor(readers=4)
+    active = 0
+    max_active = 0
+
+    def write():
+        nonlocal active, max_active
+        active += 1
+        max_active = max(max_active, active)
+        time.sleep(0.01)
+        active -= 1
+
+    await asyncio.gather(*(executor.write(write) for _ in range(5)))
+    assert max_active == 1
+    stats = executor.stats()
+    assert stats["writes"].completed == 5
+    assert stats["writes"].pending == 0
+    assert stats["writes"].wait_max > 0
+    executor.shutdown()
+
+
+@pytest.mark.asyncio
+async def test_reads_and_conversions():
+    executor = StoreExecutor(
+        readers=2, converter=concurrent.futures.ThreadPoolExecutor(1)
+    )
+    assert await executor.read(sum, [1, 2]) == 3
+    assert await executor.convert(str.upper, "a") == "A"
+    with pytest.raises(ZeroDivisionError):
+        await executor.read(lambda: 1 / 0)
+    stats = executor.stats()
+    assert stats["reads"].completed == 2
+    assert stats["conversions"].completed == 1
+    executor.shutdown()
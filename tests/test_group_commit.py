@@ -0,0 +1,95 @@
+import asyncio
+
+import pytest
+import rdflib
+
+from firm_ld.group_commit import WriteQueue
+
+EX = rdflib.Namespace("https://server.test/")
+
+
+def make_resource(name, value):
+    resource = rdflib.Graph()
+    resource.add((EX[name], EX.value, rdflib.Literal(value)))
+    return resource
+
+
+class Committer:
+    def __init__(self, error=None):
+        self.batches = []
+        self.error = error
+
+    async def __call__(self, batch):
+        await asyncio.sleep(0)
+        if self.error:
+            raise self.error
+        self.batches.append(batch)
+
+
+@pytest.mark.asyncio
+async def test_concurrent_writes_share_a_batch():
+    commit = Committer()
+    queue = WriteQueue(commit, max_delay=0.01)
+    await asyncio.gather(
+        queue.put(make_resource("a", 1)),
+        queue.put(make_resource("b", 1)),
+        queue.put(make_resource("a", 2)),
+        queue.remove(str(EX.c)),
+    )
+    assert len(commit.batches) == 1
+    batch = commit.batches[0]
+    assert batch.removals == {EX.a, EX.b, EX.c}
+    # The later put of a replaces the earlier one
+    assert [set(resource) for resource in batch.additions.values()] == [
+        {(EX.a, EX.value, rdflib.Literal(2))},
+        {(EX.b, EX.value, rdflib.Literal(1))},
+    ]
+    stats = queue.stats()
+    assert (stats.batches, stats.operations, stats.batch_max) == (1, 4, 4)
+    assert stats.latency_max > 0
+    assert stats.commits_per_second > 0
+
+
+@pytest.mark.asyncio
+async def test_batch_size_limit():
+    commit = Committer()
+    queue = WriteQueue(commit, max_batch=2, max_delay=0.05)
+    await asyncio.gather(*(queue.put(make_resource(f"r{i}", i)) for i in range(5)))
+    assert [len(batch.additions) for batch in commit.batches] == [2, 2, 1]
+
+
+@pytest.mark.asyncio
+async def test_errors_reach_every_writer():
+    queue = WriteQueue(Committer(Exception("Commit failed")))
+    results = await asyncio.gather(
+        queue.put(make_resource("a", 1)),
+        queue.remove(str(EX.b)),
+        return_exceptions=True,
+    )
+    assert [str(result) for result in results] == ["Commit failed"] * 2
+
+
+@pytest.mark.asyncio
+async def test_settle():
+    commit = Committer()
+    queue = WriteQueue(commit, max_delay=10)
+    write = asyncio.ensure_future(queue.put(make_resource("a", 1)))
+    await asyncio.sleep(0)
+    await queue.settle(str(EX.other))
+    assert not commit.batches
+    # A read of a pending URI commits it without waiting for the window
+    await asyncio.wait_for(queue.settle(str(EX.a)), 1)
+    assert len(commit.batches) == 1
+    await write
+
+
+@pytest.mark.asyncio
+async def test_settle_all():
+    commit = Committer()
+    queue = WriteQueue(commit, max_delay=10)
+    writes = asyncio.gather(queue.put(make_resource("a", 1)), queue.remove(str(EX.b)))
+    await asyncio.sleep(0)
+    await asyncio.wait_for(queue.settle_all(), 1)
+    assert len(commit.batches) == 1
+    await writes
+    await queue.settle_all()
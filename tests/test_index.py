@@ -0,0 +1,83 @@
+import rdflib
+
+from firm_ld.as2 import as2_to_graph
+from firm_ld.criteria import match_subjects
+from firm_ld.index import PropertyIndex
+from firm_ld.jsonld_utils import AS2
+
+FIRM = "https://firm.stevebate.dev#"
+
+
+def make_graph():
+    graph = rdflib.Graph()
+    for i in range(6):
+        graph += as2_to_graph(
+            {
+                "@context": "https://www.w3.org/ns/activitystreams",
+                "id": f"https://server.test/obj-{i}",
+                "type": "Note",
+                "attributedTo": f"https://server.test/actor-{i % 2}",
+                "tag": {"type": "Mention", "href": "https://server.test/actor-0"},
+            }
+        )
+    return graph
+
+
+def test_lookup():
+    graph = make_graph()
+    index = PropertyIndex(graph, [str(AS2.attributedTo)])
+    actor = rdflib.URIRef("https://server.test/actor-1")
+    assert index.subjects(AS2.attributedTo, actor) == {
+        rdflib.URIRef(f"https://server.test/obj-{i}") for i in (1, 3, 5)
+    }
+    assert index.subjects(AS2.name, rdflib.Literal("x")) is None
+    stats = index.stats()
+    assert stats.keys == 2
+    assert stats.entries == 6
+    assert stats.bytes > 0
+
+
+def test_blank_nodes_not_indexed():
+    graph = make_graph()
+    index = PropertyIndex(graph, [str(rdflib.RDF.type)])
+    assert index.subjects(rdflib.RDF.type, AS2.Mention) == set()
+
+
+def test_namespace():
+    graph = make_graph()
+    subject = rdflib.URIRef("https://server.test/obj-0")
+    graph.add((subject, rdflib.URIRef(FIRM + "flagged"), rdflib.Literal(True)))
+    index = PropertyIndex(graph, [FIRM + "*"])
+    assert index.subjects(rdflib.URIRef(FIRM + "flagged"), rdflib.Literal(True)) == {
+        subject
+    }
+    assert index.subjects(AS2.attributedTo, subject) is None
+
+
+def test_invalidation():
+    graph = make_graph()
+    index = PropertyIndex(graph, [str(AS2.attributedTo)])
+    actor = rdflib.URIRef("https://server.test/actor-0")
+    subject = rdflib.URIRef("https://server.test/obj-0")
+    assert subject in index.subjects(AS2.attributedTo, actor)
+    graph.set((subject, AS2.attributedTo, rdflib.URIRef("https://server.test/other")))
+    index.invalidate([str(subject)])
+    assert subject not in index.subjects(AS2.attributedTo, actor)
+    assert index.stats().rebuilds == 1
+
+    graph.remove((subject, None, None))
+    index.invalidate()
+    assert (
+        index.subjects(AS2.attributedTo, rdflib.URIRef("https://server.test/other"))
+        == set()
+    )
+    assert index.stats().rebuilds == 2
+
+
+def test_query_with_index():
+    graph = make_graph()
+    index = PropertyIndex(graph, [str(AS2.attributedTo), str(rdflib.RDF.type)])
+    criteria = {"type": "Note", "attributedTo": "https://server.test/actor-0"}
+    assert match_subjects(graph, criteria, index=index) == match_subjects(
+        graph, criteria
+    )
@@ -0,0 +1,133 @@
+import json
+
+import pytest
+import rdflib
+from rdflib import RDFS, URIRef
+
+from firm_ld.as2 import as2_to_graph
+from firm_ld.ingest import ingest
+from firm_ld.jsonld_utils import AS2, jsonld_to_graph
+from firm_ld.search import IndexedResource, SearchEngine
+
+
+def make_lines(count):
+    return [
+        json.dumps(
+            {
+                "@context": "https://www.w3.org/ns/activitystreams",
+                "id": f"https://server.test/notes/{n}",
+                "type": "Note",
+                "content": f"Note number {n}",
+            }
+        )
+        for n in range(count)
+    ]
+
+
+@pytest.mark.parametrize("workers", [0, 2])
+def test_ingest(workers):
+    graph = rdflib.Graph()
+    lines = make_lines(25)
+    lines.insert(3, "not json")
+    lines.insert(7, "")
+    reports = []
+    stats = ingest(
+        lines,
+        graph,
+        converter=as2_to_graph,
+        workers=workers,
+        batch_size=4,
+        commit_size=20,
+        max_pending=2,
+        progress=lambda stats: reports.append(stats.objects),
+    )
+    assert stats.lines == 27
+    assert stats.objects == 25
+    assert stats.triples == len(graph) == 50
+    assert [error.line for error in stats.errors] == [4]
+    assert reports == sorted(reports) and reports[-1] == 25
+    assert stats.commits == len(reports) > 1
+
+
+def test_later_versions_replace_earlier():
+    graph = rdflib.Graph()
+    subject = URIRef("https://server.test/notes/1")
+    graph.add((subject, AS2.content, rdflib.Literal("Stored")))
+    lines = make_lines(2)
+    lines.append(lines[1].replace("Note number 1", "Updated"))
+    notified = []
+    stats = ingest(lines, graph, workers=0, notify=notified.extend)
+    assert stats.objects == 2
+    assert list(graph.objects(subject, AS2.content)) == [rdflib.Literal("Updated")]
+    assert sorted(notified) == [
+        "https://server.test/notes/0",
+        "https://server.test/notes/1",
+    ]
+
+
+def test_search_index_in_same_pass():
+    graph = rdflib.Graph()
+    engine = SearchEngine(graph)
+    engine.add_index(
+        IndexedResource(type=AS2.Note, indexed=[AS2.content], projected=[RDFS.label])
+    )
+    ingest(make_lines(10), graph, converter=as2_to_graph, workers=0, search=engine)
+    assert len(engine.search("number").results) == 10
+
+
+def test_objects_keyed_by_document_id():
+    graph = rdflib.Graph()
+    activity = {
+        "@context": "https://www.w3.org/ns/activitystreams",
+        "id": "https://server.test/activities/1",
+        "type": "Create",
+        "object": {
+            "id": "https://server.test/notes/1",
+            "type": "Note",
+            "content": "First",
+        },
+    }
+    lines = [json.dumps(activity)]
+    activity["object"]["content"] = "Second"
+    lines.append(json.dumps(activity))
+    stats = ingest(lines, graph, workers=0)
+    assert stats.objects == 1
+    assert list(graph.objects(None, AS2.content)) == [rdflib.Literal("Second")]
+
+
+def test_stored_contexts():
+    graph = rdflib.Graph()
+    line = json.dumps(
+        {
+            "@context": "https://www.w3.org/ns/activitystreams",
+            "id": "https://server.test/actors/alice",
+            "type": "Person",
+            "publicKey": {
+                "id": "https://server.test/actors/alice#main-key",
+                "owner": "https://server.test/actors/alice",
+                "publicKeyPem": "PEM",
+            },
+        }
+    )
+    ingest([line], graph, workers=0)
+    security = rdflib.Namespace("https://w3id.org/security#")
+    assert (None, security.publicKeyPem, rdflib.Literal("PEM")) in graph
+
+
+@pytest.mark.parametrize("converter", [jsonld_to_graph, as2_to_graph])
+def test_reingest_replaces_lists_and_blank_nodes(converter):
+    graph = rdflib.Graph()
+    line = json.dumps(
+        {
+            "@context": "https://www.w3.org/ns/activitystreams",
+            "id": "https://server.test/outbox",
+            "type": "OrderedCollection",
+            "orderedItems": ["https://server.test/a", "https://server.test/b"],
+            "attachment": {"type": "Image", "url": "https://server.test/a.png"},
+        }
+    )
+    ingest([line], graph, converter=converter, workers=0)
+    size = len(graph)
+    ingest([line], graph, converter=converter, workers=0)
+    ingest([line], graph, converter=converter, workers=0)
+    assert len(graph) == size
@@ -1,10 +1,17 @@
 import json
 
+import rdflib
 from pyld import jsonld
 
 from firm_ld.jsonld_utils import (
+    AS2,
+    JSONLD_COMPACTION_CONTEXT,
+    JSONLD_CONTEXT,
+    CachingDocumentLoader,
+    ContextCache,
     httpx_document_loader,
     jsonld_to_graph,
+    node_to_python,
     subject_to_jsonld,
 )
 
@@ -68,3 +75,114 @@ def test_graph_extract():
     # Graph is setup
     jsonld_doc = subject_to_jsonld(g, str(doc["id"]))
     print(json.dumps(jsonld_doc, indent=2))
+
+
+def _failing_loader(url, options):
+    raise AssertionError(f"Unexpected fetch of {url}")
+
+
+def test_node_to_python():
+    assert node_to_python(rdflib.BNode("b0")) == {"@id": "_:b0"}
+    assert node_to_python(rdflib.URIRef("https://server.test/a")) == {
+        "@id": "https://server.test/a"
+    }
+    assert node_to_python(rdflib.Literal("text")) == {"@value": "text"}
+    # A blank node that's already embedded is referenced
+    g = rdflib.Graph()
+    subject = rdflib.URIRef("https://server.test/note")
+    node = rdflib.BNode("b0")
+    g.add((subject, AS2.attachment, node))
+    g.add((node, AS2.inReplyTo, node))
+    assert subject_to_jsonld(g, str(subject))["attachment"] == {"inReplyTo": "_:b0"}
+
+
+def test_document_loader_bundled_contexts():
+    loader = CachingDocumentLoader(loader=_failing_loader)
+    remote_doc = loader("https://www.w3.org/ns/activitystreams", {})
+    assert "@context" in remote_doc["document"]
+    loader("https://w3id.org/security/v1", {})
+    stats = loader.stats()
+    assert stats.hits == 2
+    assert stats.misses == 0
+
+
+def test_document_loader_caches_remote_documents():
+    calls = []
+
+    def loader(url, options):
+        calls.append(url)
+        return {"contextUrl": None, "documentUrl": url, "document": {"@context": {}}}
+
+    caching_loader = CachingDocumentLoader(loader=loader, maxsize=1)
+    caching_loader("https://server.test/context-1", {})
+    caching_loader("https://server.test/context-1", {})
+    assert calls == ["https://server.test/context-1"]
+    caching_loader("https://server.test/context-2", {})
+    caching_loader("https://server.test/context-1", {})
+    assert len(calls) == 3
+    stats = caching_loader.stats()
+    assert (stats.hits, stats.misses, stats.evictions) == (1, 3, 2)
+
+
+AS2_DOC = {
+    "@context": [
+        "https://www.w3.org/ns/activitystreams",
+        "https://w3c-ccg.github.io/security-vocab/contexts/security-v1.jsonld",
+        {"firm": "https://firm.stevebate.dev#"},
+    ],
+    "id": "https://server.test/activity",
+    "type": "Create",
+    "actor": "https://server.test/actor",
+    "to": ["https://www.w3.org/ns/activitystreams#Public"],
+    "published": "2024-01-01T00:00:00Z",
+    "object": {
+        "type": "Note",
+        "content": "Hello, world!",
+        "contentMap": {"en": "Hello, world!"},
+        "firm:tag": "foo",
+    },
+}
+
+
+def test_context_cache_expand_matches_pyld():
+    cache = ContextCache()
+    expected = jsonld.expand(AS2_DOC, {"documentLoader": httpx_document_loader})
+    assert cache.expand(AS2_DOC) == expected
+    assert cache.expand(AS2_DOC) == expected
+    stats = cache.stats()
+    assert (stats.hits, stats.misses) == (1, 1)
+
+
+def test_context_cache_expand_context_matches_pyld():
+    cache = ContextCache()
+    criteria = {"type": "Note", "name": "Note-1"}
+    expected = jsonld.expand(
+        criteria,
+        {
+            "expandContext": JSONLD_CONTEXT["@context"],
+            "documentLoader": httpx_document_loader,
+        },
+    )
+    assert cache.expand(criteria, JSONLD_CONTEXT["@context"]) == expected
+
+
+def test_context_cache_compact_matches_pyld():
+    cache = ContextCache()
+    expanded = jsonld.expand(AS2_DOC, {"documentLoader": httpx_document_loader})
+    expected = jsonld.compact(
+        expanded,
+        JSONLD_COMPACTION_CONTEXT,
+        {"documentLoader": httpx_document_loader},
+    )
+    assert cache.compact(expanded, JSONLD_COMPACTION_CONTEXT) == expected
+
+
+def test_context_cache_invalidate():
+    cache = ContextCache()
+    cache.expand(AS2_DOC)
+    cache.expand({"@context": JSONLD_CONTEXT["@context"], "type": "Note"})
+    assert len(cache.cache) == 2
+    cache.invalidate(AS2_DOC["@context"])
+    assert len(cache.cache) == 1
+    cache.invalidate()
+    assert len(cache.cache) == 0
@@ -0,0 +1,123 @@
+import asyncio
+import http.server
+import json
+import threading
+import time
+from collections import Counter
+
+import pytest
+
+from firm_ld.jsonld_utils import CachingDocumentLoader
+from firm_ld.loader import DocumentFetcher, DocumentLoadError
+
+
+class FakeTimer:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class StubHandler(http.server.BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        self.server.requests[self.path] += 1
+        self.server.accept.append(self.headers["Accept"])
+        time.sleep(self.server.delay)
+        if self.path.startswith("/missing"):
+            body, status = b"Not found", 404
+        else:
+            body, status = json.dumps({"@context": {"path": self.path}}).encode(), 200
+        self.send_response(status)
+        self.send_header("Content-Type", "application/ld+json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def server():
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), StubHandler)
+    server.requests = Counter()
+    server.accept = []
+    server.delay = 0.0
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    server.url = f"http://127.0.0.1:{server.server_port}"
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def fetcher():
+    fetcher = DocumentFetcher(cache_dir=None, http2=False, timer=FakeTimer())
+    yield fetcher
+    fetcher.close()
+
+
+def test_load(server, fetcher):
+    remote_doc = fetcher(f"{server.url}/context", {})
+    assert remote_doc == {
+        "contextUrl": None,
+        "documentUrl": f"{server.url}/context",
+        "document": {"@context": {"path": "/context"}},
+    }
+    assert server.accept == ["application/ld+json, application/json;q=0.5"]
+
+
+@pytest.mark.asyncio
+async def test_single_flight(server, fetcher):
+    server.delay = 0.2
+    url = f"{server.url}/context"
+    docs = await asyncio.gather(*(fetcher.aload(url) for _ in range(5)))
+    assert all(doc["document"] == {"@context": {"path": "/context"}} for doc in docs)
+    assert server.requests["/context"] == 1
+    assert (fetcher.stats.requests, fetcher.stats.coalesced) == (1, 4)
+
+
+def test_negative_cache_backoff(server, fetcher):
+    url = f"{server.url}/missing"
+    timer = fetcher._timer
+    with pytest.raises(DocumentLoadError, match="404"):
+        fetcher(url, {})
+    with pytest.raises(DocumentLoadError):
+        fetcher(url, {})
+    assert server.requests["/missing"] == 1
+    assert fetcher.stats.negative_hits == 1
+    # The backoff doubles after each failure
+    timer.now = 31
+    with pytest.raises(DocumentLoadError):
+        fetcher(url, {})
+    assert server.requests["/missing"] == 2
+    timer.now = 90
+    with pytest.raises(DocumentLoadError):
+        fetcher(url, {})
+    assert server.requests["/missing"] == 2
+    timer.now = 92
+    with pytest.raises(DocumentLoadError):
+        fetcher(url, {})
+    assert server.requests["/missing"] == 3
+
+
+def test_connection_error(fetcher):
+    # Nothing listens on the discard port
+    with pytest.raises(DocumentLoadError):
+        fetcher("http://127.0.0.1:9/context", {})
+    assert fetcher.stats.failures == 1
+
+
+@pytest.mark.asyncio
+async def test_caching_loader_prefetch(server, fetcher):
+    loader = CachingDocumentLoader(loader=fetcher)
+    urls = [f"{server.url}/a", f"{server.url}/b", f"{server.url}/missing"]
+    await loader.prefetch(urls)
+    assert len(loader.cache) == 2
+    loader(f"{server.url}/a", {})
+    assert server.requests["/a"] == 1
+    assert loader.stats().hits == 1
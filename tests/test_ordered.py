@@ -0,0 +1,82 @@
+import rdflib
+
+from firm_ld.jsonld_utils import AS2, jsonld_to_graph, subject_to_jsonld
+from firm_ld.ordered import (
+    LIST,
+    OrderedItems,
+    OrderedListIndex,
+    add_ordered_list,
+    inline_items,
+    remove_ordered_lists,
+)
+
+EX = rdflib.Namespace("https://server.test/")
+
+
+def make_collection(count):
+    return {
+        "@context": "https://www.w3.org/ns/activitystreams",
+        "id": str(EX.outbox),
+        "type": "OrderedCollection",
+        "orderedItems": [str(EX[f"item-{i}"]) for i in range(count)],
+    }
+
+
+def test_round_trip():
+    g = jsonld_to_graph(make_collection(3))
+    assert subject_to_jsonld(g, str(EX.outbox))["orderedItems"] == [
+        str(EX["item-0"]),
+        str(EX["item-1"]),
+        str(EX["item-2"]),
+    ]
+    # The entries aren't linked from the collection
+    assert len(list(g.objects(EX.outbox))) == 2
+
+
+def test_large_lists_are_not_inlined():
+    g = rdflib.Graph()
+    node = add_ordered_list(g, EX.outbox, AS2.orderedItems, [EX.a, EX.b, EX.c])
+    assert inline_items(g, node, limit=2) is None
+    assert inline_items(g, node) == [EX.a, EX.b, EX.c]
+
+
+def test_ordered_items():
+    items = OrderedItems([(1, EX.b), (0, EX.a)])
+    for name in ("c", "d"):
+        items.push(items.next_position(), EX[name])
+    for name in ("z", "y"):
+        items.push(items.next_position(first=True), EX[name], first=True)
+    assert items.page() == [EX.y, EX.z, EX.a, EX.b, EX.c, EX.d]
+    assert items.page(1, 3) == [EX.z, EX.a, EX.b]
+    assert items.page(4) == [EX.c, EX.d]
+    assert items.page(10) == []
+    # Reloading from positions keeps the order
+    items = OrderedItems([(-2, EX.y), (-1, EX.z), (0, EX.a)])
+    assert items.page(0, 2) == [EX.y, EX.z]
+    assert OrderedItems().next_position(first=True) == -1
+
+
+def test_index():
+    g = rdflib.Graph()
+    add_ordered_list(g, EX.outbox, AS2.orderedItems, [EX.a, EX.b])
+    index = OrderedListIndex(g)
+    node, items = index.get(EX.outbox, AS2.orderedItems)
+    assert items.page() == [EX.a, EX.b]
+    assert index.get(EX.outbox, AS2.orderedItems)[1] is items
+    assert index.get(EX.other, AS2.orderedItems) is None
+    index.invalidate([str(EX.outbox)])
+    assert index.get(EX.outbox, AS2.orderedItems)[1] is not items
+
+
+def test_remove_ordered_lists():
+    g = jsonld_to_graph(
+        {
+            "@context": "https://www.w3.org/ns/activitystreams",
+            "id": str(EX.outbox),
+            "type": "OrderedCollection",
+            "orderedItems": [str(EX.a), {"type": "Note", "content": "Embedded"}],
+        }
+    )
+    remove_ordered_lists(g, EX.outbox)
+    assert not list(g.subjects(LIST, None))
+    assert set(g) == {(EX.outbox, rdflib.RDF.type, AS2.OrderedCollection)}
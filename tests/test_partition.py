@@ -0,0 +1,67 @@
+import rdflib
+
+from firm_ld.jsonld_utils import AS2
+from firm_ld.partition import ByActor, ByDomain, ByPath, GraphDirectory, resource_root
+
+EX = rdflib.Namespace("https://server.test/")
+
+
+def make_resource():
+    resource = rdflib.Graph()
+    resource.add((EX.create, rdflib.RDF.type, AS2.Create))
+    resource.add((EX.create, AS2.actor, EX.alice))
+    resource.add((EX.create, AS2.object, EX.note))
+    resource.add((EX.note, AS2.attributedTo, EX.bob))
+    return resource
+
+
+def test_resource_root():
+    assert resource_root(make_resource()) == EX.create
+    assert resource_root(rdflib.Graph()) is None
+
+
+def test_by_actor():
+    policy = ByActor()
+    resource = make_resource()
+    assert policy.partition(resource, EX.create) == str(EX.alice)
+    assert policy.partition(resource, EX.note) == str(EX.bob)
+    actor = rdflib.Graph()
+    actor.add((EX.carol, rdflib.RDF.type, AS2.Person))
+    assert policy.partition(actor, EX.carol) == str(EX.carol)
+    assert policy.partition(actor, EX.other) is None
+    assert policy.partitions({"attributedTo": str(EX.bob)}) == [str(EX.bob), None]
+    # Objects with several actors are in the default graph
+    resource.add((EX.note, AS2.attributedTo, EX.carol))
+    assert policy.partition(resource, EX.note) is None
+    # Objects with both predicates are in the attributedTo actor's graph
+    assert policy.partitions({"actor": str(EX.alice)}) is None
+    assert policy.partitions({"id": str(EX.note), "attributedTo": str(EX.bob)}) == [
+        str(EX.bob),
+        None,
+    ]
+    assert policy.partitions({"unknownTerm": "x"}) is None
+
+
+def test_by_domain_and_path():
+    resource = rdflib.Graph()
+    assert ByDomain().partition(resource, EX["actors/alice"]) == str(EX)
+    policy = ByPath(segments=2)
+    assert policy.partition(resource, EX["actors/alice/outbox/1"]) == str(
+        EX["actors/alice/"]
+    )
+    assert policy.partition(resource, EX["actors/alice"]) is None
+
+
+def test_directory():
+    dataset = rdflib.Dataset()
+    dataset.graph(EX.alice).add((EX.note, rdflib.RDF.type, AS2.Note))
+    dataset.add((EX.other, rdflib.RDF.type, AS2.Note))
+    directory = GraphDirectory(dataset)
+    assert directory.get(str(EX.note)) == str(EX.alice)
+    assert directory.get(str(EX.other)) is None
+    directory.set([str(EX.moved)], str(EX.bob))
+    assert directory.get(str(EX.moved)) == str(EX.bob)
+    directory.remove_partition(str(EX.bob))
+    assert directory.get(str(EX.moved)) is None
+    directory.invalidate([str(EX.note)])
+    assert directory.get(str(EX.note)) == str(EX.alice)
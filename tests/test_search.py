@@ -1,9 +1,10 @@
+import asyncio
 import json
 
 import pytest
 from rdflib import RDF, RDFS, Graph, Literal, URIRef
 
-from firm_ld.search import IndexedResource, SearchEngine
+from firm_ld.search import IndexedResource, IndexUpdater, SearchEngine, SearchTimeout
 
 
 @pytest.fixture
@@ -45,3 +46,238 @@ def test_search(graph):
     engine.update_index()
     response = engine("label")
     print(f"{json.dumps(json.loads(response.body), indent=2)}")
+
+
+def make_engine(graph, path=None, **kwargs):
+    engine = SearchEngine(graph, path, **kwargs)
+    engine.add_index(
+        IndexedResource(
+            type=URIRef("Foo"),
+            indexed=[RDFS.label],
+            projected=[RDFS.label],
+        )
+    )
+    return engine
+
+
+def test_persistent_index(graph, tmp_path):
+    path = str(tmp_path / "search.db")
+    engine = make_engine(graph, path)
+    assert engine.sync_index() == 2
+    assert engine.sync_index() == 0
+    engine.close()
+
+    subject = URIRef("http://server.test/subject-1")
+    graph.set((subject, RDFS.label, Literal("Changed")))
+    graph.remove((URIRef("http://server.test/subject-2"), None, None))
+    engine = make_engine(graph, path)
+    assert engine.sync_index() == 2
+    assert [r["id"] for r in engine.search("changed").results] == [str(subject)]
+    assert engine.search("else").results == []
+    engine.update_index(subject)
+    assert len(engine.search("changed").results) == 1
+    engine.close()
+
+
+def test_config_change_rebuilds(graph, tmp_path):
+    path = str(tmp_path / "search.db")
+    make_engine(graph, path).sync_index()
+    engine = make_engine(graph, path)
+    engine.add_index(
+        IndexedResource(type=URIRef("Bar"), indexed=[RDFS.label], projected=[])
+    )
+    assert engine.sync_index() == 3
+
+
+def test_corrupt_index_rebuilt(graph, tmp_path):
+    path = tmp_path / "search.db"
+    path.write_bytes(b"not a database" * 100)
+    engine = make_engine(graph, str(path))
+    assert engine.sync_index() == 2
+    assert len(engine.search("label").results) == 1
+    engine.close()
+
+    engine = make_engine(graph, str(path))
+    with engine._index:
+        engine._index.execute(
+            "UPDATE index_state SET value = '0' WHERE key = 'schema_version'"
+        )
+    engine.close()
+    engine = make_engine(graph, str(path))
+    assert engine.sync_index() == 2
+
+
+def test_update_is_idempotent(graph):
+    engine = make_engine(graph)
+    subject = URIRef("http://server.test/subject-1")
+    engine.update_index(subject)
+    engine.update_index(subject)
+    assert len(engine.search("label").results) == 1
+    graph.remove((subject, None, None))
+    engine.update_index(subject)
+    assert engine.search("label").results == []
+
+
+def test_index_updater(graph):
+    engine = make_engine(graph)
+    updater = IndexUpdater(engine, delay=60)
+    updater.invalidate()
+    updater.flush()
+    assert len(engine.search("label").results) == 1
+
+    subject = URIRef("http://server.test/subject-4")
+    graph.add((subject, RDF.type, URIRef("Foo")))
+    graph.add((subject, RDFS.label, Literal("New label")))
+    graph.remove((URIRef("http://server.test/subject-1"), None, None))
+    updater.invalidate([str(subject)])
+    updater.invalidate(["http://server.test/subject-1"])
+    assert len(engine.search("label").results) == 1
+    updater.close()
+    assert [r["id"] for r in engine.search("label").results] == [str(subject)]
+
+
+def test_index_updater_retries_failed_update(graph, monkeypatch):
+    engine = make_engine(graph)
+    engine.sync_index()
+    update_subjects = engine.update_subjects
+    calls = []
+
+    def fail_once(uris):
+        calls.append(set(uris))
+        if len(calls) == 1:
+            raise RuntimeError("index unavailable")
+        update_subjects(uris)
+
+    monkeypatch.setattr(engine, "update_subjects", fail_once)
+    updater = IndexUpdater(engine, delay=60)
+    graph.remove((URIRef("http://server.test/subject-1"), None, None))
+    updater.invalidate(["http://server.test/subject-1"])
+    with pytest.raises(RuntimeError):
+        updater.flush()
+    updater.close()
+    assert calls == [{"http://server.test/subject-1"}] * 2
+    assert engine.search("label").results == []
+
+
+def test_update_after_config_change_indexes_graph(graph):
+    engine = make_engine(graph)
+    engine.sync_index()
+    engine.add_index(
+        IndexedResource(type=URIRef("Bar"), indexed=[RDFS.label], projected=[])
+    )
+    engine.update_subjects(["http://server.test/subject-2"])
+    assert sorted(r["id"] for r in engine.search("label").results) == [
+        "http://server.test/subject-1",
+        "http://server.test/subject-3",
+    ]
+
+
+def test_ranked_search():
+    graph = Graph()
+    name = URIRef("http://server.test/name")
+    for i in range(5):
+        subject = URIRef(f"http://server.test/subject-{i}")
+        graph.add((subject, RDF.type, URIRef("Foo" if i < 4 else "Bar")))
+        graph.add((subject, RDFS.label, Literal(f"apple {i}" + " pear" * i)))
+    graph.add((URIRef("http://server.test/subject-3"), name, Literal("pear")))
+    engine = SearchEngine(graph)
+    engine.add_index(
+        IndexedResource(
+            type=URIRef("Foo"),
+            indexed=[RDFS.label, name],
+            projected=[],
+            weights={name: 10.0},
+        )
+    )
+    engine.add_index(
+        IndexedResource(type=URIRef("Bar"), indexed=[RDFS.label], projected=[])
+    )
+    engine.sync_index()
+
+    page = engine.search("pear")
+    assert page.cursor is None
+    assert [r["id"][-1] for r in page.results] == ["3", "4", "2", "1"]
+    assert (
+        page.results[1]["snippet"]
+        == "apple 4 <b>pear</b> <b>pear</b> <b>pear</b> <b>pear</b>"
+    )
+
+    page = engine.search("pear", types=[URIRef("Foo")], limit=2)
+    assert [r["id"][-1] for r in page.results] == ["3", "2"]
+    page = engine.search("pear", types=[URIRef("Foo")], limit=2, cursor=page.cursor)
+    assert [r["id"][-1] for r in page.results] == ["1"]
+    assert page.cursor is None
+
+
+def test_search_before_indexing(graph):
+    assert make_engine(graph).search("label").results == []
+
+
+def test_projection_served_from_index(graph):
+    engine = make_engine(graph)
+    engine.add_index(
+        IndexedResource(
+            type=URIRef("Bar"),
+            context="http://server.example/context",
+            indexed=[RDFS.label],
+            projected=[RDFS.label],
+        )
+    )
+    engine.sync_index()
+    # The index is used without consulting the graph
+    graph.remove((None, None, None))
+    response = json.loads(engine("label").body)
+    assert sorted(response, key=lambda r: r["id"]) == [
+        {
+            "id": "http://server.test/subject-1",
+            "type": "Foo",
+            "label": "My label",
+        },
+        {
+            "@context": "http://server.example/context",
+            "id": "http://server.test/subject-3",
+            "type": "Bar",
+            "label": "Another label",
+        },
+    ]
+
+
+def make_large_graph(n):
+    graph = Graph()
+    for i in range(n):
+        subject = URIRef(f"http://server.test/subject-{i}")
+        graph.add((subject, RDF.type, URIRef("Foo")))
+        graph.add((subject, RDFS.label, Literal(f"label {i} " + "word " * 20)))
+    return graph
+
+
+def test_response_pages():
+    engine = make_engine(make_large_graph(5))
+    engine.sync_index()
+    response = engine("label", limit=3)
+    ids = [r["id"] for r in json.loads(response.body)]
+    assert len(ids) == 3
+    response = engine("label", limit=3, cursor=response.headers["x-next-cursor"])
+    ids += [r["id"] for r in json.loads(response.body)]
+    assert "x-next-cursor" not in response.headers
+    assert len(set(ids)) == 5
+
+
+@pytest.mark.asyncio
+async def test_concurrent_search(tmp_path):
+    engine = make_engine(make_large_graph(100), str(tmp_path / "search.db"))
+    engine.sync_index()
+    pages = await asyncio.gather(*(engine.asearch("label", limit=10) for _ in range(8)))
+    assert all(len(page.results) == 10 for page in pages)
+    assert engine._readers.qsize() <= 4
+    response = await engine.response("label")
+    assert len(json.loads(response.body)) == 50
+    engine.close()
+
+
+def test_search_timeout():
+    engine = make_engine(make_large_graph(500), timeout=0)
+    engine.sync_index()
+    with pytest.raises(SearchTimeout):
+        engine.search("word")
+    assert len(engine.search("word", timeout=10).results) == 50
@@ -1,6 +1,18 @@
+import asyncio
+
 import rdflib
 
-from firm_ld.store import RdfResourceStore
+from firm_ld.cache import QueryCache
+from firm_ld.executor import StoreExecutor
+from firm_ld.jsonld_utils import AS2
+from firm_ld.partition import ByActor
+from firm_ld.search import IndexedResource, IndexUpdater, SearchEngine
+from firm_ld.store import (
+    DEFAULT_INDEX_PREDICATES,
+    RdfDataSet,
+    RdfResourceStore,
+    _Dataset,
+)
 
 
 async def test_put_get_remove(tmp_path):
@@ -63,3 +75,311 @@ async def test_query_one(tmp_path):
     query_results = await store.query_one({"name": "Note-3"})
     assert query_results["id"] == "http://server.test/obj-3"
     assert (await store.query({"name": "Thing-999"})) == []
+
+
+async def test_object_cache_invalidation():
+    id_ = "http://server.test/obj1"
+    store = RdfResourceStore(rdflib.Graph(), cache_size=10)
+    await store.put({"id": id_, "type": "Note", "name": "foo"})
+    assert (await store.get(id_))["name"] == "foo"
+    assert (await store.get(id_))["name"] == "foo"
+    assert store.cache.stats().hits == 1
+    await store.put({"id": id_, "type": "Note", "name": "bar"})
+    assert (await store.get(id_))["name"] == "bar"
+    await store.remove(id_)
+    assert (await store.get(id_)) is None
+
+
+async def test_object_cache_sparql_update():
+    id_ = "http://server.test/obj1"
+    dataset = _Dataset()
+    store = RdfResourceStore(dataset, cache_size=10)
+    await store.put({"id": id_, "type": "Note", "name": "foo"})
+    assert (await store.get(id_))["name"] == "foo"
+    dataset.update(
+        f"""
+DELETE WHERE {{ <{id_}> <https://www.w3.org/ns/activitystreams#name> ?o }}
+"""
+    )
+    assert "name" not in (await store.get(id_))
+
+
+async def test_sparql_query_cache():
+    id_ = "http://server.test/obj1"
+    dataset = _Dataset()
+    dataset.query_cache = QueryCache()
+    RdfDataSet.register_cache(dataset.query_cache)
+    store = RdfResourceStore(dataset)
+    query = "SELECT ?o WHERE { ?s <https://www.w3.org/ns/activitystreams#name> ?o }"
+    assert len(dataset.query(query)) == 0
+    await store.put({"id": id_, "type": "Note", "name": "foo"})
+    assert [str(row.o) for row in dataset.query(query)] == ["foo"]
+    assert [str(row.o) for row in dataset.query(query)] == ["foo"]
+    dataset.update(
+        f"""
+DELETE WHERE {{ <{id_}> <https://www.w3.org/ns/activitystreams#name> ?o }}
+"""
+    )
+    assert len(dataset.query(query)) == 0
+    stats = dataset.query_cache.stats()
+    assert (stats["results"].hits, stats["plans"].hits) == (1, 2)
+
+
+async def test_put_many_remove_many():
+    store = RdfResourceStore(rdflib.Graph(), batch_size=2)
+    objects = [
+        {
+            "id": f"http://server.test/obj-{i}",
+            "type": "Note",
+            "name": f"Note-{i}",
+        }
+        for i in range(5)
+    ]
+    objects.append({"id": "http://server.test/obj-0", "type": "Note", "name": "New"})
+    objects.append({"id": "http://server.test/bad", "@context": "bad:context"})
+    results = await store.put_many(objects)
+    assert [r.ok for r in results] == [True] * 6 + [False]
+    assert results[-1].uri == "http://server.test/bad"
+    assert (await store.get("http://server.test/obj-4"))["name"] == "Note-4"
+    assert (await store.get("http://server.test/obj-0"))["name"] == "New"
+
+    results = await store.remove_many(obj["id"] for obj in objects[:5])
+    assert all(result.ok for result in results)
+    for obj in objects[:5]:
+        assert not await store.is_stored(obj["id"])
+
+
+async def test_delta_put():
+    id_ = "http://server.test/obj1"
+    store = RdfResourceStore(rdflib.Graph(), delta_writes=True)
+    delta = await store.put({"id": id_, "type": "Note", "name": "foo"})
+    assert len(delta.added) == 2
+    assert len(delta.removed) == 0
+    delta = await store.put({"id": id_, "type": "Note", "name": "bar"})
+    assert len(delta.added) == 1
+    assert len(delta.removed) == 1
+    assert not await store.put({"id": id_, "type": "Note", "name": "bar"})
+    assert (await store.get(id_))["name"] == "bar"
+
+
+async def test_query_paging():
+    store = RdfResourceStore(rdflib.Graph())
+    for i in range(5):
+        await store.put(
+            {
+                "id": f"http://server.test/obj-{i}",
+                "type": "Note",
+                "published": f"2024-01-0{i + 1}T00:00:00Z",
+            }
+        )
+    page = await store.query(
+        {"type": "Note"}, order_by="published", descending=True, limit=2
+    )
+    assert [o["id"] for o in page] == [
+        "http://server.test/obj-4",
+        "http://server.test/obj-3",
+    ]
+    page = await store.query(
+        {"type": "Note"}, order_by="published", descending=True, after=page[-1]["id"]
+    )
+    assert [o["id"] for o in page] == [
+        "http://server.test/obj-2",
+        "http://server.test/obj-1",
+        "http://server.test/obj-0",
+    ]
+    ids = [o["id"] async for o in store.iter_query({"type": "Note"}, offset=3)]
+    assert ids == ["http://server.test/obj-3", "http://server.test/obj-4"]
+
+
+async def test_property_index():
+    store = RdfResourceStore(rdflib.Graph(), index_predicates=DEFAULT_INDEX_PREDICATES)
+    for i in range(4):
+        await store.put(
+            {
+                "id": f"http://server.test/obj-{i}",
+                "type": "Note",
+                "attributedTo": f"http://server.test/actor-{i % 2}",
+            }
+        )
+    results = await store.query({"attributedTo": "http://server.test/actor-1"})
+    assert [o["id"] for o in results] == [
+        "http://server.test/obj-1",
+        "http://server.test/obj-3",
+    ]
+    await store.remove("http://server.test/obj-1")
+    results = await store.query({"attributedTo": "http://server.test/actor-1"})
+    assert [o["id"] for o in results] == ["http://server.test/obj-3"]
+    assert store.index.stats().rebuilds == 1
+
+
+async def test_search_index_updates():
+    graph = rdflib.Graph()
+    store = RdfResourceStore(graph)
+    engine = SearchEngine(graph)
+    engine.add_index(
+        IndexedResource(type=AS2.Note, indexed=[AS2.content], projected=[])
+    )
+    updater = IndexUpdater(engine)
+    RdfDataSet.register_cache(updater)
+    id_ = "http://server.test/obj1"
+    await store.put({"id": id_, "type": "Note", "content": "hello"})
+    updater.flush()
+    assert [r["id"] for r in engine.search("hello").results] == [id_]
+    await store.remove(id_)
+    updater.close()
+    assert engine.search("hello").results == []
+
+
+async def test_executor():
+    executor = StoreExecutor()
+    store = RdfResourceStore(rdflib.Graph(), executor=executor)
+    id_ = "http://server.test/obj1"
+    await store.put({"id": id_, "type": "Note", "name": "foo"})
+    assert (await store.get(id_))["name"] == "foo"
+    assert [o["id"] for o in await store.query({"name": "foo"})] == [id_]
+    await store.remove(id_)
+    assert not await store.is_stored(id_)
+    assert executor.stats()["writes"].completed == 2
+    executor.shutdown()
+
+
+async def test_partitioned_store():
+    dataset = rdflib.Dataset()
+    store = RdfResourceStore(dataset, partition=ByActor(), delta_writes=True)
+    for i in range(4):
+        await store.put(
+            {
+                "id": f"http://server.test/obj-{i}",
+                "type": "Note",
+                "attributedTo": f"http://server.test/actor-{i % 2}",
+            }
+        )
+    await store.put({"id": "http://server.test/other", "type": "Note"})
+    alice = store.partition_graph("http://server.test/actor-1")
+    assert set(map(str, alice.subjects())) == {
+        "http://server.test/obj-1",
+        "http://server.test/obj-3",
+    }
+    assert (await store.get("http://server.test/obj-1"))["type"] == "Note"
+    assert await store.is_stored("http://server.test/other")
+    results = await store.query({"attributedTo": "http://server.test/actor-1"})
+    assert [o["id"] for o in results] == [
+        "http://server.test/obj-1",
+        "http://server.test/obj-3",
+    ]
+    assert len(await store.query({"type": "Note"})) == 5
+    results = await store.query({"id": "http://server.test/obj-2"})
+    assert [o["id"] for o in results] == ["http://server.test/obj-2"]
+    assert await store.query({"unknownTerm": "x"}) == []
+    # An object of several actors is found with either of them
+    await store.put(
+        {
+            "id": "http://server.test/shared",
+            "type": "Note",
+            "attributedTo": [
+                "http://server.test/actor-0",
+                "http://server.test/actor-1",
+            ],
+        }
+    )
+    for actor in ["http://server.test/actor-0", "http://server.test/actor-1"]:
+        results = await store.query({"attributedTo": actor})
+        assert "http://server.test/shared" in [o["id"] for o in results]
+
+    # An object moves with its actor
+    await store.put(
+        {
+            "id": "http://server.test/obj-1",
+            "type": "Note",
+            "attributedTo": "http://server.test/actor-0",
+        }
+    )
+    assert len(alice) == 2
+    results = await store.query({"attributedTo": "http://server.test/actor-0"})
+    assert len(results) == 4
+
+    await store.remove_partition("http://server.test/actor-0")
+    assert not await store.is_stored("http://server.test/obj-0")
+    assert await store.is_stored("http://server.test/obj-3")
+    assert len(await store.query({"type": "Note"})) == 3
+
+
+async def test_ordered_collection():
+    store = RdfResourceStore(rdflib.Graph(), delta_writes=True)
+    outbox = "http://server.test/outbox"
+    await store.put(
+        {
+            "id": outbox,
+            "type": "OrderedCollection",
+            "orderedItems": ["http://server.test/obj-1", "http://server.test/obj-2"],
+        }
+    )
+    await store.insert_item(outbox, "http://server.test/obj-0", first=True)
+    await store.insert_item(outbox, "http://server.test/obj-3")
+    assert await store.items(outbox, offset=1, limit=2) == [
+        "http://server.test/obj-1",
+        "http://server.test/obj-2",
+    ]
+    assert (await store.get(outbox))["orderedItems"] == [
+        f"http://server.test/obj-{i}" for i in range(4)
+    ]
+    await store.remove(outbox)
+    assert len(store.graph) == 0
+
+
+async def test_ordered_collection_delta_put():
+    store = RdfResourceStore(rdflib.Graph(), delta_writes=True, cache_size=10)
+    outbox = "http://server.test/outbox"
+    items = ["http://server.test/obj-1", "http://server.test/obj-2"]
+    collection = {"id": outbox, "type": "OrderedCollection", "orderedItems": items}
+    await store.put(collection)
+    assert await store.items(outbox) == items
+    assert (await store.get(outbox))["orderedItems"] == items
+    # Only the list entries change
+    items = [*items, "http://server.test/obj-3"]
+    await store.put(collection | {"orderedItems": items})
+    assert await store.items(outbox) == items
+    assert (await store.get(outbox))["orderedItems"] == items
+
+
+async def test_group_commit():
+    store = RdfResourceStore(rdflib.Graph(), group_commit=0.01)
+    ids = [f"http://server.test/obj-{i}" for i in range(5)]
+    await asyncio.gather(
+        *(store.put({"id": id_, "type": "Note", "name": id_}) for id_ in ids),
+        store.remove(ids[0]),
+    )
+    assert not await store.is_stored(ids[0])
+    assert (await store.get(ids[1]))["name"] == ids[1]
+    # Reads wait for pending writes of the same URI
+    write = asyncio.ensure_future(
+        store.put({"id": ids[2], "type": "Note", "name": "Updated"})
+    )
+    await asyncio.sleep(0)
+    assert (await store.get(ids[2]))["name"] == "Updated"
+    await write
+    stats = store.write_queue.stats()
+    assert (stats.batches, stats.operations) == (2, 7)
+
+
+async def test_group_commit_query_reads_pending_writes():
+    store = RdfResourceStore(rdflib.Graph(), group_commit=10)
+    write = asyncio.ensure_future(
+        store.put({"id": "http://server.test/obj-1", "type": "Note", "name": "New"})
+    )
+    await asyncio.sleep(0)
+    matches = await asyncio.wait_for(store.query({"type": "Note"}), 1)
+    assert [match["name"] for match in matches] == ["New"]
+    await write
+
+
+async def test_query_reads_results_in_batches():
+    executor = StoreExecutor()
+    store = RdfResourceStore(rdflib.Graph(), executor=executor, batch_size=2)
+    for i in range(5):
+        await store.put({"id": f"http://server.test/obj-{i}", "type": "Note"})
+    reads = executor.stats()["reads"].completed
+    assert len(await store.query({"type": "Note"})) == 5
+    # One read to match the criteria and one per batch of results
+    assert executor.stats()["reads"].completed - reads == 4
+    executor.shutdown()
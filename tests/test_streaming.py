@@ -0,0 +1,227 @@
+import asyncio
+import csv
+import io
+import itertools
+import json
+
+import pytest
+import rdflib
+from rdflib import Literal
+from starlette.applications import Starlette
+from starlette.routing import Route
+from starlette.testclient import TestClient
+
+from firm_ld.cache import QueryCache
+from firm_ld.streaming import (
+    BudgetProcessor,
+    QueryBudget,
+    QueryTimeout,
+    ResultResponse,
+    ResultStream,
+    query_stream_endpoint,
+)
+
+EX = rdflib.Namespace("https://server.test/")
+
+SELECT = "SELECT ?s ?o WHERE { ?s <https://server.test/p> ?o } ORDER BY ?o"
+
+
+class FakeTimer:
+    def __init__(self, step):
+        self.now = 0.0
+        self.step = step
+
+    def __call__(self):
+        self.now += self.step
+        return self.now
+
+
+def make_graph(count=10):
+    graph = rdflib.Graph()
+    for n in range(count):
+        graph.add((EX[f"s{n}"], EX.p, Literal(n)))
+        graph.add((EX[f"s{n}"], EX.label, Literal(f"label {n}", lang="en")))
+    return graph
+
+
+def make_client(graph, **kwargs):
+    endpoint = query_stream_endpoint(graph, **kwargs)
+    app = Starlette(routes=[Route("/stream", endpoint, methods=["GET", "POST"])])
+    return TestClient(app)
+
+
+def test_select_json():
+    client = make_client(make_graph())
+    response = client.get("/stream", params={"query": SELECT})
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "application/sparql-results+json"
+    results = response.json()
+    assert results["head"]["vars"] == ["s", "o"]
+    bindings = results["results"]["bindings"]
+    assert len(bindings) == 10
+    assert bindings[0] == {
+        "s": {"type": "uri", "value": str(EX.s0)},
+        "o": {
+            "type": "literal",
+            "value": "0",
+            "datatype": "http://www.w3.org/2001/XMLSchema#integer",
+        },
+    }
+    assert results["truncated"] is False
+
+
+def test_select_csv_row_limit():
+    client = make_client(make_graph(), max_rows=5)
+    response = client.post(
+        "/stream",
+        data={"query": SELECT},
+        headers={"accept": "text/csv"},
+        params={"max_rows": 3},
+    )
+    assert response.headers["content-type"].startswith("text/csv")
+    assert response.headers["x-query-row-limit"] == "3"
+    rows = list(csv.reader(io.StringIO(response.text)))
+    assert rows == [
+        ["s", "o"],
+        [str(EX.s0), "0"],
+        [str(EX.s1), "1"],
+        [str(EX.s2), "2"],
+        ["# truncated"],
+    ]
+
+
+def test_construct_streamed():
+    client = make_client(make_graph(), max_rows=4)
+    response = client.post(
+        "/stream",
+        content="CONSTRUCT { ?s <https://server.test/q> ?o } "
+        "WHERE { ?s <https://server.test/p> ?o }",
+        headers={"content-type": "application/sparql-query"},
+    )
+    assert response.headers["content-type"].startswith("application/n-triples")
+    lines = response.text.splitlines()
+    assert lines[-1] == "# truncated"
+    graph = rdflib.Graph().parse(data=response.text, format="nt")
+    assert len(graph) == 4
+    assert set(graph.predicates()) == {EX.q}
+
+
+def test_unlimited_headers():
+    response = make_client(make_graph()).get("/stream", params={"query": SELECT})
+    assert "x-query-timeout" not in response.headers
+    assert "x-query-row-limit" not in response.headers
+
+
+class FailingGraph(rdflib.Graph):
+    def triples(self, triple):
+        yield from itertools.islice(super().triples(triple), 2)
+        raise ValueError("Bad value")
+
+
+def test_evaluation_error():
+    graph = FailingGraph()
+    graph += make_graph()
+    query = rdflib.plugins.sparql.prepareQuery(SELECT.replace(" ORDER BY ?o", ""))
+    results = json.loads(b"".join(ResultStream(graph, query, QueryBudget(), "json")))
+    assert len(results["results"]["bindings"]) == 2
+    assert results["truncated"] is True
+    assert results["error"] == "ValueError: Bad value"
+    lines = b"".join(ResultStream(graph, query, QueryBudget(), "csv"))
+    assert lines.decode().splitlines()[-2:] == [
+        "# error: ValueError: Bad value",
+        "# truncated",
+    ]
+
+
+def test_budget_processor():
+    graph = make_graph()
+    processor = BudgetProcessor(graph, max_rows=3)
+    assert len(graph.query(SELECT, processor=processor)) == 3
+    construct = "CONSTRUCT { ?s <https://server.test/q> ?o } WHERE { ?s ?p ?o }"
+    assert len(graph.query(construct, processor=processor).graph) == 3
+    processor = BudgetProcessor(graph, timeout=-1)
+    with pytest.raises(QueryTimeout):
+        graph.query(SELECT, processor=processor)
+
+
+def test_budget_hook_only_registered_while_evaluating():
+    custom_evals = rdflib.plugins.sparql.CUSTOM_EVALS
+    assert "firm_ld.budget" not in custom_evals
+    query = rdflib.plugins.sparql.prepareQuery(SELECT)
+    chunks = iter(ResultStream(make_graph(), query, QueryBudget(), "json", None, 1))
+    next(chunks)
+    assert "firm_ld.budget" in custom_evals
+    b"".join(chunks)
+    assert "firm_ld.budget" not in custom_evals
+    graph = make_graph()
+    graph.query(SELECT, processor=BudgetProcessor(graph, max_rows=3))
+    assert "firm_ld.budget" not in custom_evals
+
+
+def test_ask_and_bad_query():
+    client = make_client(make_graph())
+    response = client.get("/stream", params={"query": "ASK { ?s ?p 3 }"})
+    assert response.json() == {"head": {}, "boolean": True}
+    assert client.get("/stream", params={"query": "SELECT ?s"}).status_code == 400
+    assert client.get("/stream").status_code == 400
+
+
+def test_timeout():
+    graph = make_graph(50)
+    query = rdflib.plugins.sparql.prepareQuery(
+        "SELECT * WHERE { ?s <https://server.test/p> ?o . ?s ?p ?v }"
+    )
+    budget = QueryBudget(timeout=10, timer=FakeTimer(1))
+    stream = ResultStream(graph, query, budget, "json")
+    results = json.loads(b"".join(stream))
+    assert results["truncated"] is True
+    assert 0 < len(results["results"]["bindings"]) < 10
+    # The prepared query doesn't keep the budget
+    assert not hasattr(query.prologue, "budget")
+
+
+def test_prepared_query_cache():
+    graph = make_graph()
+    graph.query_cache = QueryCache()
+    client = make_client(graph)
+    for _ in range(2):
+        client.get("/stream", params={"query": SELECT})
+    assert graph.query_cache.stats()["plans"].hits == 1
+
+
+def test_truncated_trailer():
+    graph = make_graph()
+    query = rdflib.plugins.sparql.prepareQuery(SELECT)
+    response = ResultResponse(
+        ResultStream(graph, query, QueryBudget(max_rows=2), "json")
+    )
+    messages = []
+
+    async def receive():
+        await asyncio.sleep(10)
+
+    async def send(message):
+        messages.append(message)
+
+    scope = {"type": "http", "extensions": {"http.response.trailers": {}}}
+    asyncio.run(response(scope, receive, send))
+    start = messages[0]
+    assert start["trailers"] is True
+    assert (b"trailer", b"X-Query-Truncated, X-Query-Error") in start["headers"]
+    assert messages[-1] == {
+        "type": "http.response.trailers",
+        "headers": [(b"x-query-truncated", b"true")],
+        "more_trailers": False,
+    }
+    body = b"".join(m.get("body", b"") for m in messages)
+    assert len(json.loads(body)["results"]["bindings"]) == 2
+
+
+@pytest.mark.parametrize("timeout,expected", [(None, "5"), ("2", "2"), ("10", "5")])
+def test_requested_timeout(timeout, expected):
+    client = make_client(make_graph(), timeout=5)
+    params = {"query": SELECT}
+    if timeout:
+        params["timeout"] = timeout
+    response = client.get("/stream", params=params)
+    assert float(response.headers["x-query-timeout"]) == float(expected)
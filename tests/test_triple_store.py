@@ -0,0 +1,153 @@
+import random
+
+import pytest
+import rdflib
+from rdflib import RDF, BNode, Literal
+
+from firm_ld import triple_store
+from firm_ld.triple_store import CompactStore
+
+EX = rdflib.Namespace("https://server.test/")
+
+
+@pytest.fixture(params=[False, True])
+def small_merges(request, monkeypatch):
+    # Exercise both the delta and the merged indexes
+    if request.param:
+        monkeypatch.setattr(triple_store, "MERGE_MIN", 4)
+    return request.param
+
+
+def make_triples(count):
+    return [
+        (EX[f"s{n % 7}"], EX[f"p{n % 3}"], Literal(n % 11) if n % 2 else EX[f"o{n}"])
+        for n in range(count)
+    ]
+
+
+def test_patterns_match_memory(small_merges):
+    memory = rdflib.Graph()
+    graph = rdflib.Graph(store=CompactStore())
+    triples = make_triples(100)
+    for triple in triples:
+        memory.add(triple)
+        graph.add(triple)
+    for triple in triples[::3]:
+        memory.remove(triple)
+        graph.remove(triple)
+    graph.add(triples[0])
+    memory.add(triples[0])
+    assert len(graph) == len(memory)
+    terms = [None, EX.s1, EX.p2, Literal(3), EX.o10, EX.missing]
+    for s in terms:
+        for p in terms:
+            for o in terms:
+                assert set(graph.triples((s, p, o))) == set(
+                    memory.triples((s, p, o))
+                ), (s, p, o)
+
+
+def test_random_operations(small_merges):
+    rng = random.Random(1)
+    memory = rdflib.Graph()
+    graph = rdflib.Graph(store=CompactStore())
+    for _ in range(2000):
+        triple = (EX[f"s{rng.randrange(20)}"], EX.p, Literal(rng.randrange(20)))
+        if rng.random() < 0.6:
+            memory.add(triple)
+            graph.add(triple)
+        else:
+            memory.remove(triple)
+            graph.remove(triple)
+    assert set(graph) == set(memory)
+    assert len(graph) == len(memory)
+    graph.store.compact()
+    assert set(graph.triples((None, EX.p, Literal(3)))) == set(
+        memory.triples((None, EX.p, Literal(3)))
+    )
+
+
+def test_named_graphs():
+    dataset = rdflib.Dataset(store=CompactStore())
+    named = dataset.graph(EX.g1)
+    dataset.add((EX.a, RDF.type, EX.Note))
+    named.add((EX.a, RDF.type, EX.Note))
+    named.add((EX.b, RDF.type, EX.Note))
+    dataset.graph(EX.empty)
+    assert len(dataset.default_context) == 1
+    assert len(named) == 2
+    assert {g.identifier for g in dataset.contexts()} >= {EX.g1, EX.empty}
+    assert {
+        g.identifier for g in dataset.store.contexts((EX.a, RDF.type, EX.Note))
+    } == {
+        rdflib.graph.DATASET_DEFAULT_GRAPH_ID,
+        EX.g1,
+    }
+    # The union of the graphs has each triple once
+    assert len(list(dataset.store.triples((None, RDF.type, None)))) == 2
+    assert len(dataset.store) == 2
+    assert sorted(q[3] for q in dataset.quads((EX.a, None, None, None))) == sorted(
+        [rdflib.graph.DATASET_DEFAULT_GRAPH_ID, EX.g1]
+    )
+    dataset.remove_graph(named)
+    assert EX.g1 not in {g.identifier for g in dataset.contexts()}
+    assert len(dataset.store) == 1
+    # Reading or removing unknown graphs doesn't add terms
+    store = dataset.store
+    terms = len(store._terms)
+    unknown = rdflib.Graph(store=store, identifier=EX.unknown)
+    assert list(store.triples((None, None, None), unknown)) == []
+    assert store.__len__(unknown) == 0
+    store.remove((None, None, None), unknown)
+    store.remove_graph(unknown)
+    assert len(store._terms) == terms
+
+
+def test_sparql_and_parsing():
+    dataset = rdflib.Dataset(store=CompactStore())
+    dataset.parse(
+        data=f"""
+<{EX.a}> <{EX.name}> "A" <{EX.g}> .
+<{EX.a}> <{EX.knows}> _:b1 <{EX.g}> .
+_:b1 <{EX.name}> "B"@en <{EX.g}> .
+""",
+        format="nquads",
+    )
+    dataset.bind("ex", EX)
+    results = dataset.query(
+        "SELECT ?name WHERE { GRAPH ex:g { ex:a ex:knows/ex:name ?name } }"
+    )
+    assert [row.name for row in results] == [Literal("B", lang="en")]
+    assert dataset.namespace_manager.store.namespace("ex") == rdflib.URIRef(EX)
+    assert any(isinstance(s, BNode) for s in dataset.graph(EX.g).subjects())
+
+
+def test_plugin_registered():
+    pytest.importorskip("firm")
+    from firm_ld.store import RdfDataSet
+
+    RdfDataSet.configure("Compact", ["memory"])
+    try:
+        assert isinstance(RdfDataSet.VALUE.store, CompactStore)
+    finally:
+        RdfDataSet.close()
+
+
+def test_union_quads_match_memory(small_merges):
+    compact_dataset = rdflib.Dataset(store=CompactStore())
+    memory = rdflib.Dataset()
+    triples = make_triples(60)
+    for dataset in (compact_dataset, memory):
+        for n, triple in enumerate(triples):
+            # Triples are in one, two or three of the graphs
+            for g in range(n % 3 + 1):
+                dataset.graph(EX[f"g{(n + g) % 3}"]).add(triple)
+
+    def quads(dataset, pattern):
+        return sorted(dataset.quads((*pattern, None)))
+
+    for pattern in [(None, None, None), (EX.s1, None, None), (None, EX.p2, None)]:
+        assert quads(compact_dataset, pattern) == quads(memory, pattern)
+        assert len(list(compact_dataset.store.triples(pattern))) == len(
+            list(memory.store.triples(pattern))
+        )